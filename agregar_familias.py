@@ -1,5 +1,7 @@
 import sqlite3
 
+from familias import FAMILIAS_PRECIOS
+
 # Conectar a la base de datos
 conn = sqlite3.connect('database.db')
 cursor = conn.cursor()
@@ -11,39 +13,14 @@ try:
 except sqlite3.OperationalError:
     print("ℹ️ La columna 'familia' ya existe")
 
-# Función para determinar la familia
-def obtener_familia(modelo):
-    modelo_upper = modelo.upper()
-    
-    if 'COROLLA CROSS' in modelo_upper:
-        return 'COROLLA CROSS'
-    elif 'COROLLA' in modelo_upper:
-        return 'COROLLA'
-    elif 'HILUX' in modelo_upper:
-        return 'HILUX'
-    elif 'SW4' in modelo_upper:
-        return 'SW4'
-    elif 'YARIS' in modelo_upper and ('GR' in modelo_upper or 'GR-SPORT' in modelo_upper):
-        return 'YARIS GR'
-    elif 'YARIS' in modelo_upper:
-        return 'YARIS'
-    elif 'HIACE' in modelo_upper:
-        return 'HIACE'
-    elif 'LAND CRUISER' in modelo_upper:
-        return 'LAND CRUISER'
-    elif 'RAV' in modelo_upper:
-        return 'RAV 4'
-    else:
-        return 'OTROS'
-
 # Obtener todos los modelos
 cursor.execute("SELECT id, modelo FROM precios")
 modelos = cursor.fetchall()
 
-# Actualizar cada modelo con su familia
+# Clasificar todos los modelos de una vez y actualizar cada uno con su familia
+familias = FAMILIAS_PRECIOS.clasificar_serie([modelo for _, modelo in modelos])
 contador = 0
-for id_modelo, modelo in modelos:
-    familia = obtener_familia(modelo)
+for (id_modelo, modelo), familia in zip(modelos, familias):
     cursor.execute("UPDATE precios SET familia = ? WHERE id = ?", (familia, id_modelo))
     contador += 1
     print(f"{contador}. {modelo[:50]:<50} → {familia}")
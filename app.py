@@ -1,27 +1,44 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash, g, has_request_context, make_response
 import pandas as pd
+import numpy as np
+import hashlib
+import io
 import os
-from werkzeug.utils import secure_filename
+from contextlib import contextmanager
+from functools import wraps
 import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from itertools import chain
 from psycopg2 import IntegrityError as PgIntegrityError
-from db_config import get_db_connection as get_pg_connection, release_db_connection, init_connection_pool
+from psycopg2.extras import execute_values
+from db_config import get_db_connection as get_pg_connection, release_db_connection, init_connection_pool, get_pool_stats, copy_rows
 from dotenv import load_dotenv
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from auth import User, admin_required, module_permission_required, get_all_users, create_user, update_user, delete_user
+from descuentos import completar_precios, recalcular_precios_disponibles
+from serializacion import Filas, JSONProviderRapido, filas_dataframe, respuesta_json_stream
+from patentamientos import DATASETS_PATENTAMIENTOS, get_patentamientos_dataset, normalizar_mes, ruta_csv
+from cache_columnar import clave_archivo
+from retail import (
+    DATOS_MENSUALES, NOMBRES_TIPOS, dia_del_anio, porcentaje_esperado, ventas_acumuladas_por_dia, ventas_por_familia
+)
+from cache_compartido import CacheCompartida
+from tareas import COMPLETADA, ERROR, ColaTareas, sin_avance
+from carga_bi import TABLAS_BI, cargar_tablas_bi, parsear_planillas
+from planilla_fabrica import leer_planilla, normalizar_planilla, precios_desde_filas, aplicar_precios_planilla
 from time import time
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Caché global para datos de patentamientos
-patentamientos_cache = {
-    'data': None,
-    'timestamp': 0,
-    'ttl': 1800  # 30 minutos de caché
-}
+# Caché de patentamientos compartida por todos los workers (30 minutos)
+patentamientos_cache = CacheCompartida('patentamientos', ttl=1800)
 
 app = Flask(__name__)
+app.json = JSONProviderRapido(app)  # orjson (si está instalado) para todas las respuestas JSON
+
+# Procesos largos (uploads) en segundo plano, cada uno con su app context (y su conexión del pool)
+tareas = ColaTareas('tareas', ttl=3600, contexto=app.app_context)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'clave-secreta-por-defecto-cambiar')
@@ -40,7 +57,14 @@ def load_user(user_id):
 
 @app.after_request
 def add_header(response):
-    """Agregar headers para deshabilitar caché completamente"""
+    """Agregar headers para deshabilitar caché completamente.
+
+    Las respuestas de catálogos versionados (con ETag) se pueden guardar en el
+    navegador, pero siempre se revalidan.
+    """
+    if g.get('respuesta_revalidable'):
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '-1'
@@ -194,6 +218,17 @@ def api_delete_user(user_id):
     return jsonify(result)
 
 
+@app.route('/api/admin/pool', methods=['GET'])
+@login_required
+@admin_required
+def api_pool_stats():
+    """Métricas del pool de conexiones (en uso, esperas, timeouts)"""
+    stats = get_pool_stats()
+    if stats is None:
+        return jsonify({'success': False, 'error': 'Pool de conexiones no inicializado'}), 503
+    return jsonify({'success': True, 'pool': stats})
+
+
 # ==================== RUTAS PRINCIPALES ====================
 
 # Ruta raíz: redirigir a login si no está autenticado, o a home si ya lo está
@@ -274,8 +309,158 @@ def bi_recaudacion():
 # ==================== FUNCIONES DE BASE DE DATOS ====================
 
 def get_db_connection():
-    """Crear conexión a la base de datos PostgreSQL"""
-    return get_pg_connection()
+    """Obtener la conexión PostgreSQL del contexto actual.
+
+    Se pide al pool una sola vez por request (o app context) y se devuelve
+    en el teardown, así ninguna ruta puede perderla ni liberarla dos veces.
+    """
+    conn = g.get('db_conn')
+    if conn is None:
+        origen = request.endpoint if has_request_context() else 'app_context'
+        conn = get_pg_connection(origen=origen)
+        g.db_conn = conn
+    return conn
+
+
+@contextmanager
+def db_transaction():
+    """Cursor en una transacción: commit al salir del bloque, rollback si hay excepción"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        yield cursor
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+@app.teardown_appcontext
+def release_request_connection(exc):
+    """Devolver al pool la conexión del contexto (el pool hace rollback si quedó abierta)"""
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        release_db_connection(conn)
+
+
+# ==================== CATÁLOGOS VERSIONADOS (ETag) ====================
+
+# Subir si cambia el formato de alguna respuesta versionada: invalida los ETags ya emitidos
+VERSION_CATALOGOS = 1
+
+
+_versionado_instalado = False
+
+
+def version_tabla(tabla):
+    """Versión de `tabla` según versiones_tablas (contador que incrementan sus triggers).
+
+    Devuelve None si el versionado no está instalado para la tabla
+    (instalar_versionado en los scripts init_*): sin versión no hay ETag.
+    """
+    global _versionado_instalado
+    cursor = get_db_connection().cursor()
+    if not _versionado_instalado:
+        # Consultar una tabla inexistente abortaría la transacción del request
+        cursor.execute("SELECT to_regclass('versiones_tablas') IS NOT NULL AS instalado")
+        if not cursor.fetchone()['instalado']:
+            return None
+        _versionado_instalado = True
+    cursor.execute('SELECT version FROM versiones_tablas WHERE tabla = %s', (tabla,))
+    fila = cursor.fetchone()
+    return None if fila is None else fila['version']
+
+
+def catalogo_versionado(tabla):
+    """GET con ETag según la versión de `tabla` y 304 Not Modified si el cliente ya la tiene.
+
+    La versión se lee antes que los datos: si cambian en el medio, el ETag
+    queda viejo y el próximo pedido trae todo de nuevo (nunca al revés).
+    Sin versionado instalado la respuesta sale completa y sin caché, como antes.
+    """
+    def decorador(f):
+        @wraps(f)
+        def envoltura(*args, **kwargs):
+            try:
+                version = version_tabla(tabla)
+            except Exception as e:
+                print(f"Error leyendo la versión de {tabla}: {e}")
+                return jsonify({'success': False, 'error': str(e)}), 500
+            if version is None:
+                return f(*args, **kwargs)
+            etag = hashlib.sha1(
+                f'{VERSION_CATALOGOS}|{request.full_path}|{tabla}|{version}'.encode('utf-8')
+            ).hexdigest()
+            
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            g.respuesta_revalidable = True
+            return response
+        return envoltura
+    return decorador
+
+
+# ==================== TAREAS EN SEGUNDO PLANO ====================
+
+def pedido_asincronico():
+    """El cliente pidió procesar en segundo plano (?async=true)"""
+    return request.args.get('async', 'false').lower() == 'true'
+
+
+def respuesta_tarea(tarea_id):
+    """202 Accepted con el id de la tarea y dónde consultar su progreso"""
+    url_estado = url_for('get_tarea', tarea_id=tarea_id)
+    respuesta = jsonify({
+        'success': True,
+        'tarea_id': tarea_id,
+        'estado_url': url_estado,
+        'resultado_url': url_for('get_tarea_resultado', tarea_id=tarea_id)
+    })
+    respuesta.headers['Location'] = url_estado
+    return respuesta, 202
+
+
+def tarea_del_usuario(tarea_id):
+    """Estado de la tarea si existe y es del usuario actual (o es admin); None si no"""
+    estado = tareas.estado(tarea_id)
+    if estado is None or (estado['usuario'] != current_user.id and not current_user.is_admin()):
+        return None
+    return estado
+
+
+@app.route('/api/tareas/<tarea_id>', methods=['GET'])
+@login_required
+def get_tarea(tarea_id):
+    """Estado y progreso (0-100) de una tarea en segundo plano"""
+    estado = tarea_del_usuario(tarea_id)
+    if estado is None:
+        return jsonify({'success': False, 'error': 'Tarea no encontrada'}), 404
+    return jsonify({'success': True, **estado})
+
+
+@app.route('/api/tareas/<tarea_id>/resultado', methods=['GET'])
+@login_required
+def get_tarea_resultado(tarea_id):
+    """Resultado de una tarea completada (la misma respuesta que la ruta sincrónica); 202 si sigue en proceso"""
+    estado = tarea_del_usuario(tarea_id)
+    if estado is None:
+        return jsonify({'success': False, 'error': 'Tarea no encontrada'}), 404
+    if estado['estado'] == ERROR:
+        return jsonify({'success': False, 'error': estado['error']}), 500
+    if estado['estado'] != COMPLETADA:
+        return jsonify({'success': True, **estado}), 202
+    
+    resultado = tareas.resultado(tarea_id)
+    if resultado is None:
+        return jsonify({'success': False, 'error': 'El resultado de la tarea ya no está disponible'}), 410
+    return respuesta_json_stream(resultado)
 
 
 # Módulo 1: Lista de precios
@@ -289,13 +474,11 @@ def modulo1():
 @app.route('/api/precios', methods=['GET'])
 @login_required
 @module_permission_required('planeamiento')
+@catalogo_versionado('precios')
 def get_precios():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
     cursor.execute('SELECT modelo, precio_ars, precio_usd, cotizacion, descuento, descuento_futuro, visible, dado_baja, familia FROM precios ORDER BY familia, modelo')
     rows = cursor.fetchall()
-    conn.rollback()
-    release_db_connection(conn)
     
     modelos = []
     modelos_ocultos = []
@@ -326,34 +509,56 @@ def get_precios():
 @login_required
 @module_permission_required('planeamiento')
 def save_precios():
+    """Guardar precios y visibilidad de todos los modelos.
+
+    Los precios van en un solo UPDATE ... FROM (VALUES ...) y la visibilidad en
+    otro; solo se escriben las filas cuyos valores cambian.
+    """
     data = request.json
-    conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
-        # Actualizar precios de TODOS los modelos (convencionales y SC)
-        for modelo in data.get('modelos', []):
+        with db_transaction() as cursor:
+            # Precios de TODOS los modelos (convencionales y SC); si un modelo viene repetido vale el último
+            valores = list({
+                modelo['nombre']: (
+                    modelo['nombre'], modelo['precio_ars'], modelo['precio_usd'], modelo['cotizacion'],
+                    modelo['descuento'], modelo.get('descuento_futuro', 0), modelo.get('dado_baja', 0)
+                )
+                for modelo in data.get('modelos', [])
+            }.values())
+            precios_actualizados = 0
+            if valores:
+                execute_values(cursor, '''
+                    UPDATE precios AS p
+                    SET precio_ars = v.precio_ars, precio_usd = v.precio_usd, cotizacion = v.cotizacion,
+                        descuento = v.descuento, descuento_futuro = v.descuento_futuro, dado_baja = v.dado_baja,
+                        fecha_actualizacion = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS v(modelo, precio_ars, precio_usd, cotizacion, descuento, descuento_futuro, dado_baja)
+                    WHERE p.modelo = v.modelo
+                      AND (p.precio_ars, p.precio_usd, p.cotizacion, p.descuento, p.descuento_futuro, p.dado_baja)
+                          IS DISTINCT FROM
+                          (v.precio_ars, v.precio_usd, v.cotizacion, v.descuento, v.descuento_futuro, v.dado_baja)
+                ''', valores, template='(%s::text, %s::real, %s::real, %s::real, %s::real, %s::real, %s::integer)',
+                   page_size=len(valores))
+                precios_actualizados = cursor.rowcount
+            
+            # Visibilidad: ocultos los de la lista, visibles el resto
             cursor.execute('''
-                UPDATE precios 
-                SET precio_ars = %s, precio_usd = %s, cotizacion = %s, descuento = %s, descuento_futuro = %s, dado_baja = %s, fecha_actualizacion = CURRENT_TIMESTAMP
-                WHERE modelo = %s
-            ''', (modelo['precio_ars'], modelo['precio_usd'], modelo['cotizacion'], modelo['descuento'], modelo.get('descuento_futuro', 0), modelo.get('dado_baja', 0), modelo['nombre']))
-        
-        # Actualizar visibilidad
-        # Primero poner todos como visibles
-        cursor.execute('UPDATE precios SET visible = 1')
-        
-        # Luego ocultar los que están en la lista
-        for modelo_oculto in data.get('modelos_ocultos', []):
-            cursor.execute('UPDATE precios SET visible = 0 WHERE modelo = %s', (modelo_oculto,))
-        
-        conn.commit()
-        release_db_connection(conn)
+                UPDATE precios
+                SET visible = CASE WHEN modelo = ANY(%(ocultos)s) THEN 0 ELSE 1 END,
+                    fecha_actualizacion = CURRENT_TIMESTAMP
+                WHERE visible IS DISTINCT FROM CASE WHEN modelo = ANY(%(ocultos)s) THEN 0 ELSE 1 END
+            ''', {'ocultos': list(data.get('modelos_ocultos', []))})
+            visibilidad_actualizada = cursor.rowcount
+            # Los precios de disponibles no dependen de esta tabla: no hace falta recalcularlos
         
-        return jsonify({'success': True})
+        print(f"💾 Precios guardados: {precios_actualizados} con cambios de precio, {visibilidad_actualizada} de visibilidad")
+        return jsonify({
+            'success': True,
+            'precios_actualizados': precios_actualizados,
+            'visibilidad_actualizada': visibilidad_actualizada
+        })
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # API para aplicar descuento por familia
@@ -368,35 +573,31 @@ def aplicar_descuento_familia():
     if not familia:
         return jsonify({'success': False, 'error': 'Familia no especificada'}), 400
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Contar modelos afectados
-        cursor.execute('SELECT COUNT(*) as total FROM precios WHERE familia = %s', (familia,))
-        total = cursor.fetchone()['total']
-        
-        # Aplicar descuento
-        cursor.execute('UPDATE precios SET descuento = %s WHERE familia = %s', (descuento, familia))
-        conn.commit()
-        release_db_connection(conn)
+        with db_transaction() as cursor:
+            # Contar modelos afectados
+            cursor.execute('SELECT COUNT(*) as total FROM precios WHERE familia = %s', (familia,))
+            total = cursor.fetchone()['total']
+            
+            # Aplicar descuento
+            cursor.execute(
+                'UPDATE precios SET descuento = %s, fecha_actualizacion = CURRENT_TIMESTAMP WHERE familia = %s',
+                (descuento, familia)
+            )
         
         return jsonify({'success': True, 'modelos_actualizados': total})
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # API para obtener descuentos adicionales
 @app.route('/api/descuentos_adicionales', methods=['GET'])
 @login_required
 @module_permission_required('planeamiento')
+@catalogo_versionado('descuentos_adicionales')
 def get_descuentos_adicionales():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
     cursor.execute('SELECT tipo, clave, valor FROM descuentos_adicionales')
     rows = cursor.fetchall()
-    release_db_connection(conn)
     
     descuentos = {}
     for row in rows:
@@ -412,25 +613,23 @@ def get_descuentos_adicionales():
 @module_permission_required('planeamiento')
 def save_descuentos_adicionales():
     data = request.json
-    conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
-        for tipo, valores in data.items():
-            for clave, valor in valores.items():
-                cursor.execute('''
-                    INSERT INTO descuentos_adicionales (tipo, clave, valor, fecha_actualizacion)
-                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT (tipo, clave) 
-                    DO UPDATE SET valor = EXCLUDED.valor, fecha_actualizacion = CURRENT_TIMESTAMP
-                ''', (tipo, clave, valor))
+        with db_transaction() as cursor:
+            for tipo, valores in data.items():
+                for clave, valor in valores.items():
+                    cursor.execute('''
+                        INSERT INTO descuentos_adicionales (tipo, clave, valor, fecha_actualizacion)
+                        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                        ON CONFLICT (tipo, clave) 
+                        DO UPDATE SET valor = EXCLUDED.valor, fecha_actualizacion = CURRENT_TIMESTAMP
+                    ''', (tipo, clave, valor))
+            
+            # Los descuentos adicionales cambian el precio final de las unidades
+            recalcular_precios_disponibles(cursor)
         
-        conn.commit()
-        release_db_connection(conn)
         return jsonify({'success': True})
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # API para obtener unidades postergadas
@@ -438,11 +637,9 @@ def save_descuentos_adicionales():
 @login_required
 @module_permission_required('planeamiento')
 def get_unidades_postergadas():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
     cursor.execute('SELECT numero_fabrica FROM unidades_postergadas ORDER BY fecha_agregado DESC')
     rows = cursor.fetchall()
-    release_db_connection(conn)
     
     unidades = [row['numero_fabrica'] for row in rows]
     return jsonify(unidades)
@@ -458,21 +655,13 @@ def add_unidad_postergada():
     if not numero_fabrica:
         return jsonify({'success': False, 'error': 'Número de fábrica vacío'}), 400
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('INSERT INTO unidades_postergadas (numero_fabrica) VALUES (%s)', (numero_fabrica,))
-        conn.commit()
-        release_db_connection(conn)
+        with db_transaction() as cursor:
+            cursor.execute('INSERT INTO unidades_postergadas (numero_fabrica) VALUES (%s)', (numero_fabrica,))
         return jsonify({'success': True})
     except PgIntegrityError:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': 'Número de fábrica ya existe'}), 400
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # API para eliminar unidad postergada
@@ -480,17 +669,11 @@ def add_unidad_postergada():
 @login_required
 @module_permission_required('planeamiento')
 def delete_unidad_postergada(numero_fabrica):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('DELETE FROM unidades_postergadas WHERE numero_fabrica = %s', (numero_fabrica,))
-        conn.commit()
-        release_db_connection(conn)
+        with db_transaction() as cursor:
+            cursor.execute('DELETE FROM unidades_postergadas WHERE numero_fabrica = %s', (numero_fabrica,))
         return jsonify({'success': True})
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -509,15 +692,13 @@ def modulo2():
 @login_required
 @module_permission_required('planeamiento')
 def get_preventa():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
     cursor.execute('''
         SELECT id, numero_fabrica, modelo_version, operacion, vendedor, color, informado, cancelado, asignado 
         FROM preventa 
         ORDER BY id ASC
     ''')
     rows = cursor.fetchall()
-    release_db_connection(conn)
     
     preventa = []
     for row in rows:
@@ -541,46 +722,40 @@ def get_preventa():
 @module_permission_required('planeamiento')
 def save_preventa():
     data = request.json
-    conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
-        # Paso 1: Eliminar TODAS las unidades de preventa del módulo disponible
-        # Esto asegura que si la bitácora se limpia, el disponible también se limpia
-        cursor.execute('''
-            DELETE FROM disponibles 
-            WHERE numero_fabrica = 'YAC999999999'
-        ''')
-        print(f"🗑️ Unidades de preventa eliminadas del disponible")
-        
-        # Paso 2: Eliminar todos los registros de preventa
-        cursor.execute('DELETE FROM preventa')
-        
-        # Paso 3: Insertar nuevos registros (solo si hay datos)
-        if len(data) > 0:
-            for item in data:
-                cursor.execute('''
-                    INSERT INTO preventa (
-                        numero_fabrica, modelo_version, operacion, vendedor, color, informado, cancelado, asignado
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (
-                    'YAC999999999',  # Número de fábrica fijo para preventa
-                    item.get('modelo_version', ''),
-                    item.get('operacion', ''),
-                    item.get('vendedor', ''),
-                    item.get('color', ''),
-                    1 if item.get('informado') else 0,
-                    1 if item.get('cancelado') else 0,
-                    1 if item.get('asignado') else 0
-                ))
-        
-        conn.commit()
-        release_db_connection(conn)
+        with db_transaction() as cursor:
+            # Paso 1: Eliminar TODAS las unidades de preventa del módulo disponible
+            # Esto asegura que si la bitácora se limpia, el disponible también se limpia
+            cursor.execute('''
+                DELETE FROM disponibles 
+                WHERE numero_fabrica = 'YAC999999999'
+            ''')
+            print(f"🗑️ Unidades de preventa eliminadas del disponible")
+            
+            # Paso 2: Eliminar todos los registros de preventa
+            cursor.execute('DELETE FROM preventa')
+            
+            # Paso 3: Insertar nuevos registros (solo si hay datos)
+            if len(data) > 0:
+                for item in data:
+                    cursor.execute('''
+                        INSERT INTO preventa (
+                            numero_fabrica, modelo_version, operacion, vendedor, color, informado, cancelado, asignado
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    ''', (
+                        'YAC999999999',  # Número de fábrica fijo para preventa
+                        item.get('modelo_version', ''),
+                        item.get('operacion', ''),
+                        item.get('vendedor', ''),
+                        item.get('color', ''),
+                        1 if item.get('informado') else 0,
+                        1 if item.get('cancelado') else 0,
+                        1 if item.get('asignado') else 0
+                    ))
         
         return jsonify({'success': True, 'count': len(data), 'message': 'Bitácora guardada y disponible actualizado'})
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # API para convertir preventa sin vendedor a disponible
@@ -589,78 +764,73 @@ def save_preventa():
 @module_permission_required('planeamiento')
 def convertir_preventa_disponible():
     """Convierte unidades de preventa SIN vendedor al módulo disponible"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Paso 1: Limpiar TODAS las unidades de preventa anteriores del disponible
-        cursor.execute('''
-            DELETE FROM disponibles 
-            WHERE numero_fabrica = 'YAC999999999'
-        ''')
-        print(f"🗑️ Limpieza: Unidades de preventa anteriores eliminadas del disponible")
-        
-        # Paso 2: Obtener registros de preventa sin vendedor asignado
-        cursor.execute('''
-            SELECT numero_fabrica, modelo_version, operacion, color
-            FROM preventa
-            WHERE vendedor IS NULL OR vendedor = ''
-        ''')
-        preventas = cursor.fetchall()
-        
-        if len(preventas) == 0:
-            conn.commit()  # Confirmar la limpieza aunque no haya nada que agregar
-            release_db_connection(conn)
-            return jsonify({'success': True, 'count': 0, 'message': 'No hay unidades sin vendedor. Preventa anterior limpiada del disponible.'})
-        
-        # Calcular fecha de entrega estimada (3 meses adelante)
-        from datetime import datetime, timedelta
-        fecha_entrega = datetime.now() + timedelta(days=90)  # 3 meses
-        fecha_entrega_str = fecha_entrega.strftime('%Y-%m-%d')
-        
-        # Obtener precios de la base de datos
-        cursor.execute('SELECT modelo, precio_ars, descuento FROM precios')
-        precios_data = {}
-        for row in cursor.fetchall():
-            precios_data[row['modelo']] = {
-                'precio_ars': row['precio_ars'],
-                'descuento': row['descuento']
-            }
-        
-        # Insertar en disponibles
-        count = 0
-        for prev in preventas:
-            modelo = prev['modelo_version']
-            
-            # Obtener precio BASE (sin descuento)
-            # Los descuentos se aplicarán en el Módulo 4
-            precio = 0
-            if modelo in precios_data:
-                precio = precios_data[modelo]['precio_ars']
+        with db_transaction() as cursor:
+            # Paso 1: Limpiar TODAS las unidades de preventa anteriores del disponible
+            cursor.execute('''
+                DELETE FROM disponibles 
+                WHERE numero_fabrica = 'YAC999999999'
+            ''')
+            print(f"🗑️ Limpieza: Unidades de preventa anteriores eliminadas del disponible")
             
+            # Paso 2: Obtener registros de preventa sin vendedor asignado
             cursor.execute('''
-                INSERT INTO disponibles (
-                    numero_fabrica, modelo_version, color, ubicacion, 
-                    entrega_estimada, precio_disponible, operacion
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ''', (
-                prev['numero_fabrica'],  # Usar el número de fábrica de preventa (YAC999999999)
-                modelo,
-                prev['color'],
-                "Preventa",
-                fecha_entrega_str,
-                precio,
-                prev['operacion']
-            ))
-            count += 1
+                SELECT numero_fabrica, modelo_version, operacion, color
+                FROM preventa
+                WHERE vendedor IS NULL OR vendedor = ''
+            ''')
+            preventas = cursor.fetchall()
+            
+            # Calcular fecha de entrega estimada (3 meses adelante)
+            from datetime import datetime, timedelta
+            fecha_entrega = datetime.now() + timedelta(days=90)  # 3 meses
+            fecha_entrega_str = fecha_entrega.strftime('%Y-%m-%d')
+            
+            # Obtener precios de la base de datos
+            precios_data = {}
+            if preventas:
+                cursor.execute('SELECT modelo, precio_ars, descuento FROM precios')
+                for row in cursor.fetchall():
+                    precios_data[row['modelo']] = {
+                        'precio_ars': row['precio_ars'],
+                        'descuento': row['descuento']
+                    }
+            
+            # Insertar en disponibles
+            count = 0
+            for prev in preventas:
+                modelo = prev['modelo_version']
+                
+                # Obtener precio BASE (sin descuento)
+                # Los descuentos se aplicarán en el Módulo 4
+                precio = 0
+                if modelo in precios_data:
+                    precio = precios_data[modelo]['precio_ars']
+                
+                cursor.execute('''
+                    INSERT INTO disponibles (
+                        numero_fabrica, modelo_version, color, ubicacion, 
+                        entrega_estimada, precio_disponible, operacion
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ''', (
+                    prev['numero_fabrica'],  # Usar el número de fábrica de preventa (YAC999999999)
+                    modelo,
+                    prev['color'],
+                    "Preventa",
+                    fecha_entrega_str,
+                    precio,
+                    prev['operacion']
+                ))
+                count += 1
+            
+            recalcular_precios_disponibles(cursor, numeros_fabrica=['YAC999999999'])
         
-        conn.commit()
-        release_db_connection(conn)
+        if count == 0:
+            # La limpieza se confirma aunque no haya nada que agregar
+            return jsonify({'success': True, 'count': 0, 'message': 'No hay unidades sin vendedor. Preventa anterior limpiada del disponible.'})
         
         return jsonify({'success': True, 'count': count, 'message': f'{count} unidades de preventa agregadas a disponible'})
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -676,6 +846,7 @@ def modulo3():
 @login_required
 @module_permission_required('planeamiento')
 def procesar_excel():
+    """Procesar la planilla de fábrica; con ?async=true se procesa en segundo plano (202 + id de tarea)"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No se encontró ningún archivo'}), 400
@@ -688,273 +859,125 @@ def procesar_excel():
         if not allowed_file(file.filename):
             return jsonify({'error': 'Tipo de archivo no permitido. Use .xlsx o .xls'}), 400
         
-        # Obtener lista de unidades postergadas desde la base de datos
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT numero_fabrica FROM unidades_postergadas')
-        rows = cursor.fetchall()
-        release_db_connection(conn)
-        
-        unidades_postergadas = [row['numero_fabrica'] for row in rows]
-        print(f"Unidades postergadas desde BD: {unidades_postergadas}")
-        
-        # Guardar archivo temporalmente
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Debug: verificar permisos y ruta
-        print(f"📁 Intentando guardar en: {filepath}")
-        print(f"📁 Directorio uploads existe: {os.path.exists(app.config['UPLOAD_FOLDER'])}")
-        print(f"📁 Permisos del directorio: {oct(os.stat(app.config['UPLOAD_FOLDER']).st_mode)}")
+        if pedido_asincronico():
+            # El stream del upload se cierra con el request: la tarea recibe una copia en memoria
+            tarea_id = tareas.encolar('procesar_excel', procesar_planilla_fabrica, io.BytesIO(file.stream.read()),
+                                      file.filename, usuario=current_user.id)
+            return respuesta_tarea(tarea_id)
         
-        try:
-            file.save(filepath)
-            print(f"✅ Archivo guardado exitosamente en {filepath}")
-        except Exception as save_error:
-            print(f"❌ Error al guardar archivo: {save_error}")
-            return jsonify({'error': f'Error al guardar archivo: {str(save_error)}'}), 500
-        
-        # Leer el archivo Excel
-        df = pd.read_excel(filepath, header=None)
-        
-        # Paso 1: Eliminar las primeras 8 filas
-        df = df.iloc[8:]
-        
-        # Paso 2: Eliminar la columna C (índice 2, ya que comienza en 0)
-        if df.shape[1] > 2:  # Verificar que existe la columna C
-            df = df.drop(df.columns[2], axis=1)
-        
-        # Paso 3: Eliminar filas completamente vacías
-        df = df.dropna(how='all')
-        
-        # Paso 4: Ordenar por la primera columna (columna A)
-        df = df.sort_values(by=df.columns[0], ascending=True)
-        
-        # Resetear el índice
-        df = df.reset_index(drop=True)
-        
-        # Nombres de las columnas (primeras 15 columnas visibles)
-        column_names = [
-            'Nº Fábrica', 'Nº Chasis', 'Modelo/Versión', 'Color', 
-            'Fecha Finanzas', 'Despacho Estimado', 'Entrega Estimada',
-            'Fecha Recepción', 'Ubicación', 'Días Stock', 'Precio p/ Disponible',
-            'Cód. Cliente', 'Cliente', 'Vendedor', 'Operación'
-        ]
-        
-        # Asignar nombres a las primeras 15 columnas
-        for i in range(min(15, len(df.columns))):
-            df.rename(columns={df.columns[i]: column_names[i]}, inplace=True)
-        
-        # Calcular "Entrega Estimada" = "Despacho Estimado" + 1 mes
-        if 'Despacho Estimado' in df.columns:
-            # Convertir a datetime manejando errores
-            df['Despacho Estimado'] = pd.to_datetime(df['Despacho Estimado'], errors='coerce')
-            
-            # Rellenar valores vacíos con 31/12/2030
-            fecha_default = pd.Timestamp('2030-12-31')
-            df['Despacho Estimado'] = df['Despacho Estimado'].fillna(fecha_default)
-            
-            # Calcular Entrega Estimada sumando 1 mes
-            df['Entrega Estimada'] = df['Despacho Estimado'] + pd.DateOffset(months=1)
-        
-        # **NUEVO: Obtener precios de la base de datos y hacer match con Modelo/Versión ANTES DE CORTAR**
-        if 'Modelo/Versión' in df.columns and 'Precio p/ Disponible' in df.columns:
-            print("🔄 Haciendo match de precios desde la base de datos...")
-            
-            # Obtener todos los precios, descuentos individuales y descuentos futuros de la base de datos
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT modelo, precio_ars, descuento, descuento_futuro FROM precios')
-            precios_data = {}
-            for row in cursor.fetchall():
-                modelo = row['modelo']
-                precio_ars = row['precio_ars'] or 0
-                descuento = row['descuento'] or 0
-                descuento_futuro = row.get('descuento_futuro', 0) or 0
-                
-                precios_data[modelo] = {
-                    'precio_ars': precio_ars,
-                    'descuento': descuento,
-                    'descuento_futuro': descuento_futuro
-                }
-                
-                print(f"🔧 Cargado: {modelo[:40]:40} | Precio: ${precio_ars:,.0f} | Desc: {descuento}% | Desc.Futuro: {descuento_futuro}%")
-            
-            conn.rollback()
-            release_db_connection(conn)
-            
-            print(f"📊 Precios cargados: {len(precios_data)} modelos")
-            
-            # Obtener fecha actual para comparar
-            from datetime import datetime
-            hoy = datetime.now()
-            hoy_ym = (hoy.year, hoy.month)
-            
-            # Aplicar precio con descuento según fecha de DESPACHO
-            def calcular_precio_con_descuento(row):
-                modelo = row['Modelo/Versión']
-                despacho_estimado = row['Despacho Estimado']
-                numero_fabrica = row.get('Nº Fábrica', 'N/A')
-                
-                if pd.isna(modelo):
-                    print(f"⚠️ Modelo vacío, saltando...")
-                    return pd.Series({
-                        'Precio p/ Disponible': 0,
-                        'Precio Base': 0,
-                        'Descuento Aplicado (%)': 0
-                    })
-                
-                modelo_str = str(modelo).strip()
-                
-                # Buscar coincidencia exacta
-                if modelo_str not in precios_data:
-                    print(f"⚠️ Modelo '{modelo_str}' NO encontrado en precios_data")
-                    return pd.Series({
-                        'Precio p/ Disponible': 0,
-                        'Precio Base': 0,
-                        'Descuento Aplicado (%)': 0
-                    })
-                
-                precio_base = precios_data[modelo_str]['precio_ars']
-                descuento_individual = precios_data[modelo_str]['descuento']
-                descuento_futuro = precios_data[modelo_str]['descuento_futuro']
-                
-                print(f"🔍 {modelo_str[:40]:40} | Nº Fábrica: {numero_fabrica}")
-                print(f"   Precio Base: ${precio_base:,.0f}")
-                print(f"   Desc Individual: {descuento_individual}%")
-                print(f"   Desc Futuro: {descuento_futuro}%")
-                
-                # Determinar si es mes futuro o actual BASADO EN DESPACHO ESTIMADO
-                es_mes_actual_o_futuro = False
-                if not pd.isna(despacho_estimado):
-                    try:
-                        if isinstance(despacho_estimado, str):
-                            fecha_despacho = pd.to_datetime(despacho_estimado)
-                        else:
-                            fecha_despacho = despacho_estimado
-                        
-                        despacho_ym = (fecha_despacho.year, fecha_despacho.month)
-                        
-                        print(f"   Fecha Despacho: {despacho_ym} vs Hoy: {hoy_ym}")
-                        
-                        # Solo meses FUTUROS usan descuento_futuro (mes actual usa descuento_individual)
-                        if despacho_ym > hoy_ym:
-                            es_mes_actual_o_futuro = True
-                            print(f"   ✅ MES FUTURO -> usando descuento_futuro")
-                        else:
-                            print(f"   ⏸️ MES ACTUAL O ANTERIOR -> usando descuento_individual")
-                    except Exception as e:
-                        print(f"   ⚠️ Error procesando fecha: {e}")
-                        pass
-                
-                # Aplicar el descuento correspondiente
-                descuento_aplicar = descuento_futuro if es_mes_actual_o_futuro else descuento_individual
-                
-                # Calcular precio final
-                precio_final = precio_base * (1 - descuento_aplicar / 100)
-                
-                print(f"   💰 Descuento aplicado: {descuento_aplicar}% -> Precio Final: ${precio_final:,.0f}")
-                print("")
-                
-                return pd.Series({
-                    'Precio p/ Disponible': precio_final,
-                    'Precio Base': precio_base,
-                    'Descuento Aplicado (%)': descuento_aplicar
-                })
-            
-            # Aplicar la función y crear las tres columnas
-            resultado = df.apply(calcular_precio_con_descuento, axis=1)
-            df['Precio p/ Disponible'] = resultado['Precio p/ Disponible']
-            df['Precio Base'] = resultado['Precio Base']
-            df['Descuento Aplicado (%)'] = resultado['Descuento Aplicado (%)']
-            
-            # Contar cuántos precios se encontraron
-            precios_encontrados = (df['Precio p/ Disponible'] > 0).sum()
-            print(f"✅ Precios con descuento aplicados: {precios_encontrados} de {len(df)} registros")
-        
-        # Mantener solo las 15 columnas originales + 3 nuevas (18 total)
-        # Orden: 0-14 (originales) + 15,16,17 (Precio p/ Disponible, Precio Base, Descuento Aplicado)
-        columnas_a_mantener = [
-            'Nº Fábrica', 'Nº Chasis', 'Modelo/Versión', 'Color', 
-            'Fecha Finanzas', 'Despacho Estimado', 'Entrega Estimada',
-            'Fecha Recepción', 'Ubicación', 'Días Stock', 'Precio p/ Disponible',
-            'Cód. Cliente', 'Cliente', 'Vendedor', 'Operación',
-            'Precio Base', 'Descuento Aplicado (%)'
-        ]
-        # Solo mantener las columnas que existen
-        columnas_existentes = [col for col in columnas_a_mantener if col in df.columns]
-        df = df[columnas_existentes]
-        
-        print(f"📊 Columnas finales del DataFrame: {list(df.columns)}")
-        
-        # **Filtrar unidades postergadas ANTES de dividir por pestañas**
-        if unidades_postergadas and 'Nº Fábrica' in df.columns:
-            filas_antes = len(df)
-            # Convertir Nº Fábrica a string y eliminar espacios
-            df['Nº Fábrica'] = df['Nº Fábrica'].astype(str).str.strip()
-            # Filtrar las filas que NO estén en la lista de postergadas
-            df = df[~df['Nº Fábrica'].isin(unidades_postergadas)]
-            filas_despues = len(df)
-            print(f"Filtrado de unidades postergadas: {filas_antes} filas -> {filas_despues} filas ({filas_antes - filas_despues} eliminadas)")
-        
-        # Convertir la primera columna a string para el análisis de prefijos
-        df['Nº Fábrica'] = df['Nº Fábrica'].astype(str)
-        
-        # Separar por tipo de canal de venta según el prefijo de "Nº Fábrica"
-        tabs_data = []
-        
-        # Ventas Especiales (F)
-        df_ventas_especiales = df[df['Nº Fábrica'].str.startswith('F', na=False)].copy()
-        if not df_ventas_especiales.empty:
-            tabs_data.append({
-                'id': 'ventas-especiales',
-                'name': 'Ventas Especiales (F)',
-                'count': len(df_ventas_especiales),
-                'columns': list(df_ventas_especiales.columns),
-                'rows': df_ventas_especiales.where(pd.notnull(df_ventas_especiales), None).values.tolist()
-            })
-        
-        # Plan de Ahorro (TPA)
-        df_plan_ahorro = df[df['Nº Fábrica'].str.startswith('TPA', na=False)].copy()
-        if not df_plan_ahorro.empty:
-            tabs_data.append({
-                'id': 'plan-ahorro',
-                'name': 'Plan de Ahorro (TPA)',
-                'count': len(df_plan_ahorro),
-                'columns': list(df_plan_ahorro.columns),
-                'rows': df_plan_ahorro.where(pd.notnull(df_plan_ahorro), None).values.tolist()
-            })
-        
-        # Ventas Convencionales (YAC)
-        df_ventas_convencionales = df[df['Nº Fábrica'].str.startswith('YAC', na=False)].copy()
-        if not df_ventas_convencionales.empty:
-            tabs_data.append({
-                'id': 'ventas-convencionales',
-                'name': 'Ventas Convencionales (YAC)',
-                'count': len(df_ventas_convencionales),
-                'columns': list(df_ventas_convencionales.columns),
-                'rows': df_ventas_convencionales.where(pd.notnull(df_ventas_convencionales), None).values.tolist()
-            })
-        
-        # No incluir la pestaña "Otros" - comentado para simplificar
-        # df_otros = df[~df['Nº Fábrica'].str.match(r'^(F|TPA|YAC)', na=False)].copy()
-        
-        # Eliminar archivo temporal
-        os.remove(filepath)
-        
-        return jsonify({
-            'success': True,
-            'tabs': tabs_data,
-            'total_rows': len(df)
-        })
+        # Las filas de cada pestaña se serializan mientras se envían
+        return respuesta_json_stream(procesar_planilla_fabrica(sin_avance, file.stream, file.filename))
     
     except Exception as e:
-        # Limpiar archivo si existe
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
         return jsonify({'error': f'Error al procesar el archivo: {str(e)}'}), 500
 
 
+def procesar_planilla_fabrica(avance, archivo, filename):
+    """Planilla de fábrica -> pestañas por canal de venta, con precios y sin unidades postergadas"""
+    # Obtener lista de unidades postergadas desde la base de datos
+    cursor = get_db_connection().cursor()
+    cursor.execute('SELECT numero_fabrica FROM unidades_postergadas')
+    rows = cursor.fetchall()
+    
+    unidades_postergadas = [row['numero_fabrica'] for row in rows]
+    print(f"Unidades postergadas desde BD: {unidades_postergadas}")
+    
+    # Leer el Excel desde memoria y normalizarlo (encabezados, columna C, orden, entrega estimada)
+    avance(10, 'Leyendo planilla')
+    inicio = time()
+    df = normalizar_planilla(leer_planilla(archivo))
+    print(f"📖 Planilla '{filename}' leída: {len(df)} filas en {time() - inicio:.2f}s")
+    
+    # Precio con descuento según fecha de DESPACHO, para todas las filas a la vez
+    avance(60, 'Calculando precios')
+    if 'Modelo/Versión' in df.columns and 'Precio p/ Disponible' in df.columns:
+        cursor.execute('SELECT modelo, precio_ars, descuento, descuento_futuro FROM precios')
+        precios = precios_desde_filas(cursor.fetchall())
+        print(f"📊 Precios cargados: {len(precios)} modelos")
+        
+        resumen = aplicar_precios_planilla(df, precios)
+        print(f"✅ Precios con descuento aplicados: {resumen['con_precio']} de {resumen['filas']} registros "
+              f"({resumen['con_descuento_futuro']} con descuento futuro)")
+        if resumen['modelos_vacios']:
+            print(f"⚠️ {resumen['modelos_vacios']} filas sin modelo")
+        if resumen['modelos_sin_precio']:
+            print(f"⚠️ {len(resumen['modelos_sin_precio'])} modelos sin precio: {resumen['modelos_sin_precio'][:10]}")
+    
+    # Mantener solo las 15 columnas originales + 3 nuevas (18 total)
+    # Orden: 0-14 (originales) + 15,16,17 (Precio p/ Disponible, Precio Base, Descuento Aplicado)
+    columnas_a_mantener = [
+        'Nº Fábrica', 'Nº Chasis', 'Modelo/Versión', 'Color', 
+        'Fecha Finanzas', 'Despacho Estimado', 'Entrega Estimada',
+        'Fecha Recepción', 'Ubicación', 'Días Stock', 'Precio p/ Disponible',
+        'Cód. Cliente', 'Cliente', 'Vendedor', 'Operación',
+        'Precio Base', 'Descuento Aplicado (%)'
+    ]
+    # Solo mantener las columnas que existen
+    columnas_existentes = [col for col in columnas_a_mantener if col in df.columns]
+    df = df[columnas_existentes]
+    
+    print(f"📊 Columnas finales del DataFrame: {list(df.columns)}")
+    
+    # **Filtrar unidades postergadas ANTES de dividir por pestañas**
+    if unidades_postergadas and 'Nº Fábrica' in df.columns:
+        filas_antes = len(df)
+        # Convertir Nº Fábrica a string y eliminar espacios
+        df['Nº Fábrica'] = df['Nº Fábrica'].astype(str).str.strip()
+        # Filtrar las filas que NO estén en la lista de postergadas
+        df = df[~df['Nº Fábrica'].isin(unidades_postergadas)]
+        filas_despues = len(df)
+        print(f"Filtrado de unidades postergadas: {filas_antes} filas -> {filas_despues} filas ({filas_antes - filas_despues} eliminadas)")
+    
+    # Convertir la primera columna a string para el análisis de prefijos
+    df['Nº Fábrica'] = df['Nº Fábrica'].astype(str)
+    
+    # Separar por tipo de canal de venta según el prefijo de "Nº Fábrica"
+    tabs_data = []
+    
+    # Ventas Especiales (F)
+    df_ventas_especiales = df[df['Nº Fábrica'].str.startswith('F', na=False)]
+    if not df_ventas_especiales.empty:
+        tabs_data.append({
+            'id': 'ventas-especiales',
+            'name': 'Ventas Especiales (F)',
+            'count': len(df_ventas_especiales),
+            'columns': list(df_ventas_especiales.columns),
+            'rows': Filas(filas_dataframe(df_ventas_especiales))
+        })
+    
+    # Plan de Ahorro (TPA)
+    df_plan_ahorro = df[df['Nº Fábrica'].str.startswith('TPA', na=False)]
+    if not df_plan_ahorro.empty:
+        tabs_data.append({
+            'id': 'plan-ahorro',
+            'name': 'Plan de Ahorro (TPA)',
+            'count': len(df_plan_ahorro),
+            'columns': list(df_plan_ahorro.columns),
+            'rows': Filas(filas_dataframe(df_plan_ahorro))
+        })
+    
+    # Ventas Convencionales (YAC)
+    df_ventas_convencionales = df[df['Nº Fábrica'].str.startswith('YAC', na=False)]
+    if not df_ventas_convencionales.empty:
+        tabs_data.append({
+            'id': 'ventas-convencionales',
+            'name': 'Ventas Convencionales (YAC)',
+            'count': len(df_ventas_convencionales),
+            'columns': list(df_ventas_convencionales.columns),
+            'rows': Filas(filas_dataframe(df_ventas_convencionales))
+        })
+    
+    # No incluir la pestaña "Otros" - comentado para simplificar
+    # df_otros = df[~df['Nº Fábrica'].str.match(r'^(F|TPA|YAC)', na=False)].copy()
+    
+    avance(90, 'Armando pestañas')
+    return {
+        'success': True,
+        'tabs': tabs_data,
+        'total_rows': len(df)
+    }
+
+
 # Módulos 4, 5 y 6 (placeholders)
 @app.route('/modulo4')
 @login_required
@@ -980,6 +1003,31 @@ def modulo6():
 # ==================== API MÓDULO 4: DISPONIBLES ====================
 
 # API para obtener unidades disponibles
+def unidad_disponible(row):
+    """Unidad de disponibles tal como la recibe el frontend (Módulo 4 / Ventas)"""
+    return {
+        'numero_fabrica': row['numero_fabrica'],
+        'numero_chasis': row['numero_chasis'],
+        'modelo_version': row['modelo_version'],
+        'color': row['color'],
+        'fecha_finanzas': row['fecha_finanzas'],
+        'despacho_estimado': row['despacho_estimado'],
+        'entrega_estimada': row['entrega_estimada'],
+        'fecha_recepcion': row['fecha_recepcion'],
+        'ubicacion': row['ubicacion'],
+        'dias_stock': row['dias_stock'],
+        'precio_disponible': row['precio_final'] or 0,
+        'precio_base': row.get('precio_base', 0) or row['precio_disponible'] or 0,
+        'descuento_individual': row.get('descuento_guardado', 0) or 0,
+        'descuento_adicional': round(row['descuento_adicional'] or 0, 2),
+        'detalles_descuento': row['detalles_descuento'] or 'Sin descuentos',
+        'cod_cliente': row['cod_cliente'],
+        'cliente': row['cliente'],
+        'vendedor': row['vendedor'],
+        'operacion': row['operacion'],
+        'familia': row['familia'] or 'SIN FAMILIA'
+    }
+
 @app.route('/api/disponibles', methods=['GET'])
 @login_required
 def get_disponibles():
@@ -987,159 +1035,165 @@ def get_disponibles():
     if not (current_user.has_permission('planeamiento') or current_user.has_permission('ventas')):
         return jsonify({'error': 'No tienes permisos para acceder a esta información'}), 403
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Obtener descuentos adicionales
-    cursor.execute('SELECT tipo, clave, valor FROM descuentos_adicionales')
-    desc_rows = cursor.fetchall()
-    descuentos_config = {}
-    for row in desc_rows:
-        if row['tipo'] not in descuentos_config:
-            descuentos_config[row['tipo']] = {}
-        descuentos_config[row['tipo']][row['clave']] = row['valor']
-    
-    cursor.execute('''
-        SELECT d.numero_fabrica, d.numero_chasis, d.modelo_version, d.color,
+    consulta = '''
+        SELECT d.id, d.numero_fabrica, d.numero_chasis, d.modelo_version, d.color,
                d.fecha_finanzas, d.despacho_estimado, d.entrega_estimada,
                d.fecha_recepcion, d.ubicacion, d.dias_stock, d.precio_disponible,
                d.cod_cliente, d.cliente, d.vendedor, d.operacion,
-               d.precio_base, d.descuento_individual as descuento_guardado, d.descuento_adicional,
-               p.familia, p.descuento as descuento_individual, p.descuento_futuro
+               d.precio_base, d.descuento_individual as descuento_guardado,
+               d.precio_final, d.descuento_adicional, d.detalles_descuento, d.precios_calculados_en,
+               p.familia
         FROM disponibles d
         LEFT JOIN precios p ON d.modelo_version = p.modelo
         ORDER BY d.fecha_carga DESC
-    ''')
+    '''
+    cursor = get_db_connection().cursor()
+    cursor.execute(consulta)
     rows = cursor.fetchall()
-    conn.rollback()
-    release_db_connection(conn)
     
-    from datetime import datetime
-    from dateutil.relativedelta import relativedelta
-    
-    disponibles = []
-    for row in rows:
-        # Usar el precio_base guardado o el precio_disponible como fallback
-        precio_base_guardado = row.get('precio_base', 0) or row['precio_disponible'] or 0
-        
-        # Usar el descuento individual que ya fue guardado al procesar el Excel
-        descuento_individual_guardado = row.get('descuento_guardado', 0) or 0
-        
-        descuento_total = descuento_individual_guardado
-        detalles_descuento = []
-        
-        # Determinar fecha de entrega para calcular descuentos adicionales
-        fecha_entrega_parsed = None
-        
-        if row['entrega_estimada']:
-            try:
-                fecha_str = str(row['entrega_estimada'])
-                # Intentar parsear la fecha
-                try:
-                    fecha_entrega_parsed = datetime.strptime(fecha_str, '%Y-%m-%d')
-                except:
-                    try:
-                        if 'GMT' in fecha_str:
-                            fecha_str_limpia = fecha_str.replace(' GMT', '').strip()
-                            fecha_entrega_parsed = datetime.strptime(fecha_str_limpia, '%a, %d %b %Y %H:%M:%S')
-                        else:
-                            fecha_entrega_parsed = datetime.fromisoformat(fecha_str.replace('GMT', '').strip())
-                    except:
-                        pass
-            except Exception as e:
-                pass
-        
-        # Descuento por Stock
-        ubicacion_actual = (row['ubicacion'] or '').strip().upper()
-        desc_stock = descuentos_config.get('stock', {}).get('descuento_stock', 0)
-        
-        # Comparar si contiene "STOCK" en cualquier parte
-        if 'STOCK' in ubicacion_actual and desc_stock > 0:
-            descuento_total += desc_stock
-            detalles_descuento.append(f"Stock: {desc_stock}%")
-        
-        # Descuento por Color - Normalizar para comparar
-        color_original = (row['color'] or '').strip()
-        color_normalizado = color_original.lower().replace(' ', '_')
-        desc_color = descuentos_config.get('color', {}).get(color_normalizado, 0)
-        if desc_color > 0:
-            descuento_total += desc_color
-            detalles_descuento.append(f"Color: {desc_color}%")
-        
-        # Descuento por Antigüedad
-        if fecha_entrega_parsed:
-            try:
-                meses_config = descuentos_config.get('antiguedad', {}).get('meses', 3)
-                desc_antiguedad = descuentos_config.get('antiguedad', {}).get('descuento', 0)
-                fecha_limite = datetime.now() - relativedelta(months=int(meses_config))
-                
-                if fecha_entrega_parsed < fecha_limite and desc_antiguedad > 0:
-                    descuento_total += desc_antiguedad
-                    detalles_descuento.append(f"Antigüedad: {desc_antiguedad}%")
-            except Exception as e:
-                print(f"❌ Error procesando antigüedad para {row['numero_fabrica']}: {e}")
-        
-        # Calcular precio final con TODOS los descuentos
-        precio_final = precio_base_guardado * (1 - descuento_total / 100)
-        
-        # Separar descuento individual (va en su propia columna) del total de adicionales
-        descuento_adicional = descuento_total - descuento_individual_guardado
-        
-        disponibles.append({
-            'numero_fabrica': row['numero_fabrica'],
-            'numero_chasis': row['numero_chasis'],
-            'modelo_version': row['modelo_version'],
-            'color': row['color'],
-            'fecha_finanzas': row['fecha_finanzas'],
-            'despacho_estimado': row['despacho_estimado'],
-            'entrega_estimada': row['entrega_estimada'],
-            'fecha_recepcion': row['fecha_recepcion'],
-            'ubicacion': row['ubicacion'],
-            'dias_stock': row['dias_stock'],
-            'precio_disponible': round(precio_final, 2),
-            'precio_base': precio_base_guardado,
-            'descuento_individual': descuento_individual_guardado,
-            'descuento_adicional': round(descuento_adicional, 2),
-            'detalles_descuento': ', '.join(detalles_descuento) if detalles_descuento else 'Sin descuentos',
-            'cod_cliente': row['cod_cliente'],
-            'cliente': row['cliente'],
-            'vendedor': row['vendedor'],
-            'operacion': row['operacion'],
-            'familia': row['familia'] or 'SIN FAMILIA'
-        })
+    # Los precios se materializan al guardar y una vez por día (recalcular_precios.py).
+    # Si quedaron de otro día (descuento por antigüedad) o sin calcular, un solo
+    # pedido por vez los recalcula y guarda; los demás los calculan solo para su respuesta
+    hoy = datetime.now().date()
+    if any(row['precios_calculados_en'] != hoy for row in rows):
+        with db_transaction() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('recalcular_precios_disponibles')) AS bloqueo")
+            if cursor.fetchone()['bloqueo']:
+                # Releer con el bloqueo tomado: otro pedido pudo haberlas recalculado recién
+                cursor.execute(consulta)
+                rows = cursor.fetchall()
+                vencidas = [row['id'] for row in rows if row['precios_calculados_en'] != hoy]
+                if vencidas:
+                    recalcular_precios_disponibles(cursor, ids=vencidas)
+                    cursor.execute(consulta)
+                    rows = cursor.fetchall()
+            else:
+                completar_precios(cursor, [row for row in rows if row['precios_calculados_en'] != hoy])
     
     # DEBUG: Mostrar qué se está enviando al frontend
     print(f"\n🚀 ============ ENVIANDO DATOS AL FRONTEND (MÓDULO 4) ============")
-    print(f"   Total de unidades: {len(disponibles)}")
-    if len(disponibles) > 0:
+    print(f"   Total de unidades: {len(rows)}")
+    if len(rows) > 0:
+        primera = unidad_disponible(rows[0])
         print(f"\n   📤 Primera unidad que se envía:")
-        print(f"      Nº Fábrica: {disponibles[0]['numero_fabrica']}")
-        print(f"      Modelo: {disponibles[0]['modelo_version']}")
-        print(f"      Precio Base: ${disponibles[0]['precio_base']}")
-        print(f"      Descuento Individual: {disponibles[0]['descuento_individual']}%")
-        print(f"      Descuento Adicional: {disponibles[0]['descuento_adicional']}%")
-        print(f"      Precio Final: ${disponibles[0]['precio_disponible']}")
-        
-        if len(disponibles) > 1:
+        print(f"      Nº Fábrica: {primera['numero_fabrica']}")
+        print(f"      Modelo: {primera['modelo_version']}")
+        print(f"      Precio Base: ${primera['precio_base']}")
+        print(f"      Descuento Individual: {primera['descuento_individual']}%")
+        print(f"      Descuento Adicional: {primera['descuento_adicional']}%")
+        print(f"      Precio Final: ${primera['precio_disponible']}")
+        
+        if len(rows) > 1:
+            segunda = unidad_disponible(rows[1])
             print(f"\n   📤 Segunda unidad que se envía:")
-            print(f"      Nº Fábrica: {disponibles[1]['numero_fabrica']}")
-            print(f"      Modelo: {disponibles[1]['modelo_version']}")
-            print(f"      Descuento Individual: {disponibles[1]['descuento_individual']}%")
+            print(f"      Nº Fábrica: {segunda['numero_fabrica']}")
+            print(f"      Modelo: {segunda['modelo_version']}")
+            print(f"      Descuento Individual: {segunda['descuento_individual']}%")
         
-        if len(disponibles) > 2:
+        if len(rows) > 2:
+            tercera = unidad_disponible(rows[2])
             print(f"\n   📤 Tercera unidad que se envía:")
-            print(f"      Nº Fábrica: {disponibles[2]['numero_fabrica']}")
-            print(f"      Modelo: {disponibles[2]['modelo_version']}")
-            print(f"      Descuento Individual: {disponibles[2]['descuento_individual']}%")
+            print(f"      Nº Fábrica: {tercera['numero_fabrica']}")
+            print(f"      Modelo: {tercera['modelo_version']}")
+            print(f"      Descuento Individual: {tercera['descuento_individual']}%")
     print(f"   ==================================================================\n")
     
-    return jsonify(disponibles)
+    # Cada unidad se arma recién al serializarla, de a bloques
+    return respuesta_json_stream(Filas(unidad_disponible(row) for row in rows))
+
+# Columnas que se cargan desde el Módulo 3 (en el orden del COPY)
+COLUMNAS_DISPONIBLES = [
+    'numero_fabrica', 'numero_chasis', 'modelo_version', 'color',
+    'fecha_finanzas', 'despacho_estimado', 'entrega_estimada',
+    'fecha_recepcion', 'ubicacion', 'dias_stock', 'precio_disponible',
+    'cod_cliente', 'cliente', 'vendedor', 'operacion',
+    'precio_base', 'descuento_individual', 'descuento_adicional'
+]
+
+# Columnas que se comparan en modo incremental (descuento_adicional se materializa aparte)
+COLUMNAS_COMPARADAS = [col for col in COLUMNAS_DISPONIBLES if col not in ('numero_fabrica', 'descuento_adicional')]
+
+
+def aplicar_cambios_disponibles(cursor):
+    """Aplicar a disponibles solo las diferencias con disponibles_carga.
+
+    Las unidades se identifican por numero_fabrica: se eliminan las que ya no
+    vienen, se actualizan las que cambiaron (renovando su fecha_carga) y se
+    insertan las nuevas. Los números repetidos (como YAC999999999 de preventa)
+    no identifican una unidad, así que esas filas se eliminan y se vuelven a insertar.
+    Devuelve la cantidad de unidades (números de fábrica distintos) de cada categoría.
+    """
+    columnas = ', '.join(COLUMNAS_DISPONIBLES)
+    
+    cursor.execute('''
+        CREATE TEMP TABLE disponibles_claves_repetidas ON COMMIT DROP AS
+        SELECT numero_fabrica FROM disponibles_carga GROUP BY numero_fabrica HAVING COUNT(*) > 1
+        UNION
+        SELECT numero_fabrica FROM disponibles GROUP BY numero_fabrica HAVING COUNT(*) > 1
+    ''')
+    cursor.execute('''
+        DELETE FROM disponibles
+        WHERE numero_fabrica IN (SELECT numero_fabrica FROM disponibles_claves_repetidas)
+        RETURNING numero_fabrica
+    ''')
+    eliminados = {row['numero_fabrica'] for row in cursor.fetchall()}
+    
+    # Unidades que ya no están en el reporte
+    cursor.execute('''
+        DELETE FROM disponibles d
+        WHERE NOT EXISTS (SELECT 1 FROM disponibles_carga c WHERE c.numero_fabrica = d.numero_fabrica)
+        RETURNING d.numero_fabrica
+    ''')
+    eliminados.update(row['numero_fabrica'] for row in cursor.fetchall())
+    
+    cursor.execute('''
+        SELECT COUNT(*) AS total
+        FROM disponibles d JOIN disponibles_carga c ON c.numero_fabrica = d.numero_fabrica
+    ''')
+    coincidentes = cursor.fetchone()['total']
+    
+    # Unidades con algún dato distinto
+    asignaciones = ', '.join(f'{col} = c.{col}' for col in COLUMNAS_COMPARADAS)
+    actuales = ', '.join(f'd.{col}' for col in COLUMNAS_COMPARADAS)
+    nuevas = ', '.join(f'c.{col}' for col in COLUMNAS_COMPARADAS)
+    cursor.execute(f'''
+        UPDATE disponibles d
+        SET {asignaciones}, fecha_carga = CURRENT_TIMESTAMP
+        FROM disponibles_carga c
+        WHERE c.numero_fabrica = d.numero_fabrica
+          AND ({actuales}) IS DISTINCT FROM ({nuevas})
+        RETURNING d.numero_fabrica
+    ''')
+    actualizadas = {row['numero_fabrica'] for row in cursor.fetchall()}
+    
+    # Unidades nuevas (incluye las de números repetidos eliminadas arriba)
+    cursor.execute(f'''
+        INSERT INTO disponibles ({columnas})
+        SELECT {columnas} FROM disponibles_carga c
+        WHERE NOT EXISTS (SELECT 1 FROM disponibles d WHERE d.numero_fabrica = c.numero_fabrica)
+        RETURNING numero_fabrica
+    ''')
+    insertadas = {row['numero_fabrica'] for row in cursor.fetchall()}
+    
+    # Solo las unidades escritas necesitan recalcular su precio final
+    if actualizadas or insertadas:
+        recalcular_precios_disponibles(cursor, numeros_fabrica=actualizadas | insertadas)
+    
+    return {
+        'insertados': len(insertadas),
+        'actualizados': len(actualizadas),
+        'eliminados': len(eliminados),
+        'sin_cambios': coincidentes - len(actualizadas)
+    }
+
 
 # API para guardar/reemplazar unidades disponibles
+# Con ?modo=incremental solo se escriben las diferencias con lo guardado
 @app.route('/api/disponibles', methods=['POST'])
 @login_required
 @module_permission_required('planeamiento')
 def save_disponibles():
+    """Guardar las unidades convertidas a disponibles; con ?async=true se guarda en segundo plano (202 + id de tarea)"""
     data = request.json
     
     print(f"\n🔍 ============ RECIBIENDO DATOS PARA GUARDAR EN DISPONIBLES ============")
@@ -1167,54 +1221,85 @@ def save_disponibles():
             print(f"      Descuento Aplicado: {data[2].get('descuento_aplicado')} %")
     print(f"   ========================================================================\n")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    incremental = request.args.get('modo') == 'incremental'
     
     try:
-        # Eliminar todos los registros anteriores
-        cursor.execute('DELETE FROM disponibles')
-        
-        # Insertar nuevos registros
-        for item in data:
-            cursor.execute('''
-                INSERT INTO disponibles (
-                    numero_fabrica, numero_chasis, modelo_version, color,
-                    fecha_finanzas, despacho_estimado, entrega_estimada,
-                    fecha_recepcion, ubicacion, dias_stock, precio_disponible,
-                    cod_cliente, cliente, vendedor, operacion,
-                    precio_base, descuento_individual, descuento_adicional
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (
-                item.get('numero_fabrica'),
-                item.get('numero_chasis'),
-                item.get('modelo_version'),
-                item.get('color'),
-                item.get('fecha_finanzas'),
-                item.get('despacho_estimado'),
-                item.get('entrega_estimada'),
-                item.get('fecha_recepcion'),
-                item.get('ubicacion'),
-                item.get('dias_stock'),
-                item.get('precio_disponible'),
-                item.get('cod_cliente'),
-                item.get('cliente'),
-                item.get('vendedor'),
-                item.get('operacion'),
-                item.get('precio_base', 0),
-                item.get('descuento_aplicado', 0),  # Este es el descuento individual que se aplicó
-                0  # descuento_adicional se calculará en Módulo 4
-            ))
-        
-        conn.commit()
-        conn.rollback()
-        release_db_connection(conn)
-        
-        return jsonify({'success': True, 'count': len(data)})
+        if pedido_asincronico():
+            tarea_id = tareas.encolar('save_disponibles', guardar_disponibles, data, incremental,
+                                      usuario=current_user.id)
+            return respuesta_tarea(tarea_id)
+        return jsonify(guardar_disponibles(sin_avance, data, incremental))
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+
+def guardar_disponibles(avance, data, incremental):
+    """Reemplazar disponibles con las unidades recibidas (o aplicar solo las diferencias si `incremental`)"""
+    filas = [
+        (
+            item.get('numero_fabrica'),
+            item.get('numero_chasis'),
+            item.get('modelo_version'),
+            item.get('color'),
+            item.get('fecha_finanzas'),
+            item.get('despacho_estimado'),
+            item.get('entrega_estimada'),
+            item.get('fecha_recepcion'),
+            item.get('ubicacion'),
+            item.get('dias_stock'),
+            item.get('precio_disponible'),
+            item.get('cod_cliente'),
+            item.get('cliente'),
+            item.get('vendedor'),
+            item.get('operacion'),
+            item.get('precio_base', 0),
+            item.get('descuento_aplicado', 0),  # Este es el descuento individual que se aplicó
+            0  # descuento_adicional se calcula abajo
+        )
+        for item in data
+    ]
+    columnas = ', '.join(COLUMNAS_DISPONIBLES)
+    
+    avance(10, 'Cargando unidades')
+    inicio = time()
+    with db_transaction() as cursor:
+        # Un guardado a la vez: dos guardados concurrentes calcularían sus diferencias sobre el mismo estado
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('guardar_disponibles'))")
+        
+        # Cargar todo con COPY en una tabla temporal (un solo round-trip)
+        cursor.execute(f'''
+            CREATE TEMP TABLE disponibles_carga ON COMMIT DROP AS
+            SELECT {columnas} FROM disponibles WITH NO DATA
+        ''')
+        copy_rows(cursor, 'disponibles_carga', COLUMNAS_DISPONIBLES, filas)
+        
+        avance(50, 'Aplicando cambios')
+        if incremental:
+            cambios = aplicar_cambios_disponibles(cursor)
+        else:
+            # Reemplazo dentro de la misma transacción: los lectores siguen viendo
+            # la versión anterior completa hasta el commit, nunca una tabla vacía
+            cursor.execute('DELETE FROM disponibles')
+            cursor.execute(f'INSERT INTO disponibles ({columnas}) SELECT {columnas} FROM disponibles_carga')
+            
+            # Materializar precio final y descuentos adicionales de las nuevas unidades
+            recalcular_precios_disponibles(cursor)
+    
+    segundos = time() - inicio
+    filas_por_segundo = round(len(filas) / segundos) if segundos > 0 else len(filas)
+    print(f"✅ Disponibles guardados: {len(filas)} unidades en {segundos:.2f}s ({filas_por_segundo} filas/s)")
+    
+    respuesta = {
+        'success': True,
+        'count': len(data),
+        'segundos': round(segundos, 3),
+        'filas_por_segundo': filas_por_segundo
+    }
+    if incremental:
+        print(f"   Incremental: {cambios}")
+        respuesta.update(cambios)
+    return respuesta
+
 # API para obtener unidades reservadas
 @app.route('/api/unidades_reservadas', methods=['GET'])
 @login_required
@@ -1223,11 +1308,9 @@ def get_unidades_reservadas():
     if not (current_user.has_permission('planeamiento') or current_user.has_permission('ventas')):
         return jsonify({'error': 'No tienes permisos para acceder a esta información'}), 403
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
     cursor.execute('SELECT numero_fabrica, vendedor, fecha_agregado FROM unidades_reservadas ORDER BY fecha_agregado DESC')
     rows = cursor.fetchall()
-    release_db_connection(conn)
     
     reservadas = []
     for row in rows:
@@ -1256,21 +1339,13 @@ def add_unidad_reservada():
     if not vendedor:
         return jsonify({'success': False, 'error': 'Nombre del vendedor vacío'}), 400
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('INSERT INTO unidades_reservadas (numero_fabrica, vendedor) VALUES (%s, %s)', (numero_fabrica, vendedor))
-        conn.commit()
-        release_db_connection(conn)
+        with db_transaction() as cursor:
+            cursor.execute('INSERT INTO unidades_reservadas (numero_fabrica, vendedor) VALUES (%s, %s)', (numero_fabrica, vendedor))
         return jsonify({'success': True})
     except PgIntegrityError:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': 'Número de fábrica ya existe'}), 400
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # API para eliminar unidad reservada
@@ -1281,17 +1356,11 @@ def delete_unidad_reservada(numero_fabrica):
     if not (current_user.has_permission('planeamiento') or current_user.has_permission('ventas')):
         return jsonify({'error': 'No tienes permisos para acceder a esta información'}), 403
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute('DELETE FROM unidades_reservadas WHERE numero_fabrica = %s', (numero_fabrica,))
-        conn.commit()
-        release_db_connection(conn)
+    try:
+        with db_transaction() as cursor:
+            cursor.execute('DELETE FROM unidades_reservadas WHERE numero_fabrica = %s', (numero_fabrica,))
         return jsonify({'success': True})
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -1303,8 +1372,7 @@ def delete_unidad_reservada(numero_fabrica):
 def get_recaudacion():
     """Obtener datos de recaudación desde disponibles (solo YAC - Ventas Convencionales)
     Excluye unidades con ubicación 'Preventa'"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
     
     # Obtener unidades disponibles que son YAC (Ventas Convencionales)
     # Estas son las unidades que vienen del módulo 3 (Seguimiento) con cliente vacío
@@ -1321,7 +1389,6 @@ def get_recaudacion():
     ''')
     
     unidades = cursor.fetchall()
-    release_db_connection(conn)
     
     # Separar por Stock y No Stock según la ubicación
     en_stock = []
@@ -1422,24 +1489,20 @@ def upload_backup():
 @app.route('/api/observaciones/config_dias', methods=['GET'])
 @login_required
 @module_permission_required('planeamiento')
+@catalogo_versionado('config_dias_zonas')
 def get_config_dias():
     """Obtener configuración de días estándar y desvío por zona"""
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = get_db_connection().cursor()
         
         cursor.execute('SELECT zona, dias_estandar, dias_desvio FROM config_dias_zonas ORDER BY zona')
         rows = cursor.fetchall()
-        release_db_connection(conn)
         
         # Convertir a lista para el frontend
         config = [dict(row) for row in rows]
         
         return jsonify(config)
     except Exception as e:
-        if conn:
-            release_db_connection(conn)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/observaciones/config_dias', methods=['POST'])
@@ -1447,61 +1510,46 @@ def get_config_dias():
 @module_permission_required('planeamiento')
 def save_config_dias():
     """Guardar configuración de días"""
-    conn = None
     try:
         data = request.json
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         zonas = data.get('zonas', [])
         
         if not zonas:
             return jsonify({'success': False, 'error': 'No se recibieron datos de zonas'}), 400
         
-        for zona_data in zonas:
-            cursor.execute('''
-                INSERT INTO config_dias_zonas (zona, dias_estandar, dias_desvio, fecha_actualizacion)
-                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-                ON CONFLICT (zona) 
-                DO UPDATE SET 
-                    dias_estandar = EXCLUDED.dias_estandar,
-                    dias_desvio = EXCLUDED.dias_desvio,
-                    fecha_actualizacion = CURRENT_TIMESTAMP
-            ''', (zona_data['zona'], zona_data['dias_estandar'], zona_data['dias_desvio']))
+        with db_transaction() as cursor:
+            for zona_data in zonas:
+                cursor.execute('''
+                    INSERT INTO config_dias_zonas (zona, dias_estandar, dias_desvio, fecha_actualizacion)
+                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (zona) 
+                    DO UPDATE SET 
+                        dias_estandar = EXCLUDED.dias_estandar,
+                        dias_desvio = EXCLUDED.dias_desvio,
+                        fecha_actualizacion = CURRENT_TIMESTAMP
+                ''', (zona_data['zona'], zona_data['dias_estandar'], zona_data['dias_desvio']))
         
-        conn.commit()
-        release_db_connection(conn)
         return jsonify({'success': True, 'message': f'{len(zonas)} zonas guardadas'})
     except Exception as e:
-        if conn:
-            try:
-                conn.rollback()
-            except:
-                pass
-            release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/observaciones/matriz_codigos', methods=['GET'])
 @login_required
 @module_permission_required('planeamiento')
+@catalogo_versionado('matriz_codigos_obs')
 def get_matriz_codigos():
     """Obtener matriz de códigos de observación"""
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = get_db_connection().cursor()
         
         cursor.execute('SELECT clase, zona, codigos, es_zona_arribo FROM matriz_codigos_obs ORDER BY clase, zona')
         rows = cursor.fetchall()
-        release_db_connection(conn)
         
         # Convertir a lista para el frontend
         matriz = [dict(row) for row in rows]
         
         return jsonify(matriz)
     except Exception as e:
-        if conn:
-            release_db_connection(conn)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/observaciones/matriz_codigos', methods=['POST'])
@@ -1509,12 +1557,8 @@ def get_matriz_codigos():
 @module_permission_required('planeamiento')
 def save_matriz_codigos():
     """Guardar matriz de códigos"""
-    conn = None
     try:
         data = request.json
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         matriz = data.get('matriz', [])
         
         if not matriz:
@@ -1522,12 +1566,8 @@ def save_matriz_codigos():
         
         print(f"\n>> Guardando matriz de codigos: {len(matriz)} registros")
         
-        # IMPORTANTE: Eliminar todos los registros existentes primero
-        # para evitar registros huerfanos de configuraciones anteriores
-        cursor.execute('DELETE FROM matriz_codigos_obs')
-        print(f"   Registros anteriores eliminados")
-        
-        # Insertar nuevos registros
+        # Validar todos los registros antes de tocar la base de datos
+        registros = []
         for idx, registro in enumerate(matriz):
             try:
                 # Extraer y validar valores
@@ -1562,41 +1602,42 @@ def save_matriz_codigos():
                     es_zona_arribo = False
                 
                 print(f"  [{idx}] {clase} Zona {zona}: '{codigos}' (arribo={es_zona_arribo})")
-                
-                cursor.execute('''
-                    INSERT INTO matriz_codigos_obs (clase, zona, codigos, es_zona_arribo, fecha_actualizacion)
-                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
-                ''', (clase, zona, codigos, es_zona_arribo))
+                registros.append((clase, zona, codigos, es_zona_arribo))
                 
             except ValueError as val_err:
                 error_msg = f"Error de validacion en registro {idx}: {val_err}"
                 print(f"  ERROR: {error_msg}")
                 print(f"     Registro completo: {registro}")
-                conn.rollback()
-                release_db_connection(conn)
                 return jsonify({'success': False, 'error': error_msg}), 400
-            except Exception as row_error:
-                error_msg = f"Error en registro {idx}: {str(row_error)}"
-                print(f"  ERROR: {error_msg}")
-                print(f"     Registro completo: {registro}")
-                conn.rollback()
-                release_db_connection(conn)
-                return jsonify({'success': False, 'error': error_msg}), 500
         
-        conn.commit()
-        release_db_connection(conn)
+        idx = None
+        try:
+            with db_transaction() as cursor:
+                # IMPORTANTE: Eliminar todos los registros existentes primero
+                # para evitar registros huerfanos de configuraciones anteriores
+                cursor.execute('DELETE FROM matriz_codigos_obs')
+                print(f"   Registros anteriores eliminados")
+                
+                # Insertar nuevos registros
+                for idx, registro in enumerate(registros):
+                    cursor.execute('''
+                        INSERT INTO matriz_codigos_obs (clase, zona, codigos, es_zona_arribo, fecha_actualizacion)
+                        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+                    ''', registro)
+        except Exception as row_error:
+            if idx is None:
+                raise
+            error_msg = f"Error en registro {idx}: {str(row_error)}"
+            print(f"  ERROR: {error_msg}")
+            print(f"     Registro completo: {matriz[idx]}")
+            return jsonify({'success': False, 'error': error_msg}), 500
+        
         print(f">> OK - Matriz guardada exitosamente: {len(matriz)} registros")
         return jsonify({'success': True, 'message': f'{len(matriz)} registros guardados'})
         
     except Exception as e:
         error_msg = f"Error general guardando matriz: {str(e)}"
         print(f"ERROR: {error_msg}")
-        if conn:
-            try:
-                conn.rollback()
-            except:
-                pass
-            release_db_connection(conn)
         return jsonify({'success': False, 'error': error_msg}), 500
 
 @app.route('/api/observaciones/registrar_cambio', methods=['POST'])
@@ -1605,8 +1646,6 @@ def save_matriz_codigos():
 def registrar_cambio_observacion():
     """Registrar cambio de código de observación"""
     data = request.json
-    conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
         operacion = data.get('operacion')
@@ -1614,49 +1653,46 @@ def registrar_cambio_observacion():
         zona_nueva = data.get('zona_nueva')
         ejecutivo = data.get('ejecutivo')
         
-        # Obtener último cambio
-        cursor.execute('''
-            SELECT codigo_nuevo as codigo, zona_nueva as zona
-            FROM auditoria_observaciones
-            WHERE operacion = %s
-            ORDER BY fecha_cambio DESC
-            LIMIT 1
-        ''', (operacion,))
-        
-        ultimo = cursor.fetchone()
-        codigo_anterior = ultimo['codigo'] if ultimo else None
-        zona_anterior = ultimo['zona'] if ultimo else None
-        
-        # Detectar retroceso
-        es_retroceso = False
-        if zona_anterior and zona_nueva and zona_nueva < zona_anterior:
-            es_retroceso = True
-        
-        # Insertar auditoría
-        cursor.execute('''
-            INSERT INTO auditoria_observaciones 
-            (operacion, codigo_anterior, codigo_nuevo, zona_anterior, zona_nueva, ejecutivo, es_retroceso)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', (operacion, codigo_anterior, codigo_nuevo, zona_anterior, zona_nueva, ejecutivo, es_retroceso))
+        with db_transaction() as cursor:
+            # Obtener último cambio
+            cursor.execute('''
+                SELECT codigo_nuevo as codigo, zona_nueva as zona
+                FROM auditoria_observaciones
+                WHERE operacion = %s
+                ORDER BY fecha_cambio DESC
+                LIMIT 1
+            ''', (operacion,))
+        
+            ultimo = cursor.fetchone()
+            codigo_anterior = ultimo['codigo'] if ultimo else None
+            zona_anterior = ultimo['zona'] if ultimo else None
+        
+            # Detectar retroceso
+            es_retroceso = False
+            if zona_anterior and zona_nueva and zona_nueva < zona_anterior:
+                es_retroceso = True
+        
+            # Insertar auditoría
+            cursor.execute('''
+                INSERT INTO auditoria_observaciones 
+                (operacion, codigo_anterior, codigo_nuevo, zona_anterior, zona_nueva, ejecutivo, es_retroceso)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ''', (operacion, codigo_anterior, codigo_nuevo, zona_anterior, zona_nueva, ejecutivo, es_retroceso))
         
-        # Actualizar estadísticas
-        cursor.execute('''
-            INSERT INTO stats_operaciones (operacion, cantidad_cambios, cantidad_retrocesos, marcado_sospechoso)
-            VALUES (%s, 1, %s, %s)
-            ON CONFLICT (operacion)
-            DO UPDATE SET
-                cantidad_cambios = stats_operaciones.cantidad_cambios + 1,
-                cantidad_retrocesos = stats_operaciones.cantidad_retrocesos + CASE WHEN %s THEN 1 ELSE 0 END,
-                marcado_sospechoso = CASE WHEN stats_operaciones.cantidad_retrocesos + CASE WHEN %s THEN 1 ELSE 0 END > 1 THEN TRUE ELSE FALSE END,
-                fecha_actualizacion = CURRENT_TIMESTAMP
-        ''', (operacion, 1 if es_retroceso else 0, es_retroceso, es_retroceso, es_retroceso))
+            # Actualizar estadísticas
+            cursor.execute('''
+                INSERT INTO stats_operaciones (operacion, cantidad_cambios, cantidad_retrocesos, marcado_sospechoso)
+                VALUES (%s, 1, %s, %s)
+                ON CONFLICT (operacion)
+                DO UPDATE SET
+                    cantidad_cambios = stats_operaciones.cantidad_cambios + 1,
+                    cantidad_retrocesos = stats_operaciones.cantidad_retrocesos + CASE WHEN %s THEN 1 ELSE 0 END,
+                    marcado_sospechoso = CASE WHEN stats_operaciones.cantidad_retrocesos + CASE WHEN %s THEN 1 ELSE 0 END > 1 THEN TRUE ELSE FALSE END,
+                    fecha_actualizacion = CURRENT_TIMESTAMP
+            ''', (operacion, 1 if es_retroceso else 0, es_retroceso, es_retroceso, es_retroceso))
         
-        conn.commit()
-        release_db_connection(conn)
         return jsonify({'success': True, 'es_retroceso': es_retroceso})
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/observaciones/stats/<operacion>', methods=['GET'])
@@ -1664,10 +1700,8 @@ def registrar_cambio_observacion():
 @module_permission_required('planeamiento')
 def get_stats_operacion(operacion):
     """Obtener estadísticas de una operación"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
+        cursor = get_db_connection().cursor()
         cursor.execute('''
             SELECT cantidad_cambios, cantidad_retrocesos, marcado_sospechoso
             FROM stats_operaciones
@@ -1675,7 +1709,6 @@ def get_stats_operacion(operacion):
         ''', (operacion,))
         
         row = cursor.fetchone()
-        release_db_connection(conn)
         
         if row:
             return jsonify({
@@ -1696,8 +1729,6 @@ def get_stats_operacion(operacion):
                 }
             })
     except Exception as e:
-        conn.rollback()
-        release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -1706,19 +1737,18 @@ def get_stats_operacion(operacion):
 @app.route('/api/bi/upload_databases', methods=['POST'])
 @login_required
 def upload_bi_databases():
-    """Cargar y procesar archivos de bases de datos para BI"""
+    """Cargar y procesar archivos de bases de datos para BI
+
+    Las planillas se parsean en paralelo (una por proceso) a formato largo y se
+    cargan con COPY en paralelo; el reemplazo de las cuatro tablas es un solo
+    commit (si un archivo falla, no se borra nada). Con ?async=true se procesa
+    en segundo plano (202 + id de tarea).
+    """
     try:
         files = request.files
-        conn = get_db_connection()
-        cursor = conn.cursor()
         
         # Solo verificar archivos de patentamientos (ignorar entregas)
-        required_files = [
-            'argentina-marca', 'argentina-modelo', 
-            'mendoza-marca', 'mendoza-modelo'
-        ]
-        
-        for file_key in required_files:
+        for file_key in TABLAS_BI:
             if file_key not in files:
                 return jsonify({'success': False, 'error': f'Falta el archivo: {file_key}'}), 400
             # Verificar que el archivo tenga nombre válido
@@ -1726,349 +1756,159 @@ def upload_bi_databases():
             if not file.filename or file.filename == '':
                 return jsonify({'success': False, 'error': f'Archivo inválido: {file_key}'}), 400
         
-        # Procesar archivos de patentamientos
-        import pandas as pd
-        from dateutil import parser as date_parser
-        
-        # Diccionario para convertir nombres de meses en español
-        meses_es = {
-            'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
-            'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
-            'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
-            'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4,
-            'may': 5, 'jun': 6, 'jul': 7, 'ago': 8,
-            'sep': 9, 'oct': 10, 'nov': 11, 'dic': 12
-        }
-        
-        # Limpiar tablas anteriores
-        cursor.execute('DELETE FROM bi_patentamientos_argentina_marca')
-        cursor.execute('DELETE FROM bi_patentamientos_argentina_modelo')
-        cursor.execute('DELETE FROM bi_patentamientos_mendoza_marca')
-        cursor.execute('DELETE FROM bi_patentamientos_mendoza_modelo')
-        
-        print("🔄 Comenzando procesamiento de archivos...")
-        
-        # Procesar cada archivo
-        for file_key in ['argentina-marca', 'argentina-modelo', 'mendoza-marca', 'mendoza-modelo']:
-            file = files[file_key]
-            print(f"\n📂 Procesando archivo: {file_key} ({file.filename})")
-            
-            # Leer Excel sin forzar tipos
-            df = pd.read_excel(file, dtype=str)
-            print(f"   ✓ Archivo leído: {len(df)} filas, {len(df.columns)} columnas")
-            print(f"   Columnas detectadas: {list(df.columns)}")
-            
-            # La primera columna es el nombre (marca o modelo)
-            nombre_columna = df.columns[0]
-            fechas_columnas = df.columns[1:]
-            
-            print(f"   Columna de nombres: '{nombre_columna}'")
-            print(f"   Primeras 3 fechas: {list(fechas_columnas[:3])}")
-            
-            # Determinar tabla destino
-            if file_key == 'argentina-marca':
-                tabla = 'bi_patentamientos_argentina_marca'
-            elif file_key == 'argentina-modelo':
-                tabla = 'bi_patentamientos_argentina_modelo'
-            elif file_key == 'mendoza-marca':
-                tabla = 'bi_patentamientos_mendoza_marca'
-            else:  # mendoza-modelo
-                tabla = 'bi_patentamientos_mendoza_modelo'
-            
-            registros_insertados = 0
-            errores = 0
-            
-            # Insertar datos
-            for idx, row in df.iterrows():
-                nombre = str(row[nombre_columna]).strip()
-                
-                # Saltar filas vacías
-                if pd.isna(nombre) or nombre == '' or nombre == 'nan':
-                    continue
-                
-                # Insertar cada mes
-                for fecha_col in fechas_columnas:
-                    valor = row[fecha_col]
-                    
-                    # Convertir valor a número
-                    try:
-                        if pd.isna(valor) or valor == '' or valor == 'nan':
-                            cantidad = 0
-                        else:
-                            cantidad = int(float(str(valor).replace(',', '.')))
-                    except:
-                        cantidad = 0
-                    
-                    # Parsear fecha (puede venir como "enero-15", "01/15", o timestamp de pandas)
-                    try:
-                        fecha_str = str(fecha_col).strip().lower()
-                        
-                        # Caso 1: Formato "enero-15" o "ene-15"
-                        if '-' in fecha_str:
-                            partes = fecha_str.split('-')
-                            mes_nombre = partes[0].strip()
-                            anio = partes[1].strip()
-                            
-                            # Buscar el mes en el diccionario
-                            mes = meses_es.get(mes_nombre, None)
-                            if mes is None:
-                                print(f"   ⚠️ Mes no reconocido: '{mes_nombre}'")
-                                continue
-                            
-                            # Convertir año a 4 dígitos
-                            if len(anio) == 2:
-                                anio = '20' + anio
-                            
-                            fecha = f"{anio}-{str(mes).zfill(2)}-01"
-                        
-                        # Caso 2: Formato "01/15" o "1/15"
-                        elif '/' in fecha_str:
-                            partes = fecha_str.split('/')
-                            mes = int(partes[0])
-                            anio = partes[1].strip()
-                            
-                            if len(anio) == 2:
-                                anio = '20' + anio
-                            
-                            fecha = f"{anio}-{str(mes).zfill(2)}-01"
-                        
-                        # Caso 3: Timestamp de pandas
-                        elif isinstance(fecha_col, pd.Timestamp):
-                            fecha = fecha_col.strftime('%Y-%m-%d')
-                        
-                        # Caso 4: Intentar parsear con dateutil
-                        else:
-                            try:
-                                fecha_obj = date_parser.parse(fecha_str, dayfirst=True)
-                                fecha = fecha_obj.strftime('%Y-%m-01')
-                            except:
-                                print(f"   ⚠️ Fecha no reconocida: '{fecha_str}'")
-                                continue
-                        
-                        # Insertar en base de datos
-                        cursor.execute(f'''
-                            INSERT INTO {tabla} (nombre, fecha, cantidad)
-                            VALUES (%s, %s, %s)
-                        ''', (nombre, fecha, cantidad))
-                        
-                        registros_insertados += 1
-                        
-                    except Exception as e:
-                        errores += 1
-                        if errores < 5:  # Mostrar solo los primeros 5 errores
-                            print(f"   ⚠️ Error procesando fecha '{fecha_col}': {e}")
-            
-            print(f"   ✅ Insertados: {registros_insertados} registros | Errores: {errores}")
-        
-        conn.commit()
-        
-        # Obtener contadores de filas
-        row_counts = {}
-        cursor.execute('SELECT COUNT(*) as total FROM bi_patentamientos_argentina_marca')
-        row_counts['argentina-marca'] = cursor.fetchone()['total']
+        # Los streams del upload se cierran con el request: leerlos ahora
+        contenidos = {file_key: files[file_key].stream.read() for file_key in TABLAS_BI}
+        nombres = {file_key: files[file_key].filename for file_key in TABLAS_BI}
         
-        cursor.execute('SELECT COUNT(*) as total FROM bi_patentamientos_argentina_modelo')
-        row_counts['argentina-modelo'] = cursor.fetchone()['total']
+        if pedido_asincronico():
+            tarea_id = tareas.encolar('upload_bi_databases', cargar_bases_bi, contenidos, nombres,
+                                      usuario=current_user.id)
+            return respuesta_tarea(tarea_id)
         
-        cursor.execute('SELECT COUNT(*) as total FROM bi_patentamientos_mendoza_marca')
-        row_counts['mendoza-marca'] = cursor.fetchone()['total']
-        
-        cursor.execute('SELECT COUNT(*) as total FROM bi_patentamientos_mendoza_modelo')
-        row_counts['mendoza-modelo'] = cursor.fetchone()['total']
-        
-        release_db_connection(conn)
-        
-        # INVALIDAR CACHÉ cuando se cargan nuevos datos
-        patentamientos_cache['data'] = None
-        patentamientos_cache['timestamp'] = 0
-        print("🗑️ Caché de patentamientos invalidado")
-        
-        return jsonify({
-            'success': True, 
-            'message': 'Archivos procesados correctamente',
-            'rowCounts': row_counts
-        })
+        return jsonify(cargar_bases_bi(sin_avance, contenidos, nombres))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def cargar_bases_bi(avance, contenidos, nombres):
+    """Parsear las cuatro planillas de patentamientos ({file_key: bytes}) y reemplazar las tablas BI"""
+    print("🔄 Comenzando procesamiento de archivos...")
+    
+    inicio_total = time()
+    
+    # Parsear todo antes de tocar la base: una planilla por proceso
+    avance(10, 'Leyendo planillas')
+    try:
+        parseadas = parsear_planillas(contenidos)
+    except Exception as e:
+        raise ValueError(f'No se pudo leer una de las planillas: {e}') from e
+    
+    tiempos = {}
+    for file_key, (largo, resumen) in parseadas.items():
+        print(f"📂 {file_key} ({nombres[file_key]}): {resumen['filas']} filas x {resumen['meses']} meses -> "
+              f"{resumen['registros']} registros (lectura {resumen['lectura']}s, "
+              f"transformación {resumen['transformacion']}s)")
+        tiempos[file_key] = resumen
+    
+    # Copias en paralelo (una conexión por archivo) y un único commit para las cuatro tablas
+    avance(60, 'Cargando tablas')
+    cargas = cargar_tablas_bi(get_db_connection(), {file_key: largo for file_key, (largo, _) in parseadas.items()})
+    row_counts = {}
+    for file_key, (filas, segundos) in cargas.items():
+        row_counts[file_key] = filas
+        tiempos[file_key]['carga'] = segundos
+    print(f"✅ Bases BI cargadas en {time() - inicio_total:.2f}s: {row_counts}")
+    
+    # INVALIDAR CACHÉ cuando se cargan nuevos datos (en todos los workers)
+    patentamientos_cache.invalidar()
+    
+    return {
+        'success': True, 
+        'message': 'Archivos procesados correctamente',
+        'rowCounts': row_counts,
+        'tiempos': tiempos
+    }
+
+
+# Recortes que se guardan en la caché compartida: el pedido por defecto y el Top 5 sin rango.
+# El resto (rangos, modelos, mes) sale de la matriz en memoria y no se persiste: sus
+# combinaciones vienen del query string y llenarían el disco sin límite
+TOPS_CACHEADOS = (None, 5)
+
+
+def recorte_cacheable(desde=None, hasta=None, top=None, modelos=None, mes=None):
+    return desde is None and hasta is None and modelos is None and mes is None and top in TOPS_CACHEADOS
+
+
+def clave_patentamientos(dataset, desde=None, hasta=None, top=None, modelos=None, mes=None):
+    """Clave de caché de un recorte de patentamientos; cambia sola cuando se reemplaza el CSV (tamaño o mtime)"""
+    archivo = DATASETS_PATENTAMIENTOS[dataset][0]
+    return '|'.join([
+        clave_archivo(ruta_csv(archivo)), dataset, desde or '', hasta or '',
+        '' if top is None else str(top),
+        '*' if modelos is None else ','.join(sorted(set(modelos))),
+        mes or ''
+    ])
+
+
 @app.route('/api/bi/patentamientos', methods=['GET'])
 @login_required
 def get_bi_patentamientos():
-    """Obtener datos de patentamientos DIRECTAMENTE desde CSV - CON CACHÉ"""
+    """Obtener datos de patentamientos DIRECTAMENTE desde CSV - CON CACHÉ
+
+    Parámetros opcionales (sin ninguno se devuelven los 4 datasets completos):
+    - dataset: argentina_marca, argentina_modelo, mendoza_marca y/o mendoza_modelo (separados por coma)
+    - desde / hasta: rango de meses (YYYY-MM o MM/YY)
+    - top: ranking de modelos por total del rango; las series se limitan a esos modelos
+    - modelos: nombres de modelos cuyas series se devuelven (separados por coma)
+    - mes: mes de referencia de top5_ultimo_mes (por defecto el último del rango)
+    El pedido sin filtros y el Top 5 sin rango se cachean entre workers; los demás
+    recortes se calculan sobre la matriz del CSV, que ya está en memoria.
+    """
     try:
-        # Verificar si el caché es válido
-        current_time = time()
         force_refresh = request.args.get('refresh', 'false').lower() == 'true'
         
-        if (not force_refresh and 
-            patentamientos_cache['data'] is not None and 
-            (current_time - patentamientos_cache['timestamp']) < patentamientos_cache['ttl']):
-            print("✅ Sirviendo datos desde CACHÉ")
-            return jsonify({'success': True, 'data': patentamientos_cache['data'], 'from_cache': True})
-        
-        print("🔄 Cargando datos desde CSV...")
+        parametro_dataset = request.args.get('dataset')
+        datasets = [d.strip() for d in parametro_dataset.split(',')] if parametro_dataset else list(DATASETS_PATENTAMIENTOS)
+        invalidos = [d for d in datasets if d not in DATASETS_PATENTAMIENTOS]
+        if invalidos:
+            return jsonify({'success': False, 'error': f'Dataset inválido: {", ".join(invalidos)}'}), 400
         
-        # Leer datos desde CSV
-        result = {
-            'argentina_marca': get_patentamientos_from_csv('Mercado Argentino MARCA.csv', 'marca'),
-            'argentina_modelo': get_patentamientos_from_csv('Mercado Argentino MODELO.csv', 'modelo'),
-            'mendoza_marca': get_patentamientos_from_csv('Mercado Mendoza MARCA.csv', 'marca'),
-            'mendoza_modelo': get_patentamientos_from_csv('Mercado Mendoza MODELO.csv', 'modelo')
-        }
+        try:
+            desde = normalizar_mes(request.args['desde']) if request.args.get('desde') else None
+            hasta = normalizar_mes(request.args['hasta']) if request.args.get('hasta') else None
+            top = int(request.args['top']) if request.args.get('top') else None
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        modelos = None
+        if request.args.get('modelos'):
+            modelos = sorted({m.strip() for valor in request.args.getlist('modelos') for m in valor.split(',') if m.strip()})
+        mes = request.args.get('mes') or None
+        
+        result = {}
+        from_cache = True
+        cacheable = recorte_cacheable(desde, hasta, top, modelos, mes)
+        for dataset in datasets:
+            clave = clave_patentamientos(dataset, desde, hasta, top, modelos, mes)
+            
+            def calcular(dataset=dataset):
+                print(f"🔄 Cargando {dataset} desde CSV...")
+                return get_patentamientos_dataset(dataset, desde, hasta, top, modelos, mes)
+            
+            if not cacheable:
+                datos = calcular()
+                desde_cache = False
+            elif force_refresh:
+                datos = calcular()
+                patentamientos_cache.guardar(clave, datos)
+                desde_cache = False
+            else:
+                datos, desde_cache = patentamientos_cache.obtener_o_calcular(clave, calcular)
+            
+            from_cache = from_cache and desde_cache
+            # Los datasets sin meses en el rango no se devuelven
+            if datos is not None:
+                result[dataset] = datos
         
-        # Guardar en caché
-        patentamientos_cache['data'] = result
-        patentamientos_cache['timestamp'] = current_time
-        print(f"💾 Datos guardados en caché (válido por {patentamientos_cache['ttl']}s)")
+        if from_cache:
+            print("✅ Sirviendo datos desde CACHÉ")
+        elif cacheable:
+            print(f"💾 Datos guardados en caché (válido por {patentamientos_cache.ttl}s)")
         
-        return jsonify({'success': True, 'data': result, 'from_cache': False})
+        return jsonify({'success': True, 'data': result, 'from_cache': from_cache})
     except FileNotFoundError as e:
         return jsonify({'success': False, 'error': f'Archivos CSV no encontrados: {str(e)}'}), 404
+    except ValueError as e:
+        # Mes de referencia inexistente en el dataset
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-def get_patentamientos_from_csv(filename, tipo):
-    """Leer y procesar datos de patentamientos desde CSV"""
-    csv_path = os.path.join(os.path.dirname(__file__), 'Patentamientos', filename)
-    
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"Archivo no encontrado: {csv_path}")
-    
-    # Leer CSV con diferentes encodings
-    df = None
-    for encoding in ['latin-1', 'cp1252', 'iso-8859-1', 'utf-8']:
-        try:
-            df = pd.read_csv(csv_path, delimiter=';', encoding=encoding)
-            break
-        except:
-            continue
-    
-    if df is None:
-        raise Exception(f"No se pudo leer el archivo {filename}")
-    
-    # Primera columna es el nombre (marca o modelo)
-    nombres_col = df.columns[0]
-    
-    # Resto de columnas son fechas (ene-15, feb-15, etc.)
-    fecha_cols = df.columns[1:]
-    
-    # Convertir nombres de columnas de fecha a formato MM/YY
-    meses_map = {
-        'ene': '01', 'feb': '02', 'mar': '03', 'abr': '04',
-        'may': '05', 'jun': '06', 'jul': '07', 'ago': '08',
-        'sep': '09', 'oct': '10', 'nov': '11', 'dic': '12'
-    }
-    
-    fechas_formateadas = []
-    for col in fecha_cols:
-        col_lower = str(col).lower().strip()
-        if '-' in col_lower:
-            mes_str, anio_str = col_lower.split('-')
-            mes = meses_map.get(mes_str.strip())
-            anio = anio_str.strip()
-            if mes and len(anio) == 2:
-                fechas_formateadas.append(f"{mes}/{anio}")
-            else:
-                fechas_formateadas.append(col)
-        else:
-            fechas_formateadas.append(col)
-    
-    if tipo == 'marca':
-        return get_datos_por_marca(df, nombres_col, fecha_cols, fechas_formateadas)
-    else:
-        return get_datos_por_modelo(df, nombres_col, fecha_cols, fechas_formateadas)
-
-
-def get_datos_por_marca(df, nombres_col, fecha_cols, fechas_formateadas):
-    """Procesar datos agrupados por marca"""
-    marcas = ['TOYOTA', 'FORD', 'FIAT', 'VOLKSWAGEN', 'CHEVROLET', 'PEUGEOT']
-    result = {'labels': fechas_formateadas}
-    
-    # Inicializar series para cada marca
-    for marca in marcas:
-        result[marca.lower()] = [0] * len(fecha_cols)
-    result['otros'] = [0] * len(fecha_cols)
-    
-    # Procesar cada fila
-    for idx, row in df.iterrows():
-        nombre = str(row[nombres_col]).upper().strip()
-        
-        for i, fecha_col in enumerate(fecha_cols):
-            valor = row[fecha_col]
-            try:
-                cantidad = int(float(valor)) if pd.notna(valor) else 0
-            except:
-                cantidad = 0
-            
-            # Clasificar por marca
-            marca_encontrada = False
-            for marca in marcas:
-                if marca in nombre:
-                    result[marca.lower()][i] += cantidad
-                    marca_encontrada = True
-                    break
-            
-            if not marca_encontrada:
-                result['otros'][i] += cantidad
-    
-    return result
-
-
-def get_datos_por_modelo(df, nombres_col, fecha_cols, fechas_formateadas):
-    """Procesar datos por modelo con Top 5"""
-    # Obtener datos de la última columna para Top 5
-    ultima_col = fecha_cols[-1]
-    
-    # Crear lista de (nombre, valor_ultimo_mes) y ordenar
-    modelos_ultimo_mes = []
-    for idx, row in df.iterrows():
-        nombre = str(row[nombres_col]).strip()
-        valor = row[ultima_col]
-        try:
-            cantidad = int(float(valor)) if pd.notna(valor) else 0
-        except:
-            cantidad = 0
-        
-        if cantidad > 0:
-            modelos_ultimo_mes.append({'nombre': nombre, 'cantidad': cantidad})
-    
-    # Ordenar y obtener Top 5
-    modelos_ultimo_mes.sort(key=lambda x: x['cantidad'], reverse=True)
-    top5_ultimo_mes = modelos_ultimo_mes[:5]
-    
-    # Procesar todos los modelos con sus valores históricos
-    modelos = []
-    for idx, row in df.iterrows():
-        nombre = str(row[nombres_col]).strip()
-        valores = []
-        
-        for fecha_col in fecha_cols:
-            valor = row[fecha_col]
-            try:
-                cantidad = int(float(valor)) if pd.notna(valor) else 0
-            except:
-                cantidad = 0
-            valores.append(cantidad)
-        
-        modelos.append({
-            'nombre': nombre,
-            'valores': valores
-        })
-    
-    return {
-        'labels': fechas_formateadas,
-        'modelos': modelos,
-        'top5_ultimo_mes': top5_ultimo_mes
-    }
-
-
 def get_patentamientos_marca(cursor, tabla):
     """Obtener datos agrupados por marca - OPTIMIZADO con una consulta"""
     # Obtener todas las fechas distintas ordenadas
@@ -2273,12 +2113,8 @@ def save_manual_data():
         cursor.execute(f'SELECT COUNT(*) as total FROM {tabla}')
         total = cursor.fetchone()['total']
         
-        release_db_connection(conn)
-        
-        # INVALIDAR CACHÉ cuando se actualizan datos manualmente
-        patentamientos_cache['data'] = None
-        patentamientos_cache['timestamp'] = 0
-        print("🗑️ Caché de patentamientos invalidado")
+        # INVALIDAR CACHÉ cuando se actualizan datos manualmente (en todos los workers)
+        patentamientos_cache.invalidar()
         
         print(f"   ✅ Actualizado: {len(registros)} registros para {fecha_actualizar}")
         
@@ -2297,7 +2133,6 @@ def save_manual_data():
         
         if conn:
             conn.rollback()
-            release_db_connection(conn)
         
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -2305,35 +2140,45 @@ def save_manual_data():
 @app.route('/api/bi/get_saved_data/<data_type>', methods=['GET'])
 @login_required
 def get_saved_data(data_type):
-    """Obtener datos guardados de una tabla específica"""
+    """Obtener datos guardados de una tabla específica como matriz nombre x mes.
+
+    Una sola consulta (sin COUNT previo): una fila por nombre con sus meses y
+    cantidades agregados en arrays; la matriz se arma con un scatter de NumPy.
+    """
     try:
-        # Determinar tabla origen
-        tabla_map = {
-            'argentina-marca': 'bi_patentamientos_argentina_marca',
-            'argentina-modelo': 'bi_patentamientos_argentina_modelo',
-            'mendoza-marca': 'bi_patentamientos_mendoza_marca',
-            'mendoza-modelo': 'bi_patentamientos_mendoza_modelo'
-        }
-        
-        if data_type not in tabla_map:
+        if data_type not in TABLAS_BI:
             return jsonify({'success': False, 'error': 'Tipo de datos inválido'}), 400
         
-        tabla = tabla_map[data_type]
+        tabla = TABLAS_BI[data_type]
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = get_db_connection().cursor()
         
-        # Verificar si hay datos
-        cursor.execute(f'SELECT COUNT(*) as total FROM {tabla}')
-        total = cursor.fetchone()['total']
+        # Fechas como días desde 1970-01-01: enteros, más baratos de transferir y parsear que date
+        cursor.execute(f'''
+            SELECT nombre,
+                   array_agg(fecha - DATE '1970-01-01' ORDER BY fecha) AS dias,
+                   array_agg(COALESCE(cantidad, 0) ORDER BY fecha) AS cantidades,
+                   MAX(fecha_carga) AS ultima_carga
+            FROM {tabla}
+            GROUP BY nombre
+            ORDER BY nombre
+        ''')
+        filas = cursor.fetchall()
         
-        if total == 0:
-            release_db_connection(conn)
+        # Verificar si hay datos
+        if not filas:
             return jsonify({'success': True, 'hasData': False})
         
-        # Obtener todas las fechas únicas ordenadas
-        cursor.execute(f'SELECT DISTINCT fecha FROM {tabla} ORDER BY fecha')
-        fechas_raw = cursor.fetchall()
+        nombres = [fila['nombre'] for fila in filas]
+        largos = np.fromiter((len(fila['dias']) for fila in filas), dtype=np.int64, count=len(filas))
+        total = int(largos.sum())
+        dias = np.fromiter(chain.from_iterable(fila['dias'] for fila in filas), dtype=np.int64, count=total)
+        cantidades = np.fromiter(chain.from_iterable(fila['cantidades'] for fila in filas), dtype=np.int64, count=total)
+        
+        # Columnas = fechas distintas ordenadas; cada registro cae en (fila de su nombre, columna de su fecha)
+        fechas_dias, columna = np.unique(dias, return_inverse=True)
+        matriz = np.zeros((len(nombres), len(fechas_dias)), dtype=np.int64)
+        matriz[np.repeat(np.arange(len(nombres)), largos), columna] = cantidades
         
         # Formatear fechas como "ene-15", "feb-15", etc.
         meses_nombres = {
@@ -2342,59 +2187,26 @@ def get_saved_data(data_type):
         }
         
         fechas = []
-        for row in fechas_raw:
-            fecha_obj = row['fecha']
+        for dia in fechas_dias.tolist():
+            fecha_obj = date(1970, 1, 1) + timedelta(days=dia)
             mes_nombre = meses_nombres[fecha_obj.month]
             anio_corto = str(fecha_obj.year)[-2:]
             fechas.append(f"{mes_nombre}-{anio_corto}")
         
-        # Obtener todos los nombres únicos ordenados
-        cursor.execute(f'SELECT DISTINCT nombre FROM {tabla} ORDER BY nombre')
-        nombres_raw = cursor.fetchall()
-        nombres = [row['nombre'] for row in nombres_raw]
-        
-        # Obtener TODOS los datos en una sola consulta (OPTIMIZACIÓN CRÍTICA)
-        cursor.execute(f'SELECT nombre, fecha, cantidad FROM {tabla} ORDER BY nombre, fecha')
-        todos_los_datos = cursor.fetchall()
-        
-        # Crear diccionario para acceso rápido: {(nombre, fecha): cantidad}
-        datos_dict = {}
-        for row in todos_los_datos:
-            key = (row['nombre'], row['fecha'])
-            datos_dict[key] = row['cantidad']
-        
-        # Construir matriz de datos usando el diccionario
-        rows_data = []
-        for nombre in nombres:
-            row = [nombre]
-            
-            # Para cada fecha, obtener la cantidad del diccionario
-            for fecha_obj_wrapper in fechas_raw:
-                fecha_obj = fecha_obj_wrapper['fecha']
-                cantidad = datos_dict.get((nombre, fecha_obj), 0)
-                row.append(cantidad)
-            
-            rows_data.append(row)
-        
-        # Obtener fecha de última actualización
-        cursor.execute(f'SELECT MAX(fecha_carga) as ultima_actualizacion FROM {tabla}')
-        ultima_act = cursor.fetchone()['ultima_actualizacion']
+        # Fecha de última actualización
+        ultima_act = max((fila['ultima_carga'] for fila in filas if fila['ultima_carga'] is not None), default=None)
         
-        release_db_connection(conn)
-        
-        return jsonify({
+        return respuesta_json_stream({
             'success': True,
             'hasData': True,
             'headers': ['Marca/Modelo'] + fechas,
-            'rows': rows_data,
+            'rows': Filas([nombre] + valores for nombre, valores in zip(nombres, matriz.tolist())),
             'totalRecords': total,
             'lastUpdate': ultima_act.strftime('%Y-%m-%d %H:%M:%S') if ultima_act else None
         })
         
     except Exception as e:
         print(f"❌ Error obteniendo datos guardados: {e}")
-        if 'conn' in locals():
-            release_db_connection(conn)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -2402,8 +2214,7 @@ def get_saved_data(data_type):
 @login_required
 def load_historical_data():
     """Invalidar caché y forzar recarga desde CSV"""
-    patentamientos_cache['data'] = None
-    patentamientos_cache['timestamp'] = 0
+    patentamientos_cache.invalidar()
     return jsonify({'success': True, 'message': 'Caché invalidado. Los datos se recargarán en la próxima consulta.'})
 
 
@@ -2438,7 +2249,12 @@ def get_load_status():
     
     return jsonify({
         'archivos': status,
-        'cache_activo': patentamientos_cache['data'] is not None
+        'cache_activo': all(item['existe'] for item in status) and all(
+            # Cada dataset cuenta como cacheado con cualquiera de los recortes que se guardan
+            # (la página de patentamientos carga top=5)
+            any(patentamientos_cache.obtener(clave_patentamientos(dataset, top=top)) is not None for top in TOPS_CACHEADOS)
+            for dataset in DATASETS_PATENTAMIENTOS
+        )
     })
 
 
@@ -2446,31 +2262,6 @@ def get_load_status():
 # RETAIL Y PLAN DE NEGOCIO ROUTES
 # ================================
 
-def extract_family(modelo):
-    """Extract vehicle family from model name"""
-    modelo_upper = str(modelo).upper()
-    
-    # Priority order matters (check COROLLA CROSS before COROLLA)
-    if 'COROLLA CROSS' in modelo_upper:
-        return 'COROLLA CROSS'
-    elif 'YARIS CROSS' in modelo_upper:
-        return 'YARIS CROSS'
-    elif 'COROLLA' in modelo_upper:
-        return 'COROLLA'
-    elif 'HILUX' in modelo_upper:
-        return 'HILUX'
-    elif 'SW4' in modelo_upper:
-        return 'SW4'
-    elif 'YARIS' in modelo_upper:
-        return 'YARIS'
-    elif 'RAV' in modelo_upper or 'RAV4' in modelo_upper:
-        return 'RAV 4'
-    elif 'HIACE' in modelo_upper:
-        return 'HIACE'
-    else:
-        return 'OTROS'
-
-
 @app.route('/bi/retail_plan')
 @login_required
 def retail_plan():
@@ -2480,12 +2271,12 @@ def retail_plan():
 
 @app.route('/api/retail/plan', methods=['GET'])
 @login_required
+@catalogo_versionado('retail_plan')
 def get_retail_plan():
     """Obtener objetivos del plan de negocio"""
     try:
         anio = request.args.get('anio', 2025, type=int)
-        conn = get_db_connection()
-        cur = conn.cursor()
+        cur = get_db_connection().cursor()
         
         cur.execute("""
             SELECT familia, convencional_objetivo, especificas_objetivo, tpa_objetivo
@@ -2504,9 +2295,6 @@ def get_retail_plan():
                 'total': row['convencional_objetivo'] + row['especificas_objetivo'] + row['tpa_objetivo']
             }
         
-        cur.close()
-        conn.close()
-        
         return jsonify({'success': True, 'plan': plan})
     except Exception as e:
         print(f"Error obteniendo plan: {e}")
@@ -2525,24 +2313,18 @@ def update_retail_plan():
         especificas = data['especificas']
         tpa = data['tpa']
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            INSERT INTO retail_plan 
-            (anio, familia, convencional_objetivo, especificas_objetivo, tpa_objetivo, updated_at)
-            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-            ON CONFLICT (anio, familia) 
-            DO UPDATE SET 
-                convencional_objetivo = EXCLUDED.convencional_objetivo,
-                especificas_objetivo = EXCLUDED.especificas_objetivo,
-                tpa_objetivo = EXCLUDED.tpa_objetivo,
-                updated_at = CURRENT_TIMESTAMP
-        """, (anio, familia, convencional, especificas, tpa))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        with db_transaction() as cur:
+            cur.execute("""
+                INSERT INTO retail_plan 
+                (anio, familia, convencional_objetivo, especificas_objetivo, tpa_objetivo, updated_at)
+                VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (anio, familia) 
+                DO UPDATE SET 
+                    convencional_objetivo = EXCLUDED.convencional_objetivo,
+                    especificas_objetivo = EXCLUDED.especificas_objetivo,
+                    tpa_objetivo = EXCLUDED.tpa_objetivo,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (anio, familia, convencional, especificas, tpa))
         
         return jsonify({'success': True})
     except Exception as e:
@@ -2553,79 +2335,40 @@ def update_retail_plan():
 @app.route('/api/retail/sales_vs_plan', methods=['GET'])
 @login_required
 def sales_vs_plan():
-    """Comparar ventas reales vs plan de negocio con desvío acumulado diario"""
+    """Comparar ventas reales vs plan de negocio con desvío acumulado diario
+
+    Parámetros: anio (por defecto 2025) y fecha de corte (YYYY-MM-DD; por
+    defecto hoy en el año en curso y el 31/12 en los demás años). Se comparan
+    las ventas del año hasta el día y mes de la fecha de corte con el
+    porcentaje del plan esperado a ese día.
+    """
     try:
         anio = request.args.get('anio', 2025, type=int)
         
-        # Promedios mensuales de patentamiento histórico y días por mes
-        datos_mensuales = {
-            1: {'porcentaje': 11.54, 'dias': 31},   # Enero
-            2: {'porcentaje': 7.29, 'dias': 28},    # Febrero (ajustar para bisiestos)
-            3: {'porcentaje': 8.37, 'dias': 31},    # Marzo
-            4: {'porcentaje': 7.76, 'dias': 30},    # Abril
-            5: {'porcentaje': 8.37, 'dias': 31},    # Mayo
-            6: {'porcentaje': 9.25, 'dias': 30},    # Junio
-            7: {'porcentaje': 9.25, 'dias': 31},    # Julio
-            8: {'porcentaje': 9.43, 'dias': 31},    # Agosto
-            9: {'porcentaje': 8.65, 'dias': 30},    # Septiembre
-            10: {'porcentaje': 8.80, 'dias': 31},   # Octubre
-            11: {'porcentaje': 7.79, 'dias': 30},   # Noviembre
-            12: {'porcentaje': 3.99, 'dias': 31}    # Diciembre
-        }
-        
-        # Calcular porcentaje acumulado hasta hoy considerando días exactos
-        from datetime import datetime
-        hoy = datetime.now()
-        mes_actual = hoy.month
-        dia_actual = hoy.day
-        
-        # Acumular meses completos anteriores
-        porcentaje_esperado_acumulado = sum(datos_mensuales[m]['porcentaje'] for m in range(1, mes_actual))
-        
-        # Calcular porcentaje diario del mes actual
-        porcentaje_diario_mes_actual = datos_mensuales[mes_actual]['porcentaje'] / datos_mensuales[mes_actual]['dias']
-        
-        # Agregar los días transcurridos del mes actual
-        porcentaje_esperado_acumulado += (porcentaje_diario_mes_actual * dia_actual)
-        
-        print(f"🗓️ Fecha: {dia_actual}/{mes_actual}/{anio} | Porcentaje esperado acumulado: {porcentaje_esperado_acumulado:.2f}%")
-        
-        # Leer CSV de retail
-        csv_path = os.path.join(os.path.dirname(__file__), 'Retail y Plan de Negocio', 'Retail y Plan de Negocio.csv')
-        
-        # Try different encodings
-        df = None
-        for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
+        # Fecha de corte: la indicada, hoy si es el año en curso o el año completo si no
+        parametro_fecha = request.args.get('fecha')
+        if parametro_fecha:
             try:
-                df = pd.read_csv(csv_path, sep=';', encoding=encoding)
-                break
-            except:
-                continue
-        
-        if df is None:
-            return jsonify({'success': False, 'error': 'No se pudo leer el archivo CSV'}), 500
-        
-        # Extract family and sale type
-        df['Familia'] = df['Modelo / Versión'].apply(extract_family)
+                corte = datetime.strptime(parametro_fecha, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Fecha inválida (usar YYYY-MM-DD)'}), 400
+        else:
+            corte = datetime.now()
+            if anio != corte.year:
+                corte = datetime(anio, 12, 31)
+        mes_actual = corte.month
+        dia_actual = corte.day
         
-        sale_type_map = {
-            'YAC': 'Convencional',
-            'TPA': 'Plan Ahorro',
-            'F02': 'Vtas Especiales'
-        }
-        df['Tipo_Venta'] = df['Orden'].str[:3].map(sale_type_map)
+        # Calcular porcentaje acumulado hasta la fecha de corte considerando días exactos
+        porcentaje_esperado_acumulado = porcentaje_esperado(mes_actual, dia_actual)
         
-        # Filter by year if Fecha column exists
-        if 'Fecha' in df.columns:
-            df['Fecha'] = pd.to_datetime(df['Fecha'], format='%d/%m/%Y', errors='coerce')
-            df = df[df['Fecha'].dt.year == anio]
+        print(f"🗓️ Fecha: {dia_actual}/{mes_actual}/{anio} | Porcentaje esperado acumulado: {porcentaje_esperado_acumulado:.2f}%")
         
-        # Group by family and sale type
-        ventas_reales = df.groupby(['Familia', 'Tipo_Venta']).size().unstack(fill_value=0)
+        # Ventas del año hasta la fecha de corte por familia y tipo de venta (desde los acumulados diarios)
+        ventas_reales = ventas_por_familia(anio, dia_del_anio(anio, mes_actual, dia_actual))
         
         # Get plan objectives
-        conn = get_db_connection()
-        cur = conn.cursor()
+        cur = get_db_connection().cursor()
         
         cur.execute("""
             SELECT familia, convencional_objetivo, especificas_objetivo, tpa_objetivo
@@ -2645,9 +2388,6 @@ def sales_vs_plan():
                 'Plan Ahorro': row['tpa_objetivo']
             }
         
-        cur.close()
-        conn.close()
-        
         # Build comparison data with accumulated deviation logic
         familias = list(set(list(ventas_reales.index) + list(plan_data.keys())))
         resultados = []
@@ -2713,9 +2453,9 @@ def sales_vs_plan():
                     'mes': mes,
                     'nombre': ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
                               'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'][mes-1],
-                    'porcentaje': datos_mensuales[mes]['porcentaje'],
-                    'dias': datos_mensuales[mes]['dias'],
-                    'porcentaje_diario': round(datos_mensuales[mes]['porcentaje'] / datos_mensuales[mes]['dias'], 3)
+                    'porcentaje': DATOS_MENSUALES[mes]['porcentaje'],
+                    'dias': DATOS_MENSUALES[mes]['dias'],
+                    'porcentaje_diario': round(DATOS_MENSUALES[mes]['porcentaje'] / DATOS_MENSUALES[mes]['dias'], 3)
                 }
                 for mes in range(1, 13)
             ]
@@ -2728,6 +2468,69 @@ def sales_vs_plan():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+
+@app.route('/api/retail/desvio_curva', methods=['GET'])
+@login_required
+def get_desvio_curva():
+    """Curva diaria del desvío acumulado (todas las familias) por tipo de venta y total
+
+    Cada punto sale de los acumulados diarios precalculados, sin recorrer las ventas.
+    Parámetros: anio (por defecto 2025) y hasta (YYYY-MM-DD, por defecto fin de año o hoy si es el año en curso).
+    """
+    try:
+        anio = request.args.get('anio', 2025, type=int)
+        parametro_hasta = request.args.get('hasta')
+        if parametro_hasta:
+            try:
+                hasta = datetime.strptime(parametro_hasta, '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Fecha inválida (usar YYYY-MM-DD)'}), 400
+        else:
+            hasta = min(date.today(), date(anio, 12, 31))
+        if hasta.year != anio:
+            return jsonify({'success': False, 'error': 'La fecha hasta debe ser del año consultado'}), 400
+        
+        cur = get_db_connection().cursor()
+        cur.execute("""
+            SELECT COALESCE(SUM(convencional_objetivo), 0) AS convencional,
+                   COALESCE(SUM(especificas_objetivo), 0) AS especificas,
+                   COALESCE(SUM(tpa_objetivo), 0) AS tpa
+            FROM retail_plan
+            WHERE anio = %s
+        """, (anio,))
+        plan = cur.fetchone()
+        objetivos = {
+            'Convencional': plan['convencional'],
+            'Vtas Especiales': plan['especificas'],
+            'Plan Ahorro': plan['tpa']
+        }
+        
+        dias = (hasta - date(anio, 1, 1)).days + 1
+        fechas = [date(anio, 1, 1) + timedelta(days=i) for i in range(dias)]
+        porcentajes = np.array([porcentaje_esperado(f.month, f.day) for f in fechas])
+        acumuladas = ventas_acumuladas_por_dia(anio)
+        
+        def curva(real, objetivo_total):
+            # Igual que en sales_vs_plan: objetivo acumulado entero y desvío en % sobre él
+            objetivo = (objetivo_total * porcentajes / 100).astype(np.int64)
+            desvio = np.zeros(dias)
+            con_objetivo = objetivo != 0
+            desvio[con_objetivo] = np.round((real[con_objetivo] - objetivo[con_objetivo]) / objetivo[con_objetivo] * 100, 1)
+            return {'real': real.tolist(), 'objetivo_acumulado': objetivo.tolist(), 'desvio': desvio.tolist()}
+        
+        series = {tipo: curva(acumuladas[tipo][:dias], objetivos[tipo]) for tipo in NOMBRES_TIPOS}
+        series['Total'] = curva(sum(acumuladas[tipo][:dias] for tipo in NOMBRES_TIPOS), sum(objetivos.values()))
+        
+        return jsonify({
+            'success': True,
+            'anio': anio,
+            'fechas': [f.strftime('%d/%m/%Y') for f in fechas],
+            'series': series
+        })
+    except Exception as e:
+        print(f"Error en desvio_curva: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 if __name__ == '__main__':
     # Para Hugging Face Spaces, usar puerto 7860
     port = int(os.environ.get('PORT', 7860))
@@ -0,0 +1,167 @@
+"""
+Benchmark del cálculo de precios de GET /api/disponibles.
+
+Compara el bucle fila por fila original con el motor vectorizado de
+descuentos.py sobre 1k, 10k y 100k unidades sintéticas, y verifica que
+ambos produzcan exactamente el mismo JSON.
+
+Uso: python benchmark_disponibles.py [cantidad ...]
+"""
+
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+from dateutil.relativedelta import relativedelta
+
+from descuentos import calcular_precios_disponibles
+
+
+DESCUENTOS_CONFIG = {
+    'stock': {'descuento_stock': 2.5},
+    'color': {'super_blanco': 1.0, 'gris_plata': 0.0, 'rojo_metalizado': 1.5, 'negro_mica': 0.5},
+    'antiguedad': {'meses': 3.0, 'descuento': 3.0},
+}
+
+COLORES = ['SUPER BLANCO', 'Gris Plata', 'ROJO METALIZADO', 'Negro Mica', 'Blanco Perlado', '', None]
+UBICACIONES = ['STOCK MENDOZA', 'En viaje', 'Stock San Juan', 'Preventa', 'Fábrica', '', None]
+
+
+def generar_filas(cantidad, semilla=42):
+    """Filas con la misma forma que devuelve el SELECT de get_disponibles"""
+    rnd = random.Random(semilla)
+    hoy = datetime.now()
+    filas = []
+    for i in range(cantidad):
+        fecha = hoy - timedelta(days=rnd.randint(-120, 360))
+        formato = rnd.random()
+        if formato < 0.5:
+            entrega = fecha.strftime('%Y-%m-%d')
+        elif formato < 0.8:
+            entrega = fecha.strftime('%a, %d %b %Y 00:00:00 GMT')
+        elif formato < 0.9:
+            entrega = fecha.strftime('%Y-%m-%d %H:%M:%S')
+        elif formato < 0.95:
+            entrega = 'sin fecha'
+        else:
+            entrega = None
+
+        filas.append({
+            'numero_fabrica': f'YAC{i:09d}',
+            'precio_base': rnd.choice([0, None, round(rnd.uniform(20e6, 90e6), 2)]),
+            'precio_disponible': rnd.choice([None, round(rnd.uniform(20e6, 90e6), 2)]),
+            'descuento_guardado': rnd.choice([None, 0.0, 2.0, 4.5]),
+            'ubicacion': rnd.choice(UBICACIONES),
+            'color': rnd.choice(COLORES),
+            'entrega_estimada': entrega,
+        })
+    return filas
+
+
+def calcular_legacy(rows, descuentos_config):
+    """Implementación original (bucle por fila) tomada de get_disponibles"""
+    resultado = []
+    for row in rows:
+        precio_base_guardado = row.get('precio_base', 0) or row['precio_disponible'] or 0
+        descuento_individual_guardado = row.get('descuento_guardado', 0) or 0
+
+        descuento_total = descuento_individual_guardado
+        detalles_descuento = []
+
+        fecha_entrega_parsed = None
+
+        if row['entrega_estimada']:
+            try:
+                fecha_str = str(row['entrega_estimada'])
+                try:
+                    fecha_entrega_parsed = datetime.strptime(fecha_str, '%Y-%m-%d')
+                except:
+                    try:
+                        if 'GMT' in fecha_str:
+                            fecha_str_limpia = fecha_str.replace(' GMT', '').strip()
+                            fecha_entrega_parsed = datetime.strptime(fecha_str_limpia, '%a, %d %b %Y %H:%M:%S')
+                        else:
+                            fecha_entrega_parsed = datetime.fromisoformat(fecha_str.replace('GMT', '').strip())
+                    except:
+                        pass
+            except Exception:
+                pass
+
+        ubicacion_actual = (row['ubicacion'] or '').strip().upper()
+        desc_stock = descuentos_config.get('stock', {}).get('descuento_stock', 0)
+
+        if 'STOCK' in ubicacion_actual and desc_stock > 0:
+            descuento_total += desc_stock
+            detalles_descuento.append(f"Stock: {desc_stock}%")
+
+        color_original = (row['color'] or '').strip()
+        color_normalizado = color_original.lower().replace(' ', '_')
+        desc_color = descuentos_config.get('color', {}).get(color_normalizado, 0)
+        if desc_color > 0:
+            descuento_total += desc_color
+            detalles_descuento.append(f"Color: {desc_color}%")
+
+        if fecha_entrega_parsed:
+            try:
+                meses_config = descuentos_config.get('antiguedad', {}).get('meses', 3)
+                desc_antiguedad = descuentos_config.get('antiguedad', {}).get('descuento', 0)
+                fecha_limite = datetime.now() - relativedelta(months=int(meses_config))
+
+                if fecha_entrega_parsed < fecha_limite and desc_antiguedad > 0:
+                    descuento_total += desc_antiguedad
+                    detalles_descuento.append(f"Antigüedad: {desc_antiguedad}%")
+            except Exception as e:
+                print(f"❌ Error procesando antigüedad para {row['numero_fabrica']}: {e}")
+
+        precio_final = precio_base_guardado * (1 - descuento_total / 100)
+        descuento_adicional = descuento_total - descuento_individual_guardado
+
+        resultado.append((
+            round(precio_final, 2),
+            precio_base_guardado,
+            descuento_individual_guardado,
+            round(descuento_adicional, 2),
+            ', '.join(detalles_descuento) if detalles_descuento else 'Sin descuentos'
+        ))
+    return resultado
+
+
+def calcular_vectorizado(rows, descuentos_config):
+    precios = calcular_precios_disponibles(rows, descuentos_config)
+    return list(zip(
+        precios['precio_final'],
+        precios['precio_base'],
+        precios['descuento_individual'],
+        precios['descuento_adicional'],
+        precios['detalles_descuento']
+    ))
+
+
+def medir(funcion, *args, repeticiones=3):
+    mejor = None
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = perf_counter()
+        resultado = funcion(*args)
+        duracion = perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, resultado
+
+
+def main(cantidades):
+    print(f"{'unidades':>10} | {'original (s)':>12} | {'vectorizado (s)':>15} | {'speedup':>7}")
+    print('-' * 55)
+    for cantidad in cantidades:
+        filas = generar_filas(cantidad)
+        t_legacy, r_legacy = medir(calcular_legacy, filas, DESCUENTOS_CONFIG)
+        t_nuevo, r_nuevo = medir(calcular_vectorizado, filas, DESCUENTOS_CONFIG)
+
+        if json.dumps(r_legacy, ensure_ascii=False) != json.dumps(r_nuevo, ensure_ascii=False):
+            raise SystemExit(f"❌ Los resultados difieren con {cantidad} unidades")
+
+        print(f"{cantidad:>10} | {t_legacy:>12.3f} | {t_nuevo:>15.3f} | {t_legacy / t_nuevo:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000])
@@ -0,0 +1,116 @@
+"""
+Benchmark de serialización JSON de los endpoints más pesados.
+
+Compara el provider por defecto de Flask con JSONProviderRapido (orjson)
+sobre payloads sintéticos con la forma y el tamaño de las respuestas reales:
+serie de patentamientos por modelo (3650 modelos x 131 meses, como el CSV de
+Mercado Argentino MODELO), matriz BI de get_saved_data, disponibles y
+preventa. Verifica que ambos produzcan el mismo JSON.
+
+Uso: python benchmark_json.py
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import serializacion
+from serializacion import JSONProviderRapido
+
+MESES = 131
+MODELOS = 3650
+
+
+def payload_patentamientos(rnd):
+    labels = [f'{(i % 12) + 1:02d}/{15 + i // 12:02d}' for i in range(MESES)]
+    modelos = [
+        {'nombre': f'MODELO {i} 1.6 MT', 'valores': [rnd.randint(0, 900) for _ in range(MESES)]}
+        for i in range(MODELOS)
+    ]
+    top5 = [{'nombre': m['nombre'], 'cantidad': m['valores'][-1]} for m in modelos[:5]]
+    return {'success': True, 'data': {'labels': labels, 'modelos': modelos, 'top5_ultimo_mes': top5}}
+
+
+def payload_matriz_bi(rnd):
+    headers = ['Marca/Modelo'] + [f'ene-{15 + i // 12}' for i in range(MESES)]
+    rows = [[f'MODELO {i}'] + [rnd.randint(0, 900) for _ in range(MESES)] for i in range(MODELOS)]
+    return {'success': True, 'hasData': True, 'headers': headers, 'rows': rows,
+            'totalRecords': MODELOS * MESES, 'lastUpdate': '2025-11-19 10:00:00'}
+
+
+def payload_disponibles(rnd, cantidad=5000):
+    hoy = datetime(2025, 11, 19)
+    return [
+        {
+            'numero_fabrica': f'YAC{i:09d}', 'numero_chasis': f'8AJ{i:014d}',
+            'modelo_version': 'HILUX 2.8 TDI DC 4X4 SRV A/T', 'color': 'SUPER BLANCO',
+            'fecha_finanzas': (hoy - timedelta(days=i % 90)).strftime('%a, %d %b %Y 00:00:00 GMT'),
+            'despacho_estimado': (hoy + timedelta(days=i % 60)).strftime('%a, %d %b %Y 00:00:00 GMT'),
+            'entrega_estimada': (hoy + timedelta(days=30 + i % 60)).strftime('%a, %d %b %Y 00:00:00 GMT'),
+            'fecha_recepcion': None, 'ubicacion': rnd.choice(['STOCK MENDOZA', 'EN VIAJE']),
+            'dias_stock': str(i % 300), 'precio_disponible': round(rnd.uniform(20e6, 90e6), 2),
+            'precio_base': round(rnd.uniform(20e6, 90e6), 2), 'descuento_individual': 2.5,
+            'descuento_adicional': 1.5, 'detalles_descuento': 'Stock: 1.5%', 'cod_cliente': None,
+            'cliente': None, 'vendedor': 'VENDEDOR 1', 'operacion': None, 'familia': 'HILUX',
+        }
+        for i in range(cantidad)
+    ]
+
+
+def payload_preventa(rnd, cantidad=2000):
+    return [
+        {
+            'id': i, 'numero_fabrica': 'YAC999999999', 'modelo_version': 'COROLLA CROSS XEI HEV',
+            'operacion': f'OP-{i}', 'vendedor': 'VENDEDOR 1', 'color': 'GRIS PLATA',
+            'informado': rnd.randint(0, 1), 'cancelado': 0, 'asignado': rnd.randint(0, 1),
+        }
+        for i in range(cantidad)
+    ]
+
+
+def medir(app, payload, repeticiones=5):
+    mejor = None
+    cuerpo = None
+    with app.app_context():
+        for _ in range(repeticiones):
+            inicio = perf_counter()
+            cuerpo = app.json.response(payload).get_data()
+            duracion = perf_counter() - inicio
+            mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, cuerpo
+
+
+def main():
+    if serializacion.orjson is None:
+        print("⚠️ orjson no está instalado: JSONProviderRapido usa json estándar")
+
+    app_flask = Flask('flask_default')
+    app_flask.json = DefaultJSONProvider(app_flask)
+    app_rapida = Flask('orjson')
+    app_rapida.json = JSONProviderRapido(app_rapida)
+
+    rnd = random.Random(42)
+    payloads = [
+        ('patentamientos modelo', payload_patentamientos(rnd)),
+        ('matriz BI', payload_matriz_bi(rnd)),
+        ('disponibles', payload_disponibles(rnd)),
+        ('preventa', payload_preventa(rnd)),
+    ]
+
+    print(f"{'endpoint':>22} | {'MB':>5} | {'flask (ms)':>10} | {'orjson (ms)':>11} | {'speedup':>7}")
+    print('-' * 68)
+    for nombre, payload in payloads:
+        t_flask, c_flask = medir(app_flask, payload)
+        t_rapido, c_rapido = medir(app_rapida, payload)
+        if json.loads(c_flask) != json.loads(c_rapido):
+            raise SystemExit(f"❌ El JSON de {nombre} difiere entre providers")
+        print(f"{nombre:>22} | {len(c_rapido) / 1e6:>5.1f} | {t_flask * 1000:>10.1f} | "
+              f"{t_rapido * 1000:>11.1f} | {t_flask / t_rapido:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark de get_datos_por_modelo / get_datos_por_marca sobre los CSV de Patentamientos/.
+
+Compara las funciones originales (df.iterrows con conversión celda por celda)
+con las versiones NumPy sobre la matriz de la caché columnar, y verifica:
+- que con los parámetros por defecto la salida sea idéntica a la original;
+- que el Top N de cualquier mes coincida con un sort estable en Python.
+
+Uso: python benchmark_patentamientos.py
+"""
+
+import json
+from time import perf_counter
+
+import pandas as pd
+
+from patentamientos import (
+    ARCHIVOS_PATENTAMIENTOS, cargar_matriz, formatear_fechas, get_datos_por_marca, get_datos_por_modelo,
+    leer_csv, ruta_csv
+)
+
+
+def marca_legacy(df, nombres_col, fecha_cols, fechas_formateadas):
+    """get_datos_por_marca original"""
+    marcas = ['TOYOTA', 'FORD', 'FIAT', 'VOLKSWAGEN', 'CHEVROLET', 'PEUGEOT']
+    result = {'labels': fechas_formateadas}
+    for marca in marcas:
+        result[marca.lower()] = [0] * len(fecha_cols)
+    result['otros'] = [0] * len(fecha_cols)
+    for idx, row in df.iterrows():
+        nombre = str(row[nombres_col]).upper().strip()
+        for i, fecha_col in enumerate(fecha_cols):
+            valor = row[fecha_col]
+            try:
+                cantidad = int(float(valor)) if pd.notna(valor) else 0
+            except Exception:
+                cantidad = 0
+            marca_encontrada = False
+            for marca in marcas:
+                if marca in nombre:
+                    result[marca.lower()][i] += cantidad
+                    marca_encontrada = True
+                    break
+            if not marca_encontrada:
+                result['otros'][i] += cantidad
+    return result
+
+
+def modelo_legacy(df, nombres_col, fecha_cols, fechas_formateadas):
+    """get_datos_por_modelo original"""
+    ultima_col = fecha_cols[-1]
+    modelos_ultimo_mes = []
+    for idx, row in df.iterrows():
+        nombre = str(row[nombres_col]).strip()
+        valor = row[ultima_col]
+        try:
+            cantidad = int(float(valor)) if pd.notna(valor) else 0
+        except Exception:
+            cantidad = 0
+        if cantidad > 0:
+            modelos_ultimo_mes.append({'nombre': nombre, 'cantidad': cantidad})
+    modelos_ultimo_mes.sort(key=lambda x: x['cantidad'], reverse=True)
+    top5_ultimo_mes = modelos_ultimo_mes[:5]
+
+    modelos = []
+    for idx, row in df.iterrows():
+        nombre = str(row[nombres_col]).strip()
+        valores = []
+        for fecha_col in fecha_cols:
+            valor = row[fecha_col]
+            try:
+                cantidad = int(float(valor)) if pd.notna(valor) else 0
+            except Exception:
+                cantidad = 0
+            valores.append(cantidad)
+        modelos.append({'nombre': nombre, 'valores': valores})
+    return {'labels': fechas_formateadas, 'modelos': modelos, 'top5_ultimo_mes': top5_ultimo_mes}
+
+
+def top_referencia(nombres, filas, columna, top_n):
+    candidatos = [(n.strip(), f[columna]) for n, f in zip(nombres, filas) if f[columna] > 0]
+    candidatos.sort(key=lambda x: x[1], reverse=True)
+    return [{'nombre': n, 'cantidad': c} for n, c in candidatos[:top_n]]
+
+
+def medir(funcion, *args, repeticiones=3):
+    mejor = None
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = perf_counter()
+        resultado = funcion(*args)
+        duracion = perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, resultado
+
+
+def main():
+    print(f"{'archivo':>30} | {'filas':>5} | {'original (s)':>12} | {'numpy (s)':>9} | {'speedup':>7}")
+    print('-' * 76)
+    for archivo in ARCHIVOS_PATENTAMIENTOS:
+        df = leer_csv(ruta_csv(archivo))
+        fecha_cols = df.columns[1:]
+        fechas = formatear_fechas(fecha_cols)
+        matriz = cargar_matriz(archivo)
+        columnas = matriz['columnas'].tolist()
+
+        if 'MARCA' in archivo:
+            t_legacy, r_legacy = medir(marca_legacy, df, df.columns[0], fecha_cols, fechas)
+            t_nuevo, r_nuevo = medir(get_datos_por_marca, matriz['nombres'], matriz['valores'], fechas)
+        else:
+            t_legacy, r_legacy = medir(modelo_legacy, df, df.columns[0], fecha_cols, fechas)
+            t_nuevo, r_nuevo = medir(get_datos_por_modelo, matriz['nombres'], matriz['valores'], fechas)
+
+            # Top N y mes de referencia arbitrarios contra un sort estable
+            nombres = matriz['nombres'].tolist()
+            filas = matriz['valores'].tolist()
+            for top_n in (1, 5, 10, 50):
+                for columna in range(0, len(columnas), 7):
+                    resultado = get_datos_por_modelo(
+                        matriz['nombres'], matriz['valores'], fechas,
+                        top_n=top_n, mes_referencia=fechas[columna], columnas=columnas
+                    )
+                    if resultado['top5_ultimo_mes'] != top_referencia(nombres, filas, columna, top_n):
+                        raise SystemExit(f"❌ Top {top_n} de {columnas[columna]} difiere en {archivo}")
+
+        if json.dumps(r_legacy) != json.dumps(r_nuevo):
+            raise SystemExit(f"❌ La salida difiere de la original en {archivo}")
+
+        print(f"{archivo:>30} | {len(df):>5} | {t_legacy:>12.3f} | {t_nuevo:>9.4f} | {t_legacy / t_nuevo:>6.0f}x")
+
+    print("✅ Salidas idénticas a la implementación original")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark del cálculo de precios de /procesar_excel.
+
+Genera una planilla de fábrica sintética de 50k filas (mismo formato que la
+real: 8 filas de encabezado y columna C vacía), la normaliza y compara el
+df.apply fila por fila original con aplicar_precios_planilla, verificando que
+las tres columnas de precio sean idénticas. Los prints del código original se
+envían a /dev/null (en producción van a stdout y cuestan bastante más).
+
+Uso: python benchmark_procesar_excel.py [filas]
+"""
+
+import contextlib
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from planilla_fabrica import (
+    COLUMNAS_PRECIO, leer_planilla, normalizar_planilla, precios_desde_filas, aplicar_precios_planilla
+)
+
+
+MODELOS = [f'HILUX 2.8 TDI DC 4X4 SRV {i} A/T' for i in range(60)] + [
+    f'COROLLA CROSS XEI {i} HEV' for i in range(40)
+]
+
+
+def generar_precios(semilla=7):
+    rnd = random.Random(semilla)
+    return [
+        {
+            'modelo': modelo,
+            'precio_ars': round(rnd.uniform(20e6, 90e6), 2),
+            'descuento': rnd.choice([None, 0.0, 1.5, 3.0]),
+            'descuento_futuro': rnd.choice([None, 0.0, 2.0, 5.0]),
+        }
+        for modelo in MODELOS
+    ]
+
+
+def generar_planilla(ruta, filas, semilla=42):
+    """Escribir la planilla con el formato de fábrica (8 filas de encabezado)"""
+    rnd = random.Random(semilla)
+    hoy = datetime.now()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for i in range(8):
+        ws.append([f'Encabezado {i}'])
+    prefijos = ['YAC1250', 'TPA1250', 'F1250']
+    for i in range(filas):
+        despacho = rnd.choice([None, hoy + timedelta(days=rnd.randint(-200, 200))])
+        modelo = rnd.choice(MODELOS + [None, 'MODELO DESCONOCIDO', ' ' + MODELOS[0] + ' '])
+        ws.append([
+            f'{rnd.choice(prefijos)}{i:05d}', f'CH{i:08d}', None, modelo, rnd.choice(['SUPER BLANCO', 'GRIS PLATA']),
+            hoy - timedelta(days=rnd.randint(0, 90)), despacho, None,
+            None, rnd.choice(['STOCK MENDOZA', 'EN VIAJE']), rnd.randint(0, 300), 0,
+            None, None, rnd.choice([None, 'VENDEDOR 1']), rnd.choice([None, 'OP-1']),
+        ])
+    wb.save(ruta)
+
+
+def calcular_legacy(df, precios_rows):
+    """Implementación original (df.apply con prints por fila) tomada de procesar_excel"""
+    precios_data = {}
+    for row in precios_rows:
+        modelo = row['modelo']
+        precio_ars = row['precio_ars'] or 0
+        descuento = row['descuento'] or 0
+        descuento_futuro = row.get('descuento_futuro', 0) or 0
+        precios_data[modelo] = {'precio_ars': precio_ars, 'descuento': descuento, 'descuento_futuro': descuento_futuro}
+        print(f"🔧 Cargado: {modelo[:40]:40} | Precio: ${precio_ars:,.0f} | Desc: {descuento}% | Desc.Futuro: {descuento_futuro}%")
+
+    hoy = datetime.now()
+    hoy_ym = (hoy.year, hoy.month)
+
+    def calcular_precio_con_descuento(row):
+        modelo = row['Modelo/Versión']
+        despacho_estimado = row['Despacho Estimado']
+        numero_fabrica = row.get('Nº Fábrica', 'N/A')
+        vacio = pd.Series({'Precio p/ Disponible': 0, 'Precio Base': 0, 'Descuento Aplicado (%)': 0})
+
+        if pd.isna(modelo):
+            print(f"⚠️ Modelo vacío, saltando...")
+            return vacio
+        modelo_str = str(modelo).strip()
+        if modelo_str not in precios_data:
+            print(f"⚠️ Modelo '{modelo_str}' NO encontrado en precios_data")
+            return vacio
+
+        precio_base = precios_data[modelo_str]['precio_ars']
+        descuento_individual = precios_data[modelo_str]['descuento']
+        descuento_futuro = precios_data[modelo_str]['descuento_futuro']
+        print(f"🔍 {modelo_str[:40]:40} | Nº Fábrica: {numero_fabrica}")
+        print(f"   Precio Base: ${precio_base:,.0f}")
+        print(f"   Desc Individual: {descuento_individual}%")
+        print(f"   Desc Futuro: {descuento_futuro}%")
+
+        es_futuro = False
+        if not pd.isna(despacho_estimado):
+            despacho_ym = (despacho_estimado.year, despacho_estimado.month)
+            print(f"   Fecha Despacho: {despacho_ym} vs Hoy: {hoy_ym}")
+            es_futuro = despacho_ym > hoy_ym
+
+        descuento_aplicar = descuento_futuro if es_futuro else descuento_individual
+        precio_final = precio_base * (1 - descuento_aplicar / 100)
+        print(f"   💰 Descuento aplicado: {descuento_aplicar}% -> Precio Final: ${precio_final:,.0f}")
+        print("")
+        return pd.Series({
+            'Precio p/ Disponible': precio_final,
+            'Precio Base': precio_base,
+            'Descuento Aplicado (%)': descuento_aplicar
+        })
+
+    resultado = df.apply(calcular_precio_con_descuento, axis=1)
+    return resultado[COLUMNAS_PRECIO]
+
+
+def calcular_vectorizado(df, precios_rows):
+    df = df.copy()
+    aplicar_precios_planilla(df, precios_desde_filas(precios_rows))
+    return df[COLUMNAS_PRECIO]
+
+
+def main(filas):
+    precios_rows = generar_precios()
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, 'planilla.xlsx')
+        inicio = perf_counter()
+        generar_planilla(ruta, filas)
+        print(f"📄 Planilla de {filas} filas generada en {perf_counter() - inicio:.1f}s")
+
+        inicio = perf_counter()
+        with open(ruta, 'rb') as archivo:
+            df = normalizar_planilla(leer_planilla(archivo))
+        print(f"📖 Lectura en memoria y normalización: {perf_counter() - inicio:.2f}s")
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        inicio = perf_counter()
+        r_legacy = calcular_legacy(df, precios_rows)
+        t_legacy = perf_counter() - inicio
+
+    inicio = perf_counter()
+    r_nuevo = calcular_vectorizado(df, precios_rows)
+    t_nuevo = perf_counter() - inicio
+
+    if not np.array_equal(r_legacy.to_numpy(dtype=float), r_nuevo.to_numpy(dtype=float)):
+        raise SystemExit("❌ Los precios difieren entre la versión original y la vectorizada")
+
+    print(f"{'filas':>8} | {'df.apply (s)':>12} | {'vectorizado (s)':>15} | {'speedup':>7}")
+    print('-' * 53)
+    print(f"{filas:>8} | {t_legacy:>12.3f} | {t_nuevo:>15.3f} | {t_legacy / t_nuevo:>6.0f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
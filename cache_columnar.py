@@ -0,0 +1,98 @@
+"""
+Caché columnar de archivos fuente (CSV/Excel) ya parseados
+Guarda los arrays de NumPy en un .npz al lado del archivo y lo reutiliza mientras el archivo no cambie
+"""
+
+import os
+import threading
+import numpy as np
+
+DIRECTORIO_CACHE = '.cache'
+
+_memoria = {}  # ruta -> (clave, arrays)
+_lock = threading.Lock()
+
+
+def clave_archivo(ruta):
+    """Identifica una versión del archivo: ruta absoluta, tamaño y mtime en nanosegundos"""
+    stat = os.stat(ruta)
+    return f'{os.path.abspath(ruta)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def ruta_cache(ruta):
+    directorio, nombre = os.path.split(os.path.abspath(ruta))
+    return os.path.join(directorio, DIRECTORIO_CACHE, nombre + '.npz')
+
+
+def _leer_npz(ruta_npz, clave, formato):
+    """Arrays del .npz si corresponden a `clave` y `formato` (con clave None, los de cualquier versión del archivo)"""
+    try:
+        with np.load(ruta_npz, allow_pickle=False) as datos:
+            formato_guardado = int(datos['__formato__']) if '__formato__' in datos.files else 1
+            if formato_guardado != formato or (clave is not None and str(datos['__clave__']) != clave):
+                return None
+            return {nombre: datos[nombre] for nombre in datos.files if nombre not in ('__clave__', '__formato__')}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _escribir_npz(ruta_npz, clave, formato, arrays):
+    """Escritura atómica: otros procesos nunca ven un .npz a medio escribir"""
+    try:
+        os.makedirs(os.path.dirname(ruta_npz), exist_ok=True)
+        temporal = f'{ruta_npz}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporal, 'wb') as f:
+            np.savez(f, __clave__=np.array(clave), __formato__=np.array(formato), **arrays)
+        os.replace(temporal, ruta_npz)
+    except OSError as e:
+        # Sin permisos de escritura: se sigue con la copia en memoria
+        print(f"⚠️ No se pudo guardar la caché columnar {ruta_npz}: {e}")
+
+
+def cargar(ruta, construir, actualizar=None, formato=1):
+    """Arrays parseados de `ruta`, reconstruidos con `construir(ruta)` solo si el archivo cambió.
+
+    `construir` devuelve un dict {nombre: np.ndarray} (sin arrays de objetos).
+    Busca primero en memoria, después en el .npz y recién entonces parsea.
+    Si el archivo cambió y hay una versión anterior, se prueba primero
+    `actualizar(ruta, anteriores)`, que puede devolver los arrays nuevos a
+    partir de los anteriores (por ejemplo si solo se agregaron filas) o None
+    para reconstruir todo. `formato` se sube cuando cambian los arrays que
+    devuelve `construir`: los .npz de otro formato se descartan.
+    Los arrays devueltos son compartidos: no modificarlos.
+    """
+    clave = clave_archivo(ruta)
+
+    with _lock:
+        en_memoria = _memoria.get(ruta)
+    if en_memoria is not None and en_memoria[0] == clave:
+        return en_memoria[1]
+
+    ruta_npz = ruta_cache(ruta)
+    arrays = _leer_npz(ruta_npz, clave, formato)
+    if arrays is None:
+        anteriores = None
+        if actualizar is not None:
+            anteriores = en_memoria[1] if en_memoria is not None else _leer_npz(ruta_npz, None, formato)
+        if anteriores is not None:
+            arrays = actualizar(ruta, anteriores)
+        if arrays is not None:
+            print(f"💾 Caché columnar actualizada incrementalmente: {os.path.basename(ruta)}")
+        else:
+            arrays = construir(ruta)
+            print(f"💾 Caché columnar regenerada: {os.path.basename(ruta)}")
+        arrays = {nombre: np.asarray(valor) for nombre, valor in arrays.items()}
+        _escribir_npz(ruta_npz, clave, formato, arrays)
+
+    with _lock:
+        _memoria[ruta] = (clave, arrays)
+    return arrays
+
+
+def invalidar(ruta=None):
+    """Olvidar la copia en memoria (el .npz se valida solo contra el archivo)"""
+    with _lock:
+        if ruta is None:
+            _memoria.clear()
+        else:
+            _memoria.pop(ruta, None)
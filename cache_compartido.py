@@ -0,0 +1,221 @@
+"""
+Caché compartida entre workers (gunicorn / varios procesos)
+Las entradas viven fuera del proceso y cada espacio de nombres tiene una versión:
+invalidar cambia la versión y todos los workers dejan de ver las entradas anteriores
+"""
+
+import hashlib
+import os
+import pickle
+import stat
+import threading
+import uuid
+from collections import OrderedDict
+from time import time
+
+# Directorio propio de la aplicación (no uno compartido como /tmp): las entradas se deserializan con pickle
+DIRECTORIO_CACHE_COMPARTIDO = os.environ.get(
+    'CACHE_COMPARTIDO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'compartido')
+)
+
+
+class BackendArchivos:
+    """Backend en disco local, compartido por todos los workers de la máquina.
+
+    Cualquier backend con leer/escribir/limpiar/podar (por ejemplo uno sobre
+    Redis) puede reemplazarlo sin cambiar CacheCompartida.
+
+    Solo usa el directorio si es del usuario del proceso y nadie más puede
+    escribir en él: si no, la caché queda deshabilitada (sin leer nada de ahí).
+    """
+
+    def __init__(self, directorio=DIRECTORIO_CACHE_COMPARTIDO):
+        self.directorio = directorio
+        self._seguro = None
+
+    def _directorio_seguro(self):
+        if self._seguro is None:
+            try:
+                os.makedirs(self.directorio, mode=0o700, exist_ok=True)
+                info = os.lstat(self.directorio)
+                propio = not hasattr(os, 'getuid') or info.st_uid == os.getuid()
+                self._seguro = stat.S_ISDIR(info.st_mode) and propio and not info.st_mode & 0o022
+            except OSError:
+                self._seguro = False
+            if not self._seguro:
+                print(f"⚠️ Caché compartida deshabilitada: {self.directorio} no es un directorio propio "
+                      f"o otros usuarios pueden escribir en él")
+        return self._seguro
+
+    def _ruta(self, espacio, clave):
+        nombre = hashlib.sha1(clave.encode('utf-8')).hexdigest()
+        return os.path.join(self.directorio, espacio, nombre)
+
+    def leer(self, espacio, clave):
+        if not self._directorio_seguro():
+            return None
+        try:
+            with open(self._ruta(espacio, clave), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def escribir(self, espacio, clave, datos):
+        """Escritura atómica (archivo temporal + os.replace)"""
+        if not self._directorio_seguro():
+            return
+        ruta = self._ruta(espacio, clave)
+        os.makedirs(os.path.dirname(ruta), mode=0o700, exist_ok=True)
+        temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporal, 'wb') as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+
+    def limpiar(self, espacio, conservar=()):
+        """Borrar las entradas del espacio salvo las claves de `conservar`"""
+        directorio = os.path.join(self.directorio, espacio)
+        conservar = {os.path.basename(self._ruta(espacio, clave)) for clave in conservar}
+        try:
+            nombres = os.listdir(directorio)
+        except OSError:
+            return
+        for nombre in nombres:
+            if nombre not in conservar:
+                try:
+                    os.remove(os.path.join(directorio, nombre))
+                except OSError:
+                    pass
+
+    def podar(self, espacio, antiguedad, conservar=()):
+        """Borrar las entradas del espacio escritas hace más de `antiguedad` segundos (ya vencidas)"""
+        directorio = os.path.join(self.directorio, espacio)
+        conservar = {os.path.basename(self._ruta(espacio, clave)) for clave in conservar}
+        limite = time() - antiguedad
+        try:
+            nombres = os.listdir(directorio)
+        except OSError:
+            return 0
+        borradas = 0
+        for nombre in nombres:
+            if nombre in conservar:
+                continue
+            ruta = os.path.join(directorio, nombre)
+            try:
+                if os.stat(ruta).st_mtime < limite:
+                    os.remove(ruta)
+                    borradas += 1
+            except OSError:
+                pass
+        return borradas
+
+
+class CacheCompartida:
+    """Caché con TTL de un espacio de nombres, visible para todos los workers.
+
+    Las claves se guardan con la versión vigente del espacio; invalidar() la
+    reemplaza, así que una invalidación en cualquier worker vale para todos.
+    Cada proceso además guarda en memoria las últimas entradas leídas y, al
+    guardar, cada tanto borra del backend las entradas vencidas.
+    """
+
+    CLAVE_VERSION = '__version__'
+    # Cada cuántos segundos (como máximo) un proceso poda las entradas vencidas
+    INTERVALO_PODA = 300
+
+    def __init__(self, espacio, ttl, backend=None, max_en_memoria=64):
+        self.espacio = espacio
+        self.ttl = ttl
+        self.backend = backend or BackendArchivos()
+        self.max_en_memoria = max_en_memoria
+        self._memoria = OrderedDict()  # (version, clave) -> (expira, valor)
+        self._lock = threading.Lock()
+        self._proxima_poda = 0
+
+    def version(self):
+        datos = self.backend.leer(self.espacio, self.CLAVE_VERSION)
+        return datos.decode('ascii') if datos else '0'
+
+    def obtener(self, clave, version=None):
+        """Valor vigente de `clave` o None si no está o venció"""
+        version = version or self.version()
+        ahora = time()
+
+        with self._lock:
+            entrada = self._memoria.get((version, clave))
+            if entrada is not None and entrada[0] > ahora:
+                self._memoria.move_to_end((version, clave))
+                return entrada[1]
+
+        datos = self.backend.leer(self.espacio, f'{version}:{clave}')
+        if datos is None:
+            return None
+        try:
+            expira, valor = pickle.loads(datos)
+        except Exception:
+            return None
+        if expira <= ahora:
+            return None
+
+        self._recordar(version, clave, expira, valor)
+        return valor
+
+    def guardar(self, clave, valor, version=None):
+        """Guardar `valor` con la versión indicada (la que se leyó antes de calcularlo)"""
+        version = version or self.version()
+        expira = time() + self.ttl
+        try:
+            self.backend.escribir(
+                self.espacio, f'{version}:{clave}', pickle.dumps((expira, valor), pickle.HIGHEST_PROTOCOL)
+            )
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar en la caché compartida '{self.espacio}': {e}")
+        self._recordar(version, clave, expira, valor)
+        self._podar_si_corresponde()
+
+    def obtener_o_calcular(self, clave, calcular):
+        """Devuelve (valor, desde_cache). Si se invalida mientras se calcula, el
+        resultado queda guardado con la versión vieja y nadie lo vuelve a servir."""
+        version = self.version()
+        valor = self.obtener(clave, version)
+        if valor is not None:
+            return valor, True
+        valor = calcular()
+        self.guardar(clave, valor, version)
+        return valor, False
+
+    def invalidar(self):
+        """Nueva versión del espacio: todos los workers descartan lo anterior"""
+        nueva = uuid.uuid4().hex
+        self.backend.escribir(self.espacio, self.CLAVE_VERSION, nueva.encode('ascii'))
+        self.backend.limpiar(self.espacio, conservar=[self.CLAVE_VERSION])
+        with self._lock:
+            self._memoria.clear()
+        print(f"🗑️ Caché compartida '{self.espacio}' invalidada")
+
+    def podar(self):
+        """Borrar del backend las entradas vencidas (de cualquier versión) y los temporales abandonados"""
+        podar = getattr(self.backend, 'podar', None)
+        if podar is None:
+            return 0
+        borradas = podar(self.espacio, self.ttl, conservar=[self.CLAVE_VERSION])
+        if borradas:
+            print(f"🧹 Caché compartida '{self.espacio}': {borradas} entradas vencidas borradas")
+        return borradas
+
+    def _podar_si_corresponde(self):
+        ahora = time()
+        with self._lock:
+            if ahora < self._proxima_poda:
+                return
+            self._proxima_poda = ahora + min(self.ttl, self.INTERVALO_PODA)
+        try:
+            self.podar()
+        except OSError as e:
+            print(f"⚠️ No se pudo podar la caché compartida '{self.espacio}': {e}")
+
+    def _recordar(self, version, clave, expira, valor):
+        with self._lock:
+            self._memoria[(version, clave)] = (expira, valor)
+            self._memoria.move_to_end((version, clave))
+            while len(self._memoria) > self.max_en_memoria:
+                self._memoria.popitem(last=False)
@@ -0,0 +1,267 @@
+"""
+Carga de las planillas de patentamientos de BI (/api/bi/upload_databases)
+Cada planilla ancha (nombre + una columna por mes) se pasa a formato largo en un solo paso vectorizado;
+las cuatro se parsean en procesos separados (un pool por upload), se copian en paralelo a tablas nuevas
+(cada una por su conexión) y reemplazan a las actuales por rename
+"""
+
+import io
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from dateutil import parser as date_parser
+
+from db_config import copy_dataframe, db_connection
+from planilla_fabrica import leer_excel
+
+# Tabla destino de cada archivo, en el orden de carga
+TABLAS_BI = {
+    'argentina-marca': 'bi_patentamientos_argentina_marca',
+    'argentina-modelo': 'bi_patentamientos_argentina_modelo',
+    'mendoza-marca': 'bi_patentamientos_mendoza_marca',
+    'mendoza-modelo': 'bi_patentamientos_mendoza_modelo'
+}
+
+# Nombres de meses en español (completos y abreviados)
+MESES_ES = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
+    'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
+    'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
+    'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4,
+    'may': 5, 'jun': 6, 'jul': 7, 'ago': 8,
+    'sep': 9, 'oct': 10, 'nov': 11, 'dic': 12
+}
+
+
+def _anio(texto):
+    anio = texto.strip()
+    if len(anio) == 2:
+        anio = '20' + anio
+    if len(anio) != 4 or not anio.isdigit():
+        raise ValueError(f"Año inválido: '{texto}'")
+    return int(anio)
+
+
+def parsear_fecha_columna(columna):
+    """Primer día del mes de un encabezado ('enero-15', 'ene-15', '01/15', fecha de Excel o texto libre).
+
+    Devuelve None si el encabezado no es una fecha reconocible.
+    """
+    # Excel suele entregar los encabezados de fecha como datetime
+    if isinstance(columna, (datetime, date)):
+        return date(columna.year, columna.month, 1)
+
+    fecha_str = str(columna).strip().lower()
+    try:
+        # "enero-15" o "ene-15"
+        if '-' in fecha_str:
+            mes_nombre, anio = fecha_str.split('-', 1)
+            mes = MESES_ES.get(mes_nombre.strip())
+            if mes is None:
+                # Mes no reconocido: no se deja adivinar al parser de texto libre
+                return None
+            return date(_anio(anio), mes, 1)
+
+        # "01/15" o "1/15"
+        elif '/' in fecha_str:
+            mes, anio = fecha_str.split('/', 1)
+            return date(_anio(anio), int(mes), 1)
+
+        # Texto libre: día primero, salvo que empiece por el año ('2024.03.01')
+        fecha_obj = date_parser.parse(fecha_str, dayfirst=not fecha_str[:4].isdigit())
+        return date(fecha_obj.year, fecha_obj.month, 1)
+    except (ValueError, OverflowError):
+        return None
+
+
+def parsear_planilla_bi(archivo):
+    """Planilla ancha -> DataFrame largo (nombre, fecha, cantidad) y un resumen con tiempos.
+
+    Los encabezados se parsean una vez por columna; las columnas que no son
+    fechas se descartan. Cantidades vacías o no numéricas quedan en 0 (se
+    acepta coma decimal y se trunca como int(float(...))). Si un nombre se
+    repite para el mismo mes, las cantidades se suman.
+    """
+    inicio = perf_counter()
+    df = leer_excel(archivo, dtype=str)
+    tiempo_lectura = perf_counter() - inicio
+
+    inicio = perf_counter()
+    nombre_columna = df.columns[0]
+
+    columnas_validas = []
+    fechas = []
+    descartadas = []
+    for columna in df.columns[1:]:
+        fecha = parsear_fecha_columna(columna)
+        if fecha is None:
+            descartadas.append(str(columna))
+        else:
+            columnas_validas.append(columna)
+            fechas.append(fecha)
+    if descartadas:
+        print(f"   ⚠️ Columnas sin fecha reconocible (descartadas): {descartadas}")
+
+    # Saltar filas sin nombre
+    nombres = df[nombre_columna].astype(str).str.strip()
+    filas_validas = (nombres != '') & (nombres != 'nan') & df[nombre_columna].notna()
+    nombres = nombres[filas_validas].to_numpy()
+
+    celdas = pd.Series(df.loc[filas_validas, columnas_validas].to_numpy(dtype=object).ravel(), dtype=object)
+    cantidades = pd.to_numeric(
+        celdas.str.strip().str.replace(',', '.', regex=False), errors='coerce'
+    ).to_numpy(dtype=float, copy=True)
+    cantidades[~np.isfinite(cantidades)] = 0
+    matriz = np.trunc(cantidades).astype(np.int64).reshape(len(nombres), len(fechas))
+
+    # Nombres o meses repetidos chocarían con UNIQUE(nombre, fecha): se suman
+    codigos_nombre, nombres = pd.factorize(nombres)
+    codigos_fecha, fechas = pd.factorize(np.array(fechas, dtype=object))
+    repetidos = matriz.size - len(nombres) * len(fechas)
+    if repetidos:
+        print(f"   ⚠️ {repetidos} celdas con nombre y mes repetidos: se suman las cantidades")
+        agrupada = np.zeros((len(nombres), len(fechas)), dtype=np.int64)
+        np.add.at(agrupada, (codigos_nombre[:, None], codigos_fecha[None, :]), matriz)
+        matriz = agrupada
+
+    # Formato largo en un solo paso: cada nombre repetido por cada mes
+    largo = pd.DataFrame({
+        'nombre': np.repeat(nombres, len(fechas)),
+        'fecha': np.tile(fechas, len(nombres)),
+        'cantidad': matriz.ravel(),
+    })
+
+    resumen = {
+        'filas': int(filas_validas.sum()),
+        'meses': len(fechas),
+        'columnas_descartadas': descartadas,
+        'registros': int(len(largo)),
+        'lectura': round(tiempo_lectura, 3),
+        'transformacion': round(perf_counter() - inicio, 3),
+    }
+    return largo, resumen
+
+
+def _parsear_contenido(contenido):
+    """Punto de entrada en el proceso hijo: recibe los bytes del archivo"""
+    return parsear_planilla_bi(io.BytesIO(contenido))
+
+
+def parsear_planillas(contenidos):
+    """{file_key: bytes} -> {file_key: (largo, resumen)}, una planilla por proceso.
+
+    El pool se crea para este upload y se cierra al terminar. Con una sola
+    CPU o una sola planilla, o si no se pueden crear procesos (hosting sin
+    spawn, pool roto), se parsean en este mismo proceso, una después de otra.
+    """
+    procesos = min(len(contenidos), os.cpu_count() or 1)
+    if procesos > 1:
+        try:
+            # spawn: hacer fork de un worker con threads (pool de conexiones, Flask) no es seguro
+            with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futuros = {file_key: pool.submit(_parsear_contenido, contenido) for file_key, contenido in contenidos.items()}
+                return {file_key: futuro.result() for file_key, futuro in futuros.items()}
+        except (BrokenProcessPool, OSError, NotImplementedError) as e:
+            print(f"⚠️ Parseo en paralelo no disponible ({e}), parseando en el proceso actual")
+    return {file_key: _parsear_contenido(contenido) for file_key, contenido in contenidos.items()}
+
+
+def _copiar_a_staging(tabla, staging, largo):
+    """Crear la tabla de staging como copia de la estructura de `tabla` y llenarla, en una conexión propia"""
+    inicio = perf_counter()
+    with db_connection(origen='carga_bi') as conn:
+        try:
+            with conn.cursor() as cursor:
+                # Misma estructura, defaults, constraints e índices: va a reemplazar a la tabla tal cual
+                cursor.execute(f'CREATE TABLE {staging} (LIKE {tabla} INCLUDING ALL)')
+                filas = copy_dataframe(cursor, staging, largo)
+                # Estadísticas listas antes de que la tabla empiece a recibir consultas
+                cursor.execute(f'ANALYZE {staging}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return filas, round(perf_counter() - inicio, 3)
+
+
+def _reemplazar_tabla(cursor, tabla, staging, sufijo):
+    """Poner `staging` en el lugar de `tabla` por rename y borrar la versión anterior.
+
+    Las secuencias (serial) de la tabla anterior pasan a ser de la nueva, que
+    ya las usa en sus defaults; los índices toman los nombres que tenían.
+    """
+    anterior = f'{tabla}_anterior_{sufijo}'
+    cursor.execute(f'ALTER TABLE {tabla} RENAME TO {anterior}')
+    cursor.execute(f'ALTER TABLE {staging} RENAME TO {tabla}')
+
+    cursor.execute('''
+        SELECT a.attname AS columna, pg_get_serial_sequence(%s, a.attname) AS secuencia
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped AND a.attidentity = ''
+    ''', (anterior, anterior))
+    for fila in cursor.fetchall():
+        if fila['secuencia']:
+            cursor.execute(f'ALTER SEQUENCE {fila["secuencia"]} OWNED BY {tabla}.{fila["columna"]}')
+
+    cursor.execute(f'DROP TABLE {anterior}')
+
+    # Índices y constraints copiados con LIKE se llaman como la staging
+    cursor.execute('''
+        SELECT c.relname AS indice
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+    ''', (tabla,))
+    for fila in cursor.fetchall():
+        if fila['indice'].startswith(staging):
+            cursor.execute(f'ALTER INDEX {fila["indice"]} RENAME TO {tabla}{fila["indice"][len(staging):]}')
+
+
+def cargar_tablas_bi(conn, planillas):
+    """Reemplazar las tablas BI con las planillas parseadas ({file_key: largo}).
+
+    Cada planilla se copia en paralelo, por su propia conexión del pool, a una
+    tabla nueva con la estructura de la destino. Recién cuando están todas,
+    `conn` las pone en lugar de las actuales por rename en una sola
+    transacción: los cuatro archivos se publican juntos o ninguno, los lectores
+    siguen leyendo la versión anterior hasta el commit (solo esperan el
+    instante de los renames) y no quedan tuplas muertas que vacuumear.
+    Devuelve {file_key: (filas, segundos de copia)}.
+    """
+    sufijo = uuid.uuid4().hex[:12]
+    stagings = {file_key: f'bi_carga_{sufijo}_{file_key.replace("-", "_")}' for file_key in planillas}
+    cursor = conn.cursor()
+    try:
+        with ThreadPoolExecutor(max_workers=len(planillas)) as hilos:
+            futuros = {
+                file_key: hilos.submit(_copiar_a_staging, TABLAS_BI[file_key], stagings[file_key], largo)
+                for file_key, largo in planillas.items()
+            }
+            resultado = {file_key: futuro.result() for file_key, futuro in futuros.items()}
+
+        # Una recarga a la vez; sin esperar indefinidamente a lectores largos
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('carga_bi'))")
+        cursor.execute("SET LOCAL lock_timeout = '10s'")
+        for file_key, staging in stagings.items():
+            _reemplazar_tabla(cursor, TABLAS_BI[file_key], staging, sufijo)
+        conn.commit()
+        return resultado
+    except Exception:
+        conn.rollback()
+        # Las staging que llegaron a crearse se commitearon en su conexión: borrarlas
+        try:
+            for staging in stagings.values():
+                cursor.execute(f'DROP TABLE IF EXISTS {staging}')
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ No se pudieron borrar las tablas de staging: {e}")
+        raise
+    finally:
+        cursor.close()
@@ -1,5 +1,11 @@
+import io
 import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic
 import psycopg2
+from psycopg2 import extensions
 from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
@@ -12,21 +18,260 @@ except Exception as e:
 
 # Pool de conexiones para mejor rendimiento
 connection_pool = None
+_pool_lock = threading.Lock()
+
+
+class PoolAgotadoError(pool.PoolError):
+    """No se liberó ninguna conexión dentro del tiempo de espera configurado"""
+
+
+class PoolConexiones:
+    """Pool de conexiones thread-safe para PostgreSQL.
+
+    A diferencia de SimpleConnectionPool:
+    - Es seguro entre threads (un único Condition protege el estado).
+    - Cuando está lleno, espera hasta `timeout` segundos en lugar de fallar.
+    - Valida cada conexión al entregarla y descarta las muertas
+      (por ejemplo después de un reinicio de PostgreSQL).
+    - Recicla las conexiones que superan `max_edad` segundos de vida.
+    - Lleva métricas de tiempo de espera y conexiones en uso, y reporta como
+      fuga toda conexión retenida más de `fuga_segundos`.
+    """
+
+    def __init__(self, minconn, maxconn, dsn, timeout=30, max_edad=1800, ping_segundos=30,
+                 fuga_segundos=300, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_edad = max_edad
+        self.ping_segundos = ping_segundos
+        self.fuga_segundos = fuga_segundos
+        self._dsn = dsn
+        self._kwargs = kwargs
+
+        self._cond = threading.Condition()
+        self._libres = deque()  # (conn, creada_en, devuelta_en)
+        self._en_uso = {}  # id(conn) -> (conn, creada_en, entregada_en, origen)
+        self._total = 0
+        self._esperando = 0
+        self._cerrado = False
+
+        self._stats = {
+            'entregas': 0,
+            'esperas': 0,
+            'espera_total': 0.0,
+            'espera_max': 0.0,
+            'timeouts': 0,
+            'descartadas': 0,
+            'recicladas': 0,
+            'liberaciones_invalidas': 0,
+            'retenciones_largas': 0,
+        }
+
+        for _ in range(minconn):
+            conn = self._conectar()
+            self._total += 1
+            self._libres.append((conn, monotonic(), monotonic()))
+
+    def _conectar(self):
+        return psycopg2.connect(self._dsn, **self._kwargs)
+
+    def _cerrar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _es_valida(self, conn, creada_en, devuelta_en):
+        """Devuelve None si la conexión sirve, o el motivo por el que se descarta"""
+        ahora = monotonic()
+        if conn.closed:
+            return 'descartadas'
+        if self.max_edad and ahora - creada_en > self.max_edad:
+            return 'recicladas'
+        if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return 'descartadas'
+        if ahora - devuelta_en >= self.ping_segundos:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1')
+                cursor.close()
+                conn.rollback()
+            except Exception:
+                return 'descartadas'
+        return None
+
+    def getconn(self, timeout=None, origen=None):
+        """Obtener una conexión, esperando hasta `timeout` segundos si el pool está lleno.
+
+        `origen` identifica a quien la pidió (endpoint, script) para el reporte de fugas.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        inicio = monotonic()
+        limite = inicio + timeout
+        hubo_espera = False
+
+        while True:
+            candidata = None
+            crear = False
+
+            with self._cond:
+                while True:
+                    if self._cerrado:
+                        raise pool.PoolError('El pool de conexiones está cerrado')
+                    if self._libres:
+                        candidata = self._libres.pop()
+                        break
+                    if self._total < self.maxconn:
+                        self._total += 1
+                        crear = True
+                        break
+
+                    restante = limite - monotonic()
+                    if restante <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolAgotadoError(
+                            f'Pool agotado: {self.maxconn} conexiones en uso durante más de {timeout}s'
+                        )
+                    hubo_espera = True
+                    self._esperando += 1
+                    try:
+                        self._cond.wait(restante)
+                    finally:
+                        self._esperando -= 1
+
+            # Crear o validar fuera del lock: son operaciones de red
+            if crear:
+                try:
+                    conn = self._conectar()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+                creada_en = monotonic()
+            else:
+                conn, creada_en, devuelta_en = candidata
+                motivo = self._es_valida(conn, creada_en, devuelta_en)
+                if motivo is not None:
+                    self._cerrar(conn)
+                    with self._cond:
+                        self._total -= 1
+                        self._stats[motivo] += 1
+                        self._cond.notify()
+                    continue
+
+            espera = monotonic() - inicio
+            with self._cond:
+                self._en_uso[id(conn)] = (conn, creada_en, monotonic(), origen)
+                self._stats['entregas'] += 1
+                if hubo_espera:
+                    self._stats['esperas'] += 1
+                    self._stats['espera_total'] += espera
+                    self._stats['espera_max'] = max(self._stats['espera_max'], espera)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Devolver una conexión al pool (la descarta si está rota o vencida)"""
+        with self._cond:
+            info = self._en_uso.pop(id(conn), None)
+            if info is None:
+                self._stats['liberaciones_invalidas'] += 1
+                print("⚠️ Se intentó devolver al pool una conexión que no estaba en uso")
+                return
+
+        _, creada_en, entregada_en, origen = info
+        retenida = monotonic() - entregada_en
+        if self.fuga_segundos and retenida > self.fuga_segundos:
+            with self._cond:
+                self._stats['retenciones_largas'] += 1
+            print(f"⚠️ Conexión retenida {retenida:.0f}s por '{origen or 'desconocido'}'")
+
+        descartar = close or self._cerrado or conn.closed
+        if not descartar and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            # Cerrar cualquier transacción abierta antes de reutilizarla
+            try:
+                conn.rollback()
+            except Exception:
+                descartar = True
+        vencida = not descartar and self.max_edad and monotonic() - creada_en > self.max_edad
+
+        if descartar or vencida:
+            self._cerrar(conn)
+        with self._cond:
+            if vencida:
+                self._stats['recicladas'] += 1
+            if descartar or vencida:
+                self._total -= 1
+            else:
+                self._libres.append((conn, creada_en, monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Cerrar todas las conexiones libres; las que están en uso se cierran al devolverlas"""
+        with self._cond:
+            self._cerrado = True
+            libres = list(self._libres)
+            self._libres.clear()
+            self._total -= len(libres)
+            self._cond.notify_all()
+        for conn, _, _ in libres:
+            self._cerrar(conn)
+
+    def fugas(self):
+        """Conexiones entregadas hace más de `fuga_segundos` que todavía no volvieron"""
+        ahora = monotonic()
+        with self._cond:
+            en_uso = list(self._en_uso.values())
+        return [
+            {'origen': origen or 'desconocido', 'segundos': round(ahora - entregada_en, 1)}
+            for _, _, entregada_en, origen in en_uso
+            if self.fuga_segundos and ahora - entregada_en > self.fuga_segundos
+        ]
+
+    def stats(self):
+        """Métricas del pool (gauges de uso y tiempos de espera)"""
+        fugas = self.fugas()
+        with self._cond:
+            esperas = self._stats['esperas']
+            return {
+                'en_uso': len(self._en_uso),
+                'libres': len(self._libres),
+                'total': self._total,
+                'maximo': self.maxconn,
+                'esperando': self._esperando,
+                'entregas': self._stats['entregas'],
+                'esperas': esperas,
+                'espera_promedio_ms': round(self._stats['espera_total'] / esperas * 1000, 2) if esperas else 0,
+                'espera_max_ms': round(self._stats['espera_max'] * 1000, 2),
+                'timeouts': self._stats['timeouts'],
+                'descartadas': self._stats['descartadas'],
+                'recicladas': self._stats['recicladas'],
+                'liberaciones_invalidas': self._stats['liberaciones_invalidas'],
+                'retenciones_largas': self._stats['retenciones_largas'],
+                'fugas': fugas,
+            }
+
 
 def init_connection_pool():
     """Inicializar pool de conexiones a PostgreSQL"""
     global connection_pool
-    
+
     # Obtener URL de conexión desde variable de entorno
     database_url = os.environ.get('DATABASE_URL')
-    
+
     if not database_url:
         raise ValueError("❌ DATABASE_URL no está configurada")
-    
+
     try:
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
-            1, 20,  # mínimo 1, máximo 20 conexiones
+        connection_pool = PoolConexiones(
+            int(os.environ.get('DB_POOL_MIN', 1)),
+            int(os.environ.get('DB_POOL_MAX', 20)),
             database_url,
+            timeout=float(os.environ.get('DB_POOL_TIMEOUT', 30)),  # segundos de espera si está lleno
+            max_edad=float(os.environ.get('DB_POOL_MAX_EDAD', 1800)),  # reciclar cada 30 minutos
+            ping_segundos=float(os.environ.get('DB_POOL_PING', 30)),  # validar con SELECT 1 si estuvo ociosa
+            fuga_segundos=float(os.environ.get('DB_POOL_FUGA', 300)),  # reportar conexiones retenidas 5+ minutos
             cursor_factory=RealDictCursor
         )
         print("✅ Pool de conexiones PostgreSQL inicializado")
@@ -35,26 +280,121 @@ def init_connection_pool():
         print(f"❌ Error al conectar con PostgreSQL: {e}")
         raise
 
-def get_db_connection():
+def get_db_connection(origen=None):
     """Obtener conexión del pool"""
     global connection_pool
-    
+
     if connection_pool is None:
-        init_connection_pool()
-    
-    return connection_pool.getconn()
+        with _pool_lock:
+            if connection_pool is None:
+                init_connection_pool()
+
+    return connection_pool.getconn(origen=origen)
 
 def release_db_connection(conn):
     """Devolver conexión al pool"""
     global connection_pool
-    
+
     if connection_pool is not None and conn is not None:
         connection_pool.putconn(conn)
 
+@contextmanager
+def db_connection(origen=None):
+    """Conexión del pool que se devuelve exactamente una vez al salir del bloque.
+
+    No hace commit: quien la usa decide. Si quedó una transacción abierta,
+    el pool hace rollback al recibirla.
+    """
+    conn = get_db_connection(origen)
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+def _valor_copy(valor):
+    """Formatear un valor para COPY en formato texto"""
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    texto = str(valor)
+    return texto.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_rows(cursor, tabla, columnas, filas):
+    """Cargar filas en una tabla con COPY FROM STDIN (un solo round-trip).
+
+    `filas` es un iterable de tuplas en el orden de `columnas`; None se carga como NULL.
+    Devuelve la cantidad de filas copiadas.
+    """
+    buffer = io.StringIO()
+    for fila in filas:
+        buffer.write('\t'.join(_valor_copy(valor) for valor in fila))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN", buffer)
+    return cursor.rowcount
+
+def copy_dataframe(cursor, tabla, df):
+    """Cargar un DataFrame con COPY en formato CSV (escapado y NULLs los resuelve pandas).
+
+    Las columnas del DataFrame deben llamarse como las de la tabla; NaN se carga como NULL.
+    Devuelve la cantidad de filas copiadas.
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {tabla} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return cursor.rowcount
+
+# Tablas de catálogo cuyas respuestas GET se versionan con ETag (ver catalogo_versionado en app.py)
+CATALOGOS_VERSIONADOS = ['precios', 'descuentos_adicionales', 'config_dias_zonas', 'matriz_codigos_obs', 'retail_plan']
+
+def instalar_versionado(cursor, tablas):
+    """Contador de versión por tabla en versiones_tablas, incrementado por triggers en cada escritura.
+
+    El contador se actualiza dentro de la transacción que escribe: dos escrituras
+    concurrentes se ordenan en esa fila y cada commit deja una versión distinta.
+    Idempotente; las tablas que todavía no existen se saltean.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versiones_tablas (
+            tabla TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION incrementar_version_tabla() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO versiones_tablas (tabla, version) VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (tabla) DO UPDATE SET version = versiones_tablas.version + 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    for tabla in tablas:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL AS existe', (tabla,))
+        if not cursor.fetchone()['existe']:
+            continue
+        # Por sentencia: una carga masiva incrementa una vez por sentencia y no una vez por fila.
+        # Una sentencia que no toca filas también incrementa; solo invalida el ETag de más
+        cursor.execute(f'DROP TRIGGER IF EXISTS {tabla}_version_truncate ON {tabla}')
+        cursor.execute(f'DROP TRIGGER IF EXISTS {tabla}_version ON {tabla}')
+        cursor.execute(f'''
+            CREATE TRIGGER {tabla}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabla}
+            FOR EACH STATEMENT EXECUTE PROCEDURE incrementar_version_tabla()
+        ''')
+        cursor.execute('INSERT INTO versiones_tablas (tabla) VALUES (%s) ON CONFLICT (tabla) DO NOTHING', (tabla,))
+
+def get_pool_stats():
+    """Obtener métricas del pool de conexiones"""
+    if connection_pool is None:
+        return None
+    return connection_pool.stats()
+
 def close_all_connections():
     """Cerrar todas las conexiones del pool"""
     global connection_pool
-    
+
     if connection_pool is not None:
         connection_pool.closeall()
         print("✅ Pool de conexiones cerrado")
@@ -0,0 +1,230 @@
+"""
+Motor de descuentos para unidades disponibles (Módulo 4 / Ventas)
+Calcula precio final y descuentos adicionales de todas las unidades en una sola pasada
+"""
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from psycopg2.extras import execute_values
+
+
+def parsear_fecha_entrega(valor):
+    """Parsear entrega_estimada tal como se guarda en disponibles.
+
+    Acepta 'YYYY-MM-DD', el formato HTTP que devuelve jsonify
+    ('Mon, 01 Jan 2025 00:00:00 GMT') e ISO 8601. Devuelve None si no se
+    puede interpretar o si trae zona horaria (no es comparable con la fecha local).
+    """
+    if not valor:
+        return None
+
+    fecha_str = str(valor)
+    try:
+        fecha = datetime.strptime(fecha_str, '%Y-%m-%d')
+    except ValueError:
+        try:
+            if 'GMT' in fecha_str:
+                fecha = datetime.strptime(fecha_str.replace(' GMT', '').strip(), '%a, %d %b %Y %H:%M:%S')
+            else:
+                fecha = datetime.fromisoformat(fecha_str.replace('GMT', '').strip())
+        except ValueError:
+            return None
+
+    if fecha.tzinfo is not None:
+        return None
+    return fecha
+
+
+def parsear_fechas_entrega(valores):
+    """Parsear una columna de fechas una sola vez por valor distinto.
+
+    Devuelve un array datetime64[ns] con NaT donde no hay fecha válida.
+    """
+    serie = pd.Series(valores, dtype=object)
+    distintos = serie.dropna().unique()
+    parseadas = {valor: parsear_fecha_entrega(valor) for valor in distintos}
+    return pd.to_datetime(serie.map(parseadas), errors='coerce').to_numpy(dtype='datetime64[ns]')
+
+
+def calcular_precios_disponibles(rows, descuentos_config, ahora=None):
+    """Calcular precio final y descuentos adicionales de todas las unidades.
+
+    `rows` son las filas de disponibles (dicts con precio_base, precio_disponible,
+    descuento_guardado, ubicacion, color y entrega_estimada). Los descuentos por
+    stock, color y antigüedad se suman al descuento individual guardado.
+
+    Devuelve un dict de listas alineadas con `rows`: precio_base,
+    descuento_individual, precio_final, descuento_adicional y detalles_descuento.
+    """
+    ahora = ahora or datetime.now()
+    n = len(rows)
+
+    precio_base = [row.get('precio_base', 0) or row['precio_disponible'] or 0 for row in rows]
+    descuento_individual = [row.get('descuento_guardado', 0) or 0 for row in rows]
+
+    base = np.array(precio_base, dtype=float)
+    individual = np.array(descuento_individual, dtype=float)
+    total = individual.copy()
+
+    ubicaciones = pd.Series([row['ubicacion'] for row in rows], dtype=object)
+    colores = pd.Series([row['color'] for row in rows], dtype=object)
+
+    # Descuento por Stock: la ubicación contiene "STOCK" en cualquier parte
+    desc_stock = descuentos_config.get('stock', {}).get('descuento_stock', 0)
+    if desc_stock > 0 and n:
+        en_stock = ubicaciones.fillna('').str.strip().str.upper().str.contains('STOCK', regex=False).to_numpy(dtype=bool)
+        total = np.where(en_stock, total + desc_stock, total)
+    else:
+        en_stock = np.zeros(n, dtype=bool)
+
+    # Descuento por Color - Normalizar para comparar
+    descuentos_color = {
+        clave: valor for clave, valor in descuentos_config.get('color', {}).items() if valor > 0
+    }
+    if descuentos_color and n:
+        colores_norm = colores.fillna('').str.strip().str.lower().str.replace(' ', '_', regex=False)
+        desc_color = colores_norm.map(descuentos_color).fillna(0).to_numpy(dtype=float)
+        con_color = desc_color > 0
+        total = np.where(con_color, total + desc_color, total)
+        detalle_color = colores_norm.map({k: f"Color: {v}%" for k, v in descuentos_color.items()}).to_numpy()
+    else:
+        con_color = np.zeros(n, dtype=bool)
+        detalle_color = None
+
+    # Descuento por Antigüedad: entrega estimada anterior a hoy - N meses
+    antiguedad = descuentos_config.get('antiguedad', {})
+    desc_antiguedad = antiguedad.get('descuento', 0)
+    viejas = np.zeros(n, dtype=bool)
+    if desc_antiguedad > 0 and n:
+        try:
+            fecha_limite = ahora - relativedelta(months=int(antiguedad.get('meses', 3)))
+        except (TypeError, ValueError) as e:
+            print(f"❌ Error en configuración de antigüedad: {e}")
+        else:
+            fechas = parsear_fechas_entrega([row['entrega_estimada'] for row in rows])
+            viejas = fechas < np.datetime64(fecha_limite, 'ns')  # NaT compara siempre False
+            total = np.where(viejas, total + desc_antiguedad, total)
+
+    # Calcular precio final con TODOS los descuentos
+    precio_final = base * (1 - total / 100)
+    # Separar descuento individual (va en su propia columna) del total de adicionales
+    descuento_adicional = total - individual
+
+    # round() de Python (no np.round) para conservar exactamente el redondeo anterior
+    precio_final = [round(valor, 2) for valor in precio_final.tolist()]
+    descuento_adicional = descuento_adicional.tolist()
+
+    detalle_stock = f"Stock: {desc_stock}%"
+    detalle_antiguedad = f"Antigüedad: {desc_antiguedad}%"
+    detalles_descuento = []
+    for i in range(n):
+        partes = []
+        if en_stock[i]:
+            partes.append(detalle_stock)
+        if con_color[i]:
+            partes.append(detalle_color[i])
+        if viejas[i]:
+            partes.append(detalle_antiguedad)
+
+        if partes:
+            descuento_adicional[i] = round(descuento_adicional[i], 2)
+            detalles_descuento.append(', '.join(partes))
+        else:
+            # Sin adicionales: conservar el tipo del descuento guardado (0 y no 0.0)
+            descuento_adicional[i] = round(descuento_individual[i] - descuento_individual[i], 2)
+            detalles_descuento.append('Sin descuentos')
+
+    return {
+        'precio_base': precio_base,
+        'descuento_individual': descuento_individual,
+        'precio_final': precio_final,
+        'descuento_adicional': descuento_adicional,
+        'detalles_descuento': detalles_descuento,
+    }
+
+
+def cargar_descuentos_config(cursor):
+    """Leer descuentos_adicionales como {tipo: {clave: valor}}"""
+    cursor.execute('SELECT tipo, clave, valor FROM descuentos_adicionales')
+    descuentos_config = {}
+    for row in cursor.fetchall():
+        if row['tipo'] not in descuentos_config:
+            descuentos_config[row['tipo']] = {}
+        descuentos_config[row['tipo']][row['clave']] = row['valor']
+    return descuentos_config
+
+
+def recalcular_precios_disponibles(cursor, ahora=None, numeros_fabrica=None, ids=None):
+    """Recalcular y guardar precio_final, descuento_adicional y detalles_descuento.
+
+    Se llama dentro de la transacción de cada operación que cambia descuentos
+    adicionales o unidades (los precios de `precios` no intervienen), y una vez
+    por día para el descuento por antigüedad. Con `numeros_fabrica` o `ids`
+    solo recalcula esas unidades. Solo escribe las filas cuyo precio cambia o que
+    todavía no quedaron marcadas como calculadas ese día; devuelve cuántas.
+    """
+    ahora = ahora or datetime.now()
+    descuentos_config = cargar_descuentos_config(cursor)
+
+    consulta = '''
+        SELECT id, precio_base, precio_disponible, descuento_individual AS descuento_guardado,
+               ubicacion, color, entrega_estimada
+        FROM disponibles
+    '''
+    if ids is not None:
+        cursor.execute(consulta + ' WHERE id = ANY(%s)', (list(ids),))
+    elif numeros_fabrica is not None:
+        cursor.execute(consulta + ' WHERE numero_fabrica = ANY(%s)', (list(numeros_fabrica),))
+    else:
+        cursor.execute(consulta)
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+
+    precios = calcular_precios_disponibles(rows, descuentos_config, ahora)
+    hoy = ahora.date()
+    valores = [
+        (row['id'], precio_final, descuento_adicional, detalles, hoy)
+        for row, precio_final, descuento_adicional, detalles in zip(
+            rows,
+            precios['precio_final'],
+            precios['descuento_adicional'],
+            precios['detalles_descuento']
+        )
+    ]
+
+    # La fecha también cuenta como cambio: GET /api/disponibles considera vencidas las filas de otro día
+    actualizadas = execute_values(cursor, '''
+        UPDATE disponibles AS d
+        SET precio_final = v.precio_final,
+            descuento_adicional = v.descuento_adicional,
+            detalles_descuento = v.detalles_descuento,
+            precios_calculados_en = v.calculado_en
+        FROM (VALUES %s) AS v(id, precio_final, descuento_adicional, detalles_descuento, calculado_en)
+        WHERE d.id = v.id
+          AND (d.precio_final, d.descuento_adicional, d.detalles_descuento, d.precios_calculados_en)
+              IS DISTINCT FROM
+              (v.precio_final, v.descuento_adicional, v.detalles_descuento, v.calculado_en)
+        RETURNING d.id
+    ''', valores, template='(%s::integer, %s::double precision, %s::real, %s::text, %s::date)', page_size=1000,
+        fetch=True)
+    return len(actualizadas)
+
+
+def completar_precios(cursor, rows, ahora=None):
+    """Calcular en memoria, sin guardar, precio_final, descuento_adicional y detalles_descuento de `rows`.
+
+    Para respuestas de solo lectura que encuentran precios de otro día mientras
+    otro pedido los está recalculando y guardando.
+    """
+    if not rows:
+        return
+    precios = calcular_precios_disponibles(rows, cargar_descuentos_config(cursor), ahora)
+    for row, precio_final, descuento_adicional, detalles in zip(
+        rows, precios['precio_final'], precios['descuento_adicional'], precios['detalles_descuento']
+    ):
+        row['precio_final'] = precio_final
+        row['descuento_adicional'] = descuento_adicional
+        row['detalles_descuento'] = detalles
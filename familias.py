@@ -0,0 +1,87 @@
+"""
+Clasificación de textos (modelos, nombres de BI) por tablas de reglas ordenadas
+Cada tabla se compila en una sola expresión regular que prueba las reglas en orden: gana la primera
+que se cumple, igual que una cadena de if/elif. Cada texto distinto se clasifica una sola vez
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+OTROS = 'OTROS'
+
+
+class Clasificador:
+    """Tabla de reglas ordenada: [(etiqueta, término, término, ...)].
+
+    Una regla se cumple si el texto (en mayúsculas) contiene todos sus
+    términos; un término que es una tupla se cumple con cualquiera de sus
+    alternativas. Los textos que no cumplen ninguna regla van a `otros`.
+    """
+
+    def __init__(self, reglas, otros=OTROS, memoria=4096):
+        self.reglas = [tuple(regla) for regla in reglas]
+        self.etiquetas = [regla[0] for regla in self.reglas] + [otros]
+        self._etiquetas = np.array(self.etiquetas, dtype=object)
+
+        # Una alternativa por regla, en orden: lookaheads con los términos y un grupo vacío que indica cuál se cumplió
+        alternativas = []
+        for regla in self.reglas:
+            condiciones = []
+            for termino in regla[1:]:
+                opciones = termino if isinstance(termino, tuple) else (termino,)
+                condiciones.append('(?=.*?(?:%s))' % '|'.join(re.escape(opcion) for opcion in opciones))
+            alternativas.append(''.join(condiciones) + '()')
+        self._patron = re.compile('(?:%s)' % '|'.join(alternativas), re.DOTALL)
+
+        self.indice = lru_cache(maxsize=memoria)(self._indice)
+
+    def _indice(self, texto):
+        """Posición de la primera regla que cumple `texto` (len(reglas) si ninguna)"""
+        coincidencia = self._patron.match(str(texto).upper())
+        return coincidencia.lastindex - 1 if coincidencia else len(self.reglas)
+
+    def clasificar(self, texto):
+        return self.etiquetas[self.indice(texto)]
+
+    def indices(self, valores):
+        """Índice de regla de cada valor: se evalúa una vez por valor distinto"""
+        codigos, unicos = pd.factorize(pd.Series(valores, dtype=object), use_na_sentinel=False)
+        por_unico = np.fromiter((self.indice(valor) for valor in unicos), dtype=np.intp, count=len(unicos))
+        return por_unico[codigos]
+
+    def clasificar_serie(self, valores):
+        """Etiqueta de cada valor (array de objetos, en el orden de `valores`)"""
+        return self._etiquetas[self.indices(valores)]
+
+
+# Ventas retail (plan de negocio): YARIS CROSS y COROLLA CROSS antes que YARIS y COROLLA
+FAMILIAS_RETAIL = Clasificador([
+    ('COROLLA CROSS', 'COROLLA CROSS'),
+    ('YARIS CROSS', 'YARIS CROSS'),
+    ('COROLLA', 'COROLLA'),
+    ('HILUX', 'HILUX'),
+    ('SW4', 'SW4'),
+    ('YARIS', 'YARIS'),
+    ('RAV 4', 'RAV'),
+    ('HIACE', 'HIACE'),
+])
+
+# Columna familia de precios
+FAMILIAS_PRECIOS = Clasificador([
+    ('COROLLA CROSS', 'COROLLA CROSS'),
+    ('COROLLA', 'COROLLA'),
+    ('HILUX', 'HILUX'),
+    ('SW4', 'SW4'),
+    ('YARIS GR', 'YARIS', ('GR', 'GR-SPORT')),
+    ('YARIS', 'YARIS'),
+    ('HIACE', 'HIACE'),
+    ('LAND CRUISER', 'LAND CRUISER'),
+    ('RAV 4', 'RAV'),
+])
+
+# Marcas de los patentamientos de BI; el resto va a "otros"
+MARCAS_PATENTAMIENTOS = ['TOYOTA', 'FORD', 'FIAT', 'VOLKSWAGEN', 'CHEVROLET', 'PEUGEOT']
+MARCAS = Clasificador([(marca, marca) for marca in MARCAS_PATENTAMIENTOS], otros='otros')
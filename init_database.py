@@ -1,6 +1,8 @@
 import sqlite3
 import os
 
+from familias import FAMILIAS_PRECIOS
+
 # Eliminar base de datos si existe
 if os.path.exists('database.db'):
     os.remove('database.db')
@@ -238,34 +240,8 @@ for tipo, clave, valor in descuentos_default:
 
 print(f"✅ {len(descuentos_default)} descuentos adicionales configurados")
 
-# Función para asignar familia a cada modelo
-def obtener_familia(modelo):
-    modelo_upper = modelo.upper()
-    
-    if 'COROLLA CROSS' in modelo_upper:
-        return 'COROLLA CROSS'
-    elif 'COROLLA' in modelo_upper:
-        return 'COROLLA'
-    elif 'HILUX' in modelo_upper:
-        return 'HILUX'
-    elif 'SW4' in modelo_upper:
-        return 'SW4'
-    elif 'YARIS' in modelo_upper and ('GR' in modelo_upper or 'GR-SPORT' in modelo_upper):
-        return 'YARIS GR'
-    elif 'YARIS' in modelo_upper:
-        return 'YARIS'
-    elif 'HIACE' in modelo_upper:
-        return 'HIACE'
-    elif 'LAND CRUISER' in modelo_upper:
-        return 'LAND CRUISER'
-    elif 'RAV' in modelo_upper:
-        return 'RAV 4'
-    else:
-        return 'OTROS'
-
 # Actualizar familias para todos los modelos
-for modelo in modelos:
-    familia = obtener_familia(modelo)
+for modelo, familia in zip(modelos, FAMILIAS_PRECIOS.clasificar_serie(modelos)):
     cursor.execute('UPDATE precios SET familia = ? WHERE modelo = ?', (familia, modelo))
 
 print(f"✅ Familias asignadas a todos los modelos")
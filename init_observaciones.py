@@ -3,7 +3,7 @@ Script para crear tablas de configuración de observaciones
 """
 
 import os
-from db_config import get_db_connection, release_db_connection, init_connection_pool
+from db_config import get_db_connection, release_db_connection, init_connection_pool, instalar_versionado
 
 def crear_tablas_observaciones():
     """Crear tablas para sistema de observaciones"""
@@ -71,6 +71,9 @@ def crear_tablas_observaciones():
             )
         ''')
         
+        # Versión por tabla para los ETags de config_dias y matriz_codigos
+        instalar_versionado(cursor, ['config_dias_zonas', 'matriz_codigos_obs'])
+        
         conn.commit()
         print("✅ Tablas de observaciones creadas")
         
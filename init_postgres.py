@@ -1,6 +1,7 @@
 import os
 import json
-from db_config import get_db_connection, release_db_connection, init_connection_pool
+from db_config import CATALOGOS_VERSIONADOS, get_db_connection, release_db_connection, init_connection_pool, instalar_versionado
+from familias import FAMILIAS_PRECIOS
 
 def init_postgres_database():
     """Inicializar todas las tablas en PostgreSQL"""
@@ -68,7 +69,20 @@ def init_postgres_database():
                 fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        
+
+        # Columnas de precios de disponibles (precio final materializado,
+        # se recalcula al guardar precios, descuentos o unidades)
+        cursor.execute('''
+            ALTER TABLE disponibles
+                ADD COLUMN IF NOT EXISTS precio_base REAL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS descuento_individual REAL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS descuento_adicional REAL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS precio_final DOUBLE PRECISION,
+                ADD COLUMN IF NOT EXISTS detalles_descuento TEXT,
+                ADD COLUMN IF NOT EXISTS precios_calculados_en DATE
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_disponibles_fecha_carga ON disponibles (fecha_carga DESC)')
+
         # Tabla de unidades reservadas
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS unidades_reservadas (
@@ -134,34 +148,10 @@ def init_postgres_database():
         except Exception as e:
             print(f"⚠️  Error al cargar backup_precios.json: {e}")
         
-        # Función para obtener familia
-        def obtener_familia(modelo):
-            modelo_upper = modelo.upper()
-            if 'COROLLA CROSS' in modelo_upper:
-                return 'COROLLA CROSS'
-            elif 'COROLLA' in modelo_upper:
-                return 'COROLLA'
-            elif 'HILUX' in modelo_upper:
-                return 'HILUX'
-            elif 'SW4' in modelo_upper:
-                return 'SW4'
-            elif 'YARIS' in modelo_upper and ('GR' in modelo_upper or 'GR-SPORT' in modelo_upper):
-                return 'YARIS GR'
-            elif 'YARIS' in modelo_upper:
-                return 'YARIS'
-            elif 'HIACE' in modelo_upper:
-                return 'HIACE'
-            elif 'LAND CRUISER' in modelo_upper:
-                return 'LAND CRUISER'
-            elif 'RAV' in modelo_upper:
-                return 'RAV 4'
-            else:
-                return 'OTROS'
-        
         # Insertar modelos con precios (solo si hay datos)
         if backup_data:
             for item in backup_data:
-                familia = obtener_familia(item['modelo'])
+                familia = FAMILIAS_PRECIOS.clasificar(item['modelo'])
                 cursor.execute('''
                     INSERT INTO precios (modelo, precio_ars, precio_usd, cotizacion, descuento, visible, dado_baja, familia)
                     VALUES (%s, %s, %s, %s, %s, 1, %s, %s)
@@ -218,6 +208,10 @@ def init_postgres_database():
         
         print(f"✅ {len(descuentos_default)} descuentos adicionales configurados")
         
+        # Versión por tabla para los ETags de los catálogos (las que ya existan)
+        instalar_versionado(cursor, CATALOGOS_VERSIONADOS)
+        print("✅ Versionado de catálogos instalado")
+        
         conn.commit()
         print("✅ Base de datos PostgreSQL inicializada correctamente")
         
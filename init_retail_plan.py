@@ -3,7 +3,7 @@ Inicialización de la tabla retail_plan para objetivos del plan de negocio.
 Ejecutar una sola vez después de crear la estructura.
 """
 import psycopg2
-from db_config import get_db_connection
+from db_config import get_db_connection, instalar_versionado
 
 def init_retail_plan_table():
     """Crea la tabla retail_plan si no existe"""
@@ -28,6 +28,9 @@ def init_retail_plan_table():
         
         print("✅ Tabla retail_plan creada exitosamente")
         
+        # Versión de la tabla para el ETag de /api/retail/plan
+        instalar_versionado(cur, ['retail_plan'])
+        
         # Insertar datos iniciales para 2025 basados en el Excel del usuario
         familias_iniciales = [
             ('HILUX', 1732, 884, 249, 599),
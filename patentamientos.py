@@ -0,0 +1,273 @@
+"""
+Patentamientos desde los CSV de Patentamientos/ (BI)
+Los CSV se parsean una sola vez a una matriz de enteros y se reutilizan desde la caché columnar
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+import cache_columnar
+from familias import MARCAS, MARCAS_PATENTAMIENTOS, Clasificador
+
+DIRECTORIO_PATENTAMIENTOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Patentamientos')
+
+ARCHIVOS_PATENTAMIENTOS = [
+    'Mercado Argentino MARCA.csv',
+    'Mercado Argentino MODELO.csv',
+    'Mercado Mendoza MARCA.csv',
+    'Mercado Mendoza MODELO.csv'
+]
+
+MESES_MAP = {
+    'ene': '01', 'feb': '02', 'mar': '03', 'abr': '04',
+    'may': '05', 'jun': '06', 'jul': '07', 'ago': '08',
+    'sep': '09', 'oct': '10', 'nov': '11', 'dic': '12'
+}
+
+
+def ruta_csv(filename):
+    return os.path.join(DIRECTORIO_PATENTAMIENTOS, filename)
+
+
+def leer_csv(csv_path):
+    """Leer CSV con diferentes encodings"""
+    for encoding in ['latin-1', 'cp1252', 'iso-8859-1', 'utf-8']:
+        try:
+            return pd.read_csv(csv_path, delimiter=';', encoding=encoding)
+        except Exception:
+            continue
+    raise Exception(f"No se pudo leer el archivo {os.path.basename(csv_path)}")
+
+
+def parsear_csv(csv_path):
+    """Convertir el CSV en arrays: nombres (1ra columna), columnas de fecha y matriz de cantidades.
+
+    Cada celda vale int(float(valor)); vacías o no numéricas quedan en 0.
+    """
+    df = leer_csv(csv_path)
+    nombres = [str(nombre) for nombre in df.iloc[:, 0].tolist()]
+    bloque = df.iloc[:, 1:].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float, copy=True)
+    bloque[~np.isfinite(bloque)] = 0
+    return {
+        'nombres': np.array(nombres, dtype=str),
+        'columnas': np.array([str(col) for col in df.columns[1:]], dtype=str),
+        'valores': np.trunc(bloque).astype(np.int32),
+    }
+
+
+def cargar_matriz(filename):
+    """Matriz parseada de un CSV (desde la caché si el archivo no cambió)"""
+    csv_path = ruta_csv(filename)
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"Archivo no encontrado: {csv_path}")
+    return cache_columnar.cargar(csv_path, parsear_csv)
+
+
+def formatear_fechas(columnas):
+    """Convertir nombres de columnas de fecha (ene-15, feb-15, etc.) a formato MM/YY"""
+    fechas_formateadas = []
+    for col in columnas:
+        col_lower = str(col).lower().strip()
+        if '-' in col_lower:
+            mes_str, anio_str = col_lower.split('-')
+            mes = MESES_MAP.get(mes_str.strip())
+            anio = anio_str.strip()
+            if mes and len(anio) == 2:
+                fechas_formateadas.append(f"{mes}/{anio}")
+            else:
+                fechas_formateadas.append(col)
+        else:
+            fechas_formateadas.append(col)
+    return fechas_formateadas
+
+
+def get_patentamientos_from_csv(filename, tipo, top_n=5, mes_referencia=None):
+    """Leer y procesar datos de patentamientos desde CSV"""
+    matriz = cargar_matriz(filename)
+    columnas = matriz['columnas'].tolist()
+    fechas_formateadas = formatear_fechas(columnas)
+
+    if tipo == 'marca':
+        return get_datos_por_marca(matriz['nombres'], matriz['valores'], fechas_formateadas)
+    else:
+        return get_datos_por_modelo(matriz['nombres'], matriz['valores'], fechas_formateadas,
+                                    top_n=top_n, mes_referencia=mes_referencia, columnas=columnas)
+
+
+def clasificar_marcas(nombres, marcas=MARCAS_PATENTAMIENTOS):
+    """Índice de la primera marca (en el orden de `marcas`) contenida en cada nombre.
+
+    Los nombres sin ninguna marca reciben len(marcas), es decir "otros".
+    """
+    clasificador = MARCAS if marcas is MARCAS_PATENTAMIENTOS else Clasificador([(marca, marca) for marca in marcas])
+    return clasificador.indices(nombres)
+
+
+def get_datos_por_marca(nombres, valores, fechas_formateadas):
+    """Procesar datos agrupados por marca"""
+    marcas = MARCAS_PATENTAMIENTOS
+    result = {'labels': fechas_formateadas}
+
+    # Cada fila se clasifica una sola vez y las series salen de una suma matricial
+    indice = clasificar_marcas(nombres, marcas)
+    pertenencia = np.zeros((len(marcas) + 1, len(indice)), dtype=np.int64)
+    pertenencia[indice, np.arange(len(indice))] = 1
+    sumas = pertenencia @ valores.astype(np.int64)
+
+    for i, marca in enumerate(marcas):
+        result[marca.lower()] = sumas[i].tolist()
+    result['otros'] = sumas[len(marcas)].tolist()
+
+    return result
+
+
+def indices_top(cantidades, top_n):
+    """Índices de las `top_n` cantidades mayores (solo > 0), de mayor a menor.
+
+    Los empates se resuelven por orden de fila, igual que un sort estable.
+    """
+    positivos = np.flatnonzero(cantidades > 0)
+    if top_n <= 0 or len(positivos) == 0:
+        return positivos[:0]
+
+    valores = cantidades[positivos]
+    if top_n < len(positivos):
+        # argpartition encuentra el umbral; los empates en el umbral se toman por orden de fila
+        umbral = valores[np.argpartition(-valores, top_n - 1)[top_n - 1]]
+        mayores = np.flatnonzero(valores > umbral)
+        iguales = np.flatnonzero(valores == umbral)[:top_n - len(mayores)]
+        elegidos = np.concatenate([mayores, iguales])
+    else:
+        elegidos = np.arange(len(positivos))
+
+    orden = elegidos[np.argsort(-valores[elegidos], kind='stable')]
+    return positivos[orden]
+
+
+def indice_mes(columnas, fechas_formateadas, mes_referencia):
+    """Columna del mes de referencia: 'MM/YY' o el encabezado del CSV ('ene-25'); por defecto la última"""
+    if mes_referencia is None:
+        return len(columnas) - 1
+    for etiquetas in (fechas_formateadas, columnas):
+        if mes_referencia in etiquetas:
+            return etiquetas.index(mes_referencia)
+    raise ValueError(f"Mes de referencia inválido: {mes_referencia}")
+
+
+def get_datos_por_modelo(nombres, valores, fechas_formateadas, top_n=5, mes_referencia=None, columnas=None,
+                         seleccion=None):
+    """Procesar datos por modelo con el Top N del mes de referencia (último mes por defecto).
+
+    La clave de la respuesta sigue siendo top5_ultimo_mes por compatibilidad con el frontend.
+    Con `seleccion` (índices de fila) solo se devuelven las series de esos modelos.
+    """
+    nombres = [nombre.strip() for nombre in nombres.tolist()]
+    columna = indice_mes(columnas or fechas_formateadas, fechas_formateadas, mes_referencia)
+
+    # Top N por cantidad en el mes de referencia
+    cantidades = valores[:, columna] if valores.shape[1] else np.zeros(len(nombres), dtype=valores.dtype)
+    top_ultimo_mes = [
+        {'nombre': nombres[i], 'cantidad': int(cantidades[i])}
+        for i in indices_top(cantidades, top_n).tolist()
+    ]
+
+    # Todos los modelos (o los seleccionados) con sus valores históricos
+    if seleccion is None:
+        modelos = [{'nombre': nombre, 'valores': fila} for nombre, fila in zip(nombres, valores.tolist())]
+    else:
+        seleccion = list(seleccion)
+        modelos = [
+            {'nombre': nombres[i], 'valores': fila}
+            for i, fila in zip(seleccion, valores[seleccion].tolist())
+        ]
+
+    return {
+        'labels': fechas_formateadas,
+        'modelos': modelos,
+        'top5_ultimo_mes': top_ultimo_mes
+    }
+
+
+# Datasets de /api/bi/patentamientos: clave -> (archivo, tipo)
+DATASETS_PATENTAMIENTOS = {
+    'argentina_marca': ('Mercado Argentino MARCA.csv', 'marca'),
+    'argentina_modelo': ('Mercado Argentino MODELO.csv', 'modelo'),
+    'mendoza_marca': ('Mercado Mendoza MARCA.csv', 'marca'),
+    'mendoza_modelo': ('Mercado Mendoza MODELO.csv', 'modelo'),
+}
+
+
+def normalizar_mes(valor):
+    """Mes como 'YYYY-MM' a partir de 'YYYY-MM' o 'MM/YY'"""
+    valor = valor.strip()
+    if len(valor) == 7 and valor[4] == '-' and valor[:4].isdigit() and valor[5:].isdigit():
+        normalizado = valor
+    elif len(valor) == 5 and valor[2] == '/' and valor[:2].isdigit() and valor[3:].isdigit():
+        normalizado = f"20{valor[3:]}-{valor[:2]}"
+    else:
+        raise ValueError(f"Mes inválido: {valor} (usar YYYY-MM o MM/YY)")
+    if not 1 <= int(normalizado[5:]) <= 12:
+        raise ValueError(f"Mes inválido: {valor} (el mes debe estar entre 01 y 12)")
+    return normalizado
+
+
+def columnas_en_rango(fechas_formateadas, desde=None, hasta=None):
+    """Índices de los meses entre `desde` y `hasta` inclusive (ambos 'YYYY-MM')"""
+    indices = []
+    for i, etiqueta in enumerate(fechas_formateadas):
+        try:
+            mes = normalizar_mes(str(etiqueta))
+        except ValueError:
+            continue
+        if (desde is None or mes >= desde) and (hasta is None or mes <= hasta):
+            indices.append(i)
+    return indices
+
+
+def get_patentamientos_dataset(dataset, desde=None, hasta=None, top_n=None, modelos=None, mes_referencia=None):
+    """Un dataset de patentamientos, calculado solo para lo pedido.
+
+    `desde`/`hasta` ('YYYY-MM') recortan los meses; en los datasets por modelo,
+    `top_n` agrega 'top' (ranking por total del rango) y limita las series a
+    esos modelos, y `modelos` limita las series a los nombres indicados. Sin
+    filtros devuelve lo mismo que get_patentamientos_from_csv. Devuelve None si
+    ningún mes cae en el rango.
+    """
+    archivo, tipo = DATASETS_PATENTAMIENTOS[dataset]
+    matriz = cargar_matriz(archivo)
+    nombres = matriz['nombres']
+    valores = matriz['valores']
+    columnas = matriz['columnas'].tolist()
+    fechas_formateadas = formatear_fechas(columnas)
+
+    if desde is not None or hasta is not None:
+        indices = columnas_en_rango(fechas_formateadas, desde, hasta)
+        if not indices:
+            return None
+        valores = valores[:, indices]
+        columnas = [columnas[i] for i in indices]
+        fechas_formateadas = [fechas_formateadas[i] for i in indices]
+
+    if tipo == 'marca':
+        return get_datos_por_marca(nombres, valores, fechas_formateadas)
+
+    seleccion = None
+    top = None
+    if top_n is not None:
+        totales = valores.sum(axis=1, dtype=np.int64)
+        indices_ranking = indices_top(totales, top_n).tolist()
+        top = [{'nombre': nombres[i].strip(), 'cantidad': int(totales[i])} for i in indices_ranking]
+        seleccion = indices_ranking
+    if modelos is not None:
+        buscados = {modelo.strip() for modelo in modelos}
+        seleccion = [i for i, nombre in enumerate(nombres.tolist()) if nombre.strip() in buscados]
+
+    resultado = get_datos_por_modelo(
+        nombres, valores, fechas_formateadas,
+        top_n=top_n if top_n is not None else 5, mes_referencia=mes_referencia,
+        columnas=columnas, seleccion=seleccion
+    )
+    if top is not None:
+        resultado['top'] = top
+    return resultado
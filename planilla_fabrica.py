@@ -0,0 +1,151 @@
+"""
+Procesamiento de la planilla de fábrica (Módulo 3)
+Normaliza el Excel de unidades y calcula precio con descuento para todas las filas a la vez
+"""
+
+from datetime import datetime
+import io
+import numpy as np
+import pandas as pd
+
+# calamine (python-calamine, pandas >= 2.2) lee xlsx/xls bastante más rápido que openpyxl
+try:
+    import python_calamine  # noqa: F401
+    MOTOR_EXCEL = 'calamine'
+except ImportError:
+    MOTOR_EXCEL = None  # pandas elige: openpyxl en modo solo lectura para xlsx, xlrd para xls
+
+# La planilla usa 17 columnas (A-Q); las siguientes se descartan al procesar
+COLUMNAS_LEIDAS = 17
+
+
+# Nombres de las columnas (primeras 15 columnas visibles)
+COLUMNAS_PLANILLA = [
+    'Nº Fábrica', 'Nº Chasis', 'Modelo/Versión', 'Color',
+    'Fecha Finanzas', 'Despacho Estimado', 'Entrega Estimada',
+    'Fecha Recepción', 'Ubicación', 'Días Stock', 'Precio p/ Disponible',
+    'Cód. Cliente', 'Cliente', 'Vendedor', 'Operación'
+]
+
+COLUMNAS_PRECIO = ['Precio p/ Disponible', 'Precio Base', 'Descuento Aplicado (%)']
+
+
+def leer_excel(archivo, **opciones):
+    """Leer un Excel subido desde memoria con el motor más rápido disponible.
+
+    `archivo` es el stream del upload (SpooledTemporaryFile de Werkzeug) o
+    cualquier objeto con read(). Se copia a un BytesIO propio del request, así
+    uploads simultáneos con el mismo nombre no se pisan.
+    """
+    global MOTOR_EXCEL
+
+    contenido = io.BytesIO(archivo.read())
+
+    if MOTOR_EXCEL:
+        try:
+            return pd.read_excel(contenido, engine=MOTOR_EXCEL, **opciones)
+        except ValueError as e:
+            if MOTOR_EXCEL not in str(e):
+                raise
+            # Versión de pandas sin soporte para calamine
+            print(f"⚠️ Motor {MOTOR_EXCEL} no disponible ({e}), usando el motor por defecto")
+            MOTOR_EXCEL = None
+            contenido.seek(0)
+
+    return pd.read_excel(contenido, **opciones)
+
+
+def leer_planilla(archivo):
+    """Leer la planilla de fábrica desde memoria, sin pasar por disco (solo las primeras 17 columnas)"""
+    return leer_excel(archivo, header=None, usecols=lambda columna: columna < COLUMNAS_LEIDAS)
+
+
+def normalizar_planilla(df):
+    """Limpiar la planilla tal como viene de fábrica (leída con header=None).
+
+    Elimina las 8 filas de encabezado y la columna C, descarta filas vacías,
+    ordena por Nº Fábrica, nombra las primeras 15 columnas y calcula
+    Entrega Estimada = Despacho Estimado + 1 mes.
+    """
+    # Paso 1: Eliminar las primeras 8 filas
+    df = df.iloc[8:]
+
+    # Paso 2: Eliminar la columna C (índice 2, ya que comienza en 0)
+    if df.shape[1] > 2:  # Verificar que existe la columna C
+        df = df.drop(df.columns[2], axis=1)
+
+    # Paso 3: Eliminar filas completamente vacías
+    df = df.dropna(how='all')
+
+    # Paso 4: Ordenar por la primera columna (columna A)
+    df = df.sort_values(by=df.columns[0], ascending=True)
+
+    # Resetear el índice
+    df = df.reset_index(drop=True)
+
+    # Asignar nombres a las primeras 15 columnas
+    df = df.rename(columns=dict(zip(df.columns[:15], COLUMNAS_PLANILLA)))
+
+    # Calcular "Entrega Estimada" = "Despacho Estimado" + 1 mes
+    if 'Despacho Estimado' in df.columns:
+        # Convertir a datetime manejando errores y rellenar vacíos con 31/12/2030
+        despacho = pd.to_datetime(df['Despacho Estimado'], errors='coerce')
+        df['Despacho Estimado'] = despacho.fillna(pd.Timestamp('2030-12-31'))
+        df['Entrega Estimada'] = df['Despacho Estimado'] + pd.DateOffset(months=1)
+
+    return df
+
+
+def precios_desde_filas(rows):
+    """Armar el DataFrame de precios a partir de las filas de la tabla precios"""
+    precios = pd.DataFrame(rows, columns=['modelo', 'precio_ars', 'descuento', 'descuento_futuro'])
+    precios[['precio_ars', 'descuento', 'descuento_futuro']] = (
+        precios[['precio_ars', 'descuento', 'descuento_futuro']].astype(float).fillna(0)
+    )
+    return precios
+
+
+def aplicar_precios_planilla(df, precios, hoy=None):
+    """Calcular Precio p/ Disponible, Precio Base y Descuento Aplicado (%) de todas las filas.
+
+    Cruza la planilla con `precios` (modelo, precio_ars, descuento, descuento_futuro)
+    por Modelo/Versión. Las unidades con despacho en un mes FUTURO usan
+    descuento_futuro; el mes actual o anteriores usan el descuento individual.
+    Los modelos vacíos o sin precio quedan en 0. Devuelve un resumen del cruce.
+    """
+    hoy = hoy or datetime.now()
+
+    modelos = df['Modelo/Versión']
+    claves = modelos.astype(str).str.strip().where(modelos.notna())
+    cruce = pd.DataFrame({'modelo': claves.to_numpy()}).merge(
+        precios, on='modelo', how='left', validate='many_to_one'
+    )
+    encontrado = cruce['precio_ars'].notna().to_numpy()
+
+    precio_base = cruce['precio_ars'].fillna(0).to_numpy(dtype=float)
+    descuento = cruce['descuento'].fillna(0).to_numpy(dtype=float)
+    descuento_futuro = cruce['descuento_futuro'].fillna(0).to_numpy(dtype=float)
+
+    # Mes de despacho posterior al actual (NaT nunca es futuro)
+    if 'Despacho Estimado' in df.columns:
+        despacho = pd.to_datetime(df['Despacho Estimado'], errors='coerce')
+        despacho_ym = (despacho.dt.year * 12 + despacho.dt.month).to_numpy(dtype=float)
+        futuro = despacho_ym > hoy.year * 12 + hoy.month
+    else:
+        futuro = np.zeros(len(df), dtype=bool)
+
+    descuento_aplicar = np.where(futuro, descuento_futuro, descuento)
+    precio_final = precio_base * (1 - descuento_aplicar / 100)
+
+    df['Precio p/ Disponible'] = precio_final
+    df['Precio Base'] = precio_base
+    df['Descuento Aplicado (%)'] = descuento_aplicar
+
+    sin_precio = claves[~encontrado & claves.notna().to_numpy()]
+    return {
+        'filas': len(df),
+        'con_precio': int((precio_final > 0).sum()),
+        'con_descuento_futuro': int((futuro & encontrado).sum()),
+        'modelos_vacios': int(claves.isna().sum()),
+        'modelos_sin_precio': sorted(sin_precio.unique().tolist()),
+    }
@@ -0,0 +1,34 @@
+"""
+Recalcular los precios materializados de la tabla disponibles.
+Ejecutar una vez por día (por ejemplo con cron a las 00:05) para aplicar el
+descuento por antigüedad; el resto de los cambios se recalculan al guardar.
+"""
+from datetime import datetime
+from db_config import db_connection, init_connection_pool
+from descuentos import recalcular_precios_disponibles
+
+def recalcular():
+    try:
+        init_connection_pool()
+    except Exception as e:
+        print(f"❌ Error al inicializar pool: {e}")
+        return False
+    
+    with db_connection('recalcular_precios') as conn:
+        cursor = conn.cursor()
+        try:
+            # Mismo bloqueo que GET /api/disponibles: mientras tanto los pedidos no reescriben la tabla
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('recalcular_precios_disponibles'))")
+            inicio = datetime.now()
+            total = recalcular_precios_disponibles(cursor, ahora=inicio)
+            conn.commit()
+            segundos = (datetime.now() - inicio).total_seconds()
+            print(f"✅ Precios recalculados: {total} unidades en {segundos:.2f}s")
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Error recalculando precios: {e}")
+            return False
+
+if __name__ == '__main__':
+    recalcular()
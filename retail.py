@@ -0,0 +1,231 @@
+"""
+Ventas retail desde 'Retail y Plan de Negocio/Retail y Plan de Negocio.csv'
+El CSV se parsea y enriquece (familia, tipo de venta, fecha) una sola vez por versión del archivo
+y se reutiliza desde la caché columnar, junto con las ventas acumuladas por día de cada año,
+familia y tipo de venta. Si al archivo solo se le agregaron filas, se procesan solo esas
+"""
+
+import hashlib
+import io
+import os
+from datetime import date
+import numpy as np
+import pandas as pd
+
+import cache_columnar
+from familias import FAMILIAS_RETAIL
+
+RUTA_RETAIL = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'Retail y Plan de Negocio', 'Retail y Plan de Negocio.csv'
+)
+
+# Prefijo de la orden -> tipo de venta
+TIPOS_VENTA = {
+    'YAC': 'Convencional',
+    'TPA': 'Plan Ahorro',
+    'F02': 'Vtas Especiales'
+}
+NOMBRES_TIPOS = list(TIPOS_VENTA.values())
+
+# Formato de los arrays en la caché columnar (2: con acumulados diarios)
+FORMATO_CACHE = 2
+
+# Promedios mensuales de patentamiento histórico (% del año) y días por mes
+DATOS_MENSUALES = {
+    1: {'porcentaje': 11.54, 'dias': 31},   # Enero
+    2: {'porcentaje': 7.29, 'dias': 28},    # Febrero (ajustar para bisiestos)
+    3: {'porcentaje': 8.37, 'dias': 31},    # Marzo
+    4: {'porcentaje': 7.76, 'dias': 30},    # Abril
+    5: {'porcentaje': 8.37, 'dias': 31},    # Mayo
+    6: {'porcentaje': 9.25, 'dias': 30},    # Junio
+    7: {'porcentaje': 9.25, 'dias': 31},    # Julio
+    8: {'porcentaje': 9.43, 'dias': 31},    # Agosto
+    9: {'porcentaje': 8.65, 'dias': 30},    # Septiembre
+    10: {'porcentaje': 8.80, 'dias': 31},   # Octubre
+    11: {'porcentaje': 7.79, 'dias': 30},   # Noviembre
+    12: {'porcentaje': 3.99, 'dias': 31}    # Diciembre
+}
+
+
+def extract_family(modelo):
+    """Extract vehicle family from model name"""
+    return FAMILIAS_RETAIL.clasificar(modelo)
+
+
+def porcentaje_esperado(mes, dia):
+    """Porcentaje del plan anual que debería estar cumplido al `dia` del `mes`"""
+    # Acumular meses completos anteriores
+    porcentaje = sum(DATOS_MENSUALES[m]['porcentaje'] for m in range(1, mes))
+    # Agregar los días transcurridos del mes actual
+    return porcentaje + DATOS_MENSUALES[mes]['porcentaje'] / DATOS_MENSUALES[mes]['dias'] * dia
+
+
+def leer_retail_csv(datos):
+    """Leer el CSV de retail (bytes) probando distintos encodings; devuelve (df, encoding)"""
+    for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
+        try:
+            return pd.read_csv(io.BytesIO(datos), sep=';', encoding=encoding), encoding
+        except Exception:
+            continue
+    raise Exception('No se pudo leer el archivo CSV')
+
+
+def _enriquecer(df):
+    """Familia (una vez por modelo distinto), tipo de venta ('' si la orden no tiene prefijo conocido) y fecha"""
+    familias = FAMILIAS_RETAIL.clasificar_serie(df['Modelo / Versión'])
+    tipos = df['Orden'].str[:3].map(TIPOS_VENTA).fillna('')
+
+    if 'Fecha' in df.columns:
+        fechas = pd.to_datetime(df['Fecha'], format='%d/%m/%Y', errors='coerce')
+    else:
+        fechas = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+
+    return {
+        'familia': familias.astype(str),
+        'tipo_venta': tipos.to_numpy(dtype=str),
+        'fecha': fechas.to_numpy(dtype='datetime64[D]'),
+    }
+
+
+def _conteos_por_dia(ventas, anios, familias):
+    """Ventas por (año, familia, tipo de venta, día del año - 1), contando solo tipos conocidos y fechas válidas"""
+    conteos = np.zeros((len(anios), len(familias), len(NOMBRES_TIPOS), 366), dtype=np.int32)
+    fechas = ventas['fecha']
+    validas = (ventas['tipo_venta'] != '') & ~np.isnat(fechas)
+    if validas.any():
+        fechas = fechas[validas]
+        inicio_anio = fechas.astype('datetime64[Y]')
+        np.add.at(conteos, (
+            np.searchsorted(anios, inicio_anio.astype(int) + 1970),
+            np.searchsorted(familias, ventas['familia'][validas]),
+            pd.Index(NOMBRES_TIPOS).get_indexer(ventas['tipo_venta'][validas]),
+            (fechas - inicio_anio.astype('datetime64[D]')).astype(int),
+        ), 1)
+    return conteos
+
+
+def _claves_agregado(ventas):
+    validas = (ventas['tipo_venta'] != '') & ~np.isnat(ventas['fecha'])
+    anios = np.unique(ventas['fecha'][validas].astype('datetime64[Y]').astype(int) + 1970)
+    return anios, np.unique(ventas['familia'][validas])
+
+
+def parsear_retail(csv_path):
+    """CSV de retail -> ventas enriquecidas y acumulado diario por año, familia y tipo de venta.
+
+    Sin columna Fecha, `tiene_fecha` es False y las ventas no se filtran por año.
+    También guarda cuántos bytes se leyeron y su hash, para reconocer después
+    un archivo al que solo se le agregaron filas.
+    """
+    with open(csv_path, 'rb') as f:
+        datos = f.read()
+    df, encoding = leer_retail_csv(datos)
+    ventas = _enriquecer(df)
+
+    anios, familias = _claves_agregado(ventas)
+    return {
+        **ventas,
+        'tiene_fecha': np.array('Fecha' in df.columns),
+        'acum_anios': anios,
+        'acum_familias': familias,
+        'acumulado': _conteos_por_dia(ventas, anios, familias).cumsum(axis=3, dtype=np.int32),
+        'encoding': np.array(encoding),
+        'bytes_leidos': np.array(len(datos), dtype=np.int64),
+        'hash_leido': np.array(hashlib.sha1(datos).hexdigest()),
+    }
+
+
+def actualizar_retail(csv_path, anteriores):
+    """Procesar solo las filas agregadas al final del CSV desde la versión anterior.
+
+    Devuelve None (reconstruir todo) si el archivo no es la versión anterior
+    más filas al final: cambió el contenido ya leído, se achicó o no hay fechas.
+    """
+    leidos = int(anteriores['bytes_leidos'])
+    with open(csv_path, 'rb') as f:
+        previo = f.read(leidos)
+        agregado = f.read()
+    if (not agregado or not previo.endswith(b'\n') or not bool(anteriores['tiene_fecha'])
+            or hashlib.sha1(previo).hexdigest() != str(anteriores['hash_leido'])):
+        return None
+
+    # Las filas nuevas se leen con el encabezado original
+    encabezado = previo.split(b'\n', 1)[0] + b'\n'
+    try:
+        df = pd.read_csv(io.BytesIO(encabezado + agregado), sep=';', encoding=str(anteriores['encoding']))
+    except Exception:
+        return None
+    nuevas = _enriquecer(df)
+    print(f"➕ Retail: {len(df)} filas nuevas")
+
+    ventas = {nombre: np.concatenate([anteriores[nombre], nuevas[nombre]]) for nombre in nuevas}
+
+    # Acumulados: los anteriores reubicados en los ejes ampliados más los de las filas nuevas
+    anios, familias = _claves_agregado(ventas)
+    acumulado = np.zeros((len(anios), len(familias), len(NOMBRES_TIPOS), 366), dtype=np.int32)
+    acumulado[np.ix_(np.searchsorted(anios, anteriores['acum_anios']),
+                     np.searchsorted(familias, anteriores['acum_familias']))] = anteriores['acumulado']
+    acumulado += _conteos_por_dia(nuevas, anios, familias).cumsum(axis=3, dtype=np.int32)
+
+    return {
+        **ventas,
+        'tiene_fecha': anteriores['tiene_fecha'],
+        'acum_anios': anios,
+        'acum_familias': familias,
+        'acumulado': acumulado,
+        'encoding': anteriores['encoding'],
+        'bytes_leidos': np.array(leidos + len(agregado), dtype=np.int64),
+        'hash_leido': np.array(hashlib.sha1(previo + agregado).hexdigest()),
+    }
+
+
+def cargar_retail(csv_path=RUTA_RETAIL):
+    """Ventas enriquecidas y acumulados (desde la caché si el CSV no cambió)"""
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"Archivo no encontrado: {csv_path}")
+    return cache_columnar.cargar(csv_path, parsear_retail, actualizar_retail, formato=FORMATO_CACHE)
+
+
+def dia_del_anio(anio, mes, dia):
+    """Día del año (1-366) de la fecha; el 29/02 en un año no bisiesto cuenta como 28/02"""
+    try:
+        return date(anio, mes, dia).timetuple().tm_yday
+    except ValueError:
+        return date(anio, mes, dia - 1).timetuple().tm_yday
+
+
+def ventas_por_familia(anio, hasta_dia=366, csv_path=RUTA_RETAIL):
+    """Ventas del año hasta el día `hasta_dia` (1-366) por familia (filas) y tipo de venta (columnas).
+
+    Sale de los acumulados: no recorre las ventas. Solo incluye familias y
+    tipos con alguna venta, como un groupby sobre las filas.
+    """
+    ventas = cargar_retail(csv_path)
+    if not bool(ventas['tiene_fecha']):
+        # Sin fechas no hay año: todas las ventas
+        df = pd.DataFrame({'Familia': ventas['familia'], 'Tipo_Venta': ventas['tipo_venta']})
+        return df[df['Tipo_Venta'] != ''].groupby(['Familia', 'Tipo_Venta']).size().unstack(fill_value=0)
+
+    anios = ventas['acum_anios']
+    posicion = np.searchsorted(anios, anio)
+    if posicion == len(anios) or anios[posicion] != anio:
+        return pd.DataFrame()
+
+    conteos = ventas['acumulado'][posicion, :, :, max(1, min(hasta_dia, 366)) - 1]
+    tabla = pd.DataFrame(conteos.astype(np.int64), index=ventas['acum_familias'], columns=NOMBRES_TIPOS)
+    tabla = tabla.loc[tabla.sum(axis=1) > 0, tabla.sum(axis=0) > 0]
+    tabla = tabla[sorted(tabla.columns)]
+    tabla.index.name = 'Familia'
+    tabla.columns.name = 'Tipo_Venta'
+    return tabla
+
+
+def ventas_acumuladas_por_dia(anio, csv_path=RUTA_RETAIL):
+    """Ventas acumuladas del año por tipo de venta (todas las familias): {tipo: array de 366 días}"""
+    ventas = cargar_retail(csv_path)
+    anios = ventas['acum_anios']
+    posicion = np.searchsorted(anios, anio)
+    if not bool(ventas['tiene_fecha']) or posicion == len(anios) or anios[posicion] != anio:
+        return {tipo: np.zeros(366, dtype=np.int64) for tipo in NOMBRES_TIPOS}
+    totales = ventas['acumulado'][posicion].sum(axis=0, dtype=np.int64)
+    return {tipo: totales[i] for i, tipo in enumerate(NOMBRES_TIPOS)}
@@ -0,0 +1,174 @@
+"""
+Serialización JSON de la aplicación
+Provider de Flask basado en orjson y respuestas en streaming para endpoints con muchas filas
+"""
+
+import json
+import math
+from datetime import date
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+# orjson es opcional: sin él se usa el módulo json estándar con las mismas conversiones
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # numpy nativo (NaN -> null) y fechas por json_default para conservar el formato de jsonify
+    OPCIONES_ORJSON = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+FILAS_POR_BLOQUE = 1000
+BYTES_POR_ENVIO = 64 * 1024
+
+
+class Filas:
+    """Marca un iterable de filas para serializarlo de a bloques (se consume una sola vez)"""
+
+    def __init__(self, filas):
+        self.filas = filas
+
+
+def json_default(obj):
+    """Tipos que json no serializa solo: fechas como jsonify (formato HTTP), numpy y Decimal"""
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return None if math.isnan(obj) else float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class JSONProviderRapido(DefaultJSONProvider):
+    """Provider de app.json: orjson si está instalado, json estándar si no.
+
+    En ambos casos serializa datetime/date/Timestamp en el formato HTTP de
+    jsonify, NaT como null, Decimal como texto y escalares/arrays de numpy.
+    """
+
+    default = staticmethod(json_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        opciones = OPCIONES_ORJSON
+        if kwargs.get('sort_keys', self.sort_keys):
+            opciones |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            opciones |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=json_default, option=opciones).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        opciones = OPCIONES_ORJSON | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            opciones |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, default=json_default, option=opciones) + b'\n',
+            mimetype=self.mimetype
+        )
+
+
+def _dumps(valor):
+    if orjson is not None:
+        return orjson.dumps(valor, default=json_default, option=OPCIONES_ORJSON).decode()
+    return json.dumps(valor, default=json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def filas_dataframe(df, bloque=FILAS_POR_BLOQUE):
+    """Filas de un DataFrame como listas (NaN/NaT salen como null), de a un bloque por vez"""
+    for inicio in range(0, len(df), bloque):
+        parte = df.iloc[inicio:inicio + bloque].astype(object)
+        if orjson is None:
+            # json estándar escribiría NaN, que no es JSON válido
+            parte = parte.where(parte.notna(), None)
+        yield from parte.to_numpy().tolist()
+
+
+def materializar(valor):
+    """Copia de `valor` con los Filas convertidos en listas (para guardarlo o serializarlo más de una vez)"""
+    if isinstance(valor, Filas):
+        return list(valor.filas)
+    if isinstance(valor, dict):
+        return {clave: materializar(item) for clave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [materializar(item) for item in valor]
+    return valor
+
+
+def _iterar(valor):
+    """Fragmentos de texto JSON de `valor`; los Filas se serializan de a FILAS_POR_BLOQUE"""
+    if isinstance(valor, Filas):
+        yield '['
+        bloque = []
+        separador = ''
+        for fila in valor.filas:
+            bloque.append(fila)
+            if len(bloque) == FILAS_POR_BLOQUE:
+                yield separador + _dumps(bloque)[1:-1]
+                separador = ','
+                bloque = []
+        if bloque:
+            yield separador + _dumps(bloque)[1:-1]
+        yield ']'
+    elif isinstance(valor, dict):
+        yield '{'
+        for i, (clave, item) in enumerate(valor.items()):
+            yield (',' if i else '') + _dumps(str(clave)) + ':'
+            yield from _iterar(item)
+        yield '}'
+    elif isinstance(valor, (list, tuple)):
+        yield '['
+        for i, item in enumerate(valor):
+            if i:
+                yield ','
+            yield from _iterar(item)
+        yield ']'
+    else:
+        yield _dumps(valor)
+
+
+def _agrupar(fragmentos, tamano=BYTES_POR_ENVIO):
+    """Juntar fragmentos chicos para no enviar la respuesta de a pocos bytes"""
+    buffer = []
+    acumulado = 0
+    for fragmento in fragmentos:
+        buffer.append(fragmento)
+        acumulado += len(fragmento)
+        if acumulado >= tamano:
+            yield ''.join(buffer)
+            buffer = []
+            acumulado = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def respuesta_json_stream(valor, status=200):
+    """Response que envía `valor` como JSON a medida que se serializa.
+
+    Los Filas dentro de `valor` se consumen recién al enviar la respuesta (con el
+    contexto del request todavía activo). El status ya está enviado para entonces,
+    así que los errores deben detectarse antes de devolverla.
+    """
+    return Response(stream_with_context(_agrupar(_iterar(valor))), status=status, mimetype='application/json')
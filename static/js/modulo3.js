@@ -6,6 +6,50 @@ const resultContainer = document.getElementById('resultContainer');
 const successAlert = document.getElementById('successAlert');
 const errorAlert = document.getElementById('errorAlert');
 const errorMessage = document.getElementById('errorMessage');
+const loadingProgress = document.getElementById('loadingProgress');
+
+// Procesos largos: con ?async=true el backend responde 202 con el id de la tarea
+// y se consulta su progreso hasta que el resultado está listo
+function esperarTarea(response, alAvanzar) {
+    return response.json().then(data => {
+        if (response.status !== 202) {
+            if (!response.ok) {
+                throw new Error(data.error || 'Error al procesar');
+            }
+            return data;
+        }
+        
+        return new Promise((resolve, reject) => {
+            const consultar = () => {
+                fetch(data.estado_url)
+                    .then(r => r.json().then(estado => {
+                        if (!r.ok) {
+                            throw new Error(estado.error || 'Tarea no encontrada');
+                        }
+                        if (alAvanzar) {
+                            alAvanzar(estado.progreso, estado.mensaje);
+                        }
+                        if (estado.estado === 'error') {
+                            throw new Error(estado.error || 'Error al procesar');
+                        }
+                        if (estado.estado === 'completada') {
+                            return fetch(data.resultado_url).then(res => res.json()).then(resolve);
+                        }
+                        setTimeout(consultar, 1000);
+                    }))
+                    .catch(reject);
+            };
+            consultar();
+        });
+    });
+}
+
+// Sin argumentos limpia el texto de progreso
+function mostrarProgreso(progreso, mensaje) {
+    if (loadingProgress) {
+        loadingProgress.textContent = progreso === undefined ? '' : `${mensaje || 'Procesando'}... ${progreso}%`;
+    }
+}
 
 // Función simple para manejar pestañas (sin Bootstrap)
 function initTabs() {
@@ -89,20 +133,15 @@ function handleFile(file) {
     
     console.log('Enviando archivo para procesamiento...');
     
-    fetch('/procesar_excel', {
+    // En segundo plano: planillas grandes no quedan atadas al timeout del proxy
+    fetch('/procesar_excel?async=true', {
         method: 'POST',
         body: formData
     })
-    .then(response => {
-        if (!response.ok) {
-            return response.json().then(data => {
-                throw new Error(data.error || 'Error al procesar el archivo');
-            });
-        }
-        return response.json();
-    })
+    .then(response => esperarTarea(response, mostrarProgreso))
     .then(data => {
         loadingSpinner.classList.remove('show');
+        mostrarProgreso();
         
         if (data.success) {
             // Guardar datos originales para filtrado
@@ -125,6 +164,7 @@ function handleFile(file) {
     })
     .catch(error => {
         loadingSpinner.classList.remove('show');
+        mostrarProgreso();
         showError(error.message);
     });
 }
@@ -169,6 +209,10 @@ function displayResults(data) {
             <button class="btn btn-success" id="convertirDisponible" onclick="convertirADisponible()">
                 <i class="fas fa-check-circle"></i> Convertir a Disponible
             </button>
+            <div class="form-check form-check-inline ms-2">
+                <input class="form-check-input" type="checkbox" id="convertirIncremental">
+                <label class="form-check-label" for="convertirIncremental">Solo diferencias</label>
+            </div>
         </div>
     `;
     
@@ -745,10 +789,16 @@ function convertirADisponible() {
         };
     });
     
+    // Por defecto se reemplaza todo; con "Solo diferencias" se escriben solo las unidades nuevas, modificadas o eliminadas
+    const checkIncremental = document.getElementById('convertirIncremental');
+    const incremental = checkIncremental !== null && checkIncremental.checked;
+    
     // Confirmar con el usuario
     const confirmar = confirm(
         `¿Deseas convertir ${disponibles.length} vehículo(s) de Ventas Convencionales con cliente vacío al módulo Disponible?\n\n` +
-        `Esta acción reemplazará todos los datos actuales en el módulo Disponible.`
+        (incremental
+            ? `Solo se aplicarán las diferencias con los datos actuales del módulo Disponible.`
+            : `Esta acción reemplazará todos los datos actuales en el módulo Disponible.`)
     );
     
     if (!confirmar) {
@@ -762,21 +812,26 @@ function convertirADisponible() {
     btnConvertir.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Convirtiendo...';
     
     // Enviar datos al backend
-    fetch('/api/disponibles', {
+    fetch(incremental ? '/api/disponibles?modo=incremental&async=true' : '/api/disponibles?async=true', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
         body: JSON.stringify(disponibles)
     })
-    .then(response => response.json())
+    .then(response => esperarTarea(response, (progreso) => {
+        btnConvertir.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Convirtiendo... ${progreso}%`;
+    }))
     .then(data => {
         btnConvertir.disabled = false;
         btnConvertir.innerHTML = textoOriginal;
         
         if (data.success) {
             // Mostrar mensaje de éxito
-            const mensaje = `✅ ${disponibles.length} vehículo(s) convertido(s) exitosamente al módulo Disponible.`;
+            let mensaje = `✅ ${disponibles.length} vehículo(s) convertido(s) exitosamente al módulo Disponible.`;
+            if (data.insertados !== undefined) {
+                mensaje += ` Nuevos: ${data.insertados}, modificados: ${data.actualizados}, eliminados: ${data.eliminados}, sin cambios: ${data.sin_cambios}.`;
+            }
             showSuccessMessage(mensaje);
             
             // Preguntar si desea ir al módulo 4
@@ -0,0 +1,115 @@
+"""
+Tareas en segundo plano para procesos largos (uploads de Excel, carga de BI, disponibles)
+Se ejecutan en threads del proceso que recibió el pedido; estado, progreso y resultado viven en la
+caché compartida, así cualquier worker puede responder el polling del frontend
+"""
+
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+from cache_compartido import CacheCompartida
+from serializacion import materializar
+
+PENDIENTE = 'pendiente'
+EN_PROCESO = 'en_proceso'
+COMPLETADA = 'completada'
+ERROR = 'error'
+
+
+def sin_avance(porcentaje, mensaje=None):
+    """Callback de progreso para cuando la función corre dentro del request"""
+
+
+class ColaTareas:
+    """Cola de tareas con id, estado/progreso consultable y resultado.
+
+    `contexto` es una fábrica de context managers que envuelve cada tarea
+    (por ejemplo app.app_context, para que la tarea tenga su conexión del pool).
+    Las funciones encoladas reciben como primer argumento `avance(porcentaje, mensaje)`.
+    Estado y resultado vencen `ttl` segundos después de su última actualización;
+    cada tarea nueva borra del disco las vencidas.
+    """
+
+    def __init__(self, espacio='tareas', ttl=3600, max_workers=None, contexto=None):
+        # Sin copia en memoria: el estado cambia y lo pueden leer otros workers
+        self.cache = CacheCompartida(espacio, ttl=ttl, max_en_memoria=0)
+        self.max_workers = max_workers or int(os.environ.get('TAREAS_WORKERS', 2))
+        self.contexto = contexto or nullcontext
+        self._ejecutor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._ejecutor is None:
+                self._ejecutor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tarea')
+            return self._ejecutor
+
+    def encolar(self, tipo, funcion, *args, usuario=None, **kwargs):
+        """Encolar `funcion(avance, *args, **kwargs)` y devolver el id de la tarea"""
+        self.limpiar_vencidas()
+        tarea_id = uuid.uuid4().hex
+        ahora = datetime.now().isoformat(timespec='seconds')
+        self._guardar_estado(tarea_id, {
+            'id': tarea_id,
+            'tipo': tipo,
+            'usuario': usuario,
+            'estado': PENDIENTE,
+            'progreso': 0,
+            'mensaje': 'En cola',
+            'error': None,
+            'creada': ahora,
+            'actualizada': ahora,
+        })
+        self._pool().submit(self._ejecutar, tarea_id, funcion, args, kwargs)
+        print(f"🕒 Tarea {tipo} encolada: {tarea_id}")
+        return tarea_id
+
+    def estado(self, tarea_id):
+        """Estado actual de la tarea o None si no existe (o ya venció)"""
+        return self.cache.obtener(f'estado:{tarea_id}')
+
+    def resultado(self, tarea_id):
+        return self.cache.obtener(f'resultado:{tarea_id}')
+
+    def limpiar_vencidas(self):
+        """Borrar estado y resultado de las tareas vencidas (terminadas o abandonadas hace más de `ttl`)"""
+        try:
+            return self.cache.podar()
+        except OSError as e:
+            print(f"⚠️ No se pudieron borrar las tareas vencidas: {e}")
+            return 0
+
+    def _guardar_estado(self, tarea_id, estado):
+        self.cache.guardar(f'estado:{tarea_id}', estado)
+
+    def _actualizar(self, tarea_id, **cambios):
+        estado = self.estado(tarea_id)
+        if estado is None:
+            return
+        estado.update(cambios, actualizada=datetime.now().isoformat(timespec='seconds'))
+        self._guardar_estado(tarea_id, estado)
+
+    def _ejecutar(self, tarea_id, funcion, args, kwargs):
+        def avance(porcentaje, mensaje=None):
+            cambios = {'progreso': max(0, min(99, int(porcentaje)))}
+            if mensaje:
+                cambios['mensaje'] = mensaje
+            self._actualizar(tarea_id, **cambios)
+
+        self._actualizar(tarea_id, estado=EN_PROCESO, mensaje='Procesando')
+        try:
+            with self.contexto():
+                resultado = funcion(avance, *args, **kwargs)
+            # El resultado se guarda antes de marcarla completada: quien vea el estado ya lo puede pedir
+            self.cache.guardar(f'resultado:{tarea_id}', materializar(resultado))
+            self._actualizar(tarea_id, estado=COMPLETADA, progreso=100, mensaje='Completada')
+            print(f"✅ Tarea {tarea_id} completada")
+        except Exception as e:
+            traceback.print_exc()
+            self._actualizar(tarea_id, estado=ERROR, mensaje='Error', error=str(e))
+            print(f"❌ Tarea {tarea_id} con error: {e}")
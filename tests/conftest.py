@@ -0,0 +1,33 @@
+"""
+Configuración común de los tests: la app se importa sin base de datos y con
+la caché compartida en un directorio temporal propio
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+DIRECTORIO_CACHE = tempfile.mkdtemp(prefix='planeamiento_tests_')
+os.environ['CACHE_COMPARTIDO_DIR'] = os.path.join(DIRECTORIO_CACHE, 'compartido')
+os.environ.setdefault('DATABASE_URL', '')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app_modulo():
+    import app as modulo
+    return modulo
+
+
+@pytest.fixture
+def cliente(app_modulo):
+    """Cliente de pruebas con un usuario admin logueado (sin consultar la base)"""
+    from auth import User
+    app_modulo.app.login_manager._user_callback = lambda user_id: User(1, 'tests', 'admin')
+    cliente = app_modulo.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['_user_id'] = '1'
+    return cliente
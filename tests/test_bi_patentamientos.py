@@ -0,0 +1,28 @@
+"""Tests de /api/bi/patentamientos y /api/bi/load_status sobre los CSV de Patentamientos/"""
+
+
+def test_load_status_cuenta_la_cache_top5(app_modulo, cliente):
+    app_modulo.patentamientos_cache.invalidar()
+    assert cliente.get('/api/bi/load_status').get_json()['cache_activo'] is False
+
+    # La página de patentamientos carga top=5: con eso la caché ya está activa
+    assert cliente.get('/api/bi/patentamientos?top=5').get_json()['from_cache'] is False
+    assert cliente.get('/api/bi/patentamientos?top=5').get_json()['from_cache'] is True
+    assert cliente.get('/api/bi/load_status').get_json()['cache_activo'] is True
+
+
+def test_rango_con_mes_invalido_devuelve_400(cliente):
+    for parametros in ('desde=2024-13', 'hasta=2024-00', 'desde=13/24'):
+        respuesta = cliente.get(f'/api/bi/patentamientos?{parametros}')
+        assert respuesta.status_code == 400
+        assert respuesta.get_json()['success'] is False
+
+
+def test_normalizar_mes():
+    import pytest
+    from patentamientos import normalizar_mes
+
+    assert normalizar_mes('2024-03') == '2024-03'
+    assert normalizar_mes('03/24') == '2024-03'
+    with pytest.raises(ValueError):
+        normalizar_mes('2024-13')
@@ -0,0 +1,20 @@
+"""Tests del parseo de encabezados de las planillas de BI (carga_bi.py)"""
+
+from datetime import date, datetime
+
+from carga_bi import parsear_fecha_columna
+
+
+def test_encabezados_de_mes_reconocidos():
+    assert parsear_fecha_columna('enero-15') == date(2015, 1, 1)
+    assert parsear_fecha_columna('Ene-2024') == date(2024, 1, 1)
+    assert parsear_fecha_columna('dic-24') == date(2024, 12, 1)
+    assert parsear_fecha_columna('03/24') == date(2024, 3, 1)
+    assert parsear_fecha_columna(datetime(2024, 3, 15)) == date(2024, 3, 1)
+
+
+def test_mes_desconocido_no_se_adivina():
+    # Con '-' el mes tiene que estar en MESES_ES: no se pasa al parser de texto libre
+    assert parsear_fecha_columna('foo-24') is None
+    assert parsear_fecha_columna('sept-24') is None
+    assert parsear_fecha_columna('Nombre') is None